@@ -4,7 +4,7 @@
 from lexer import Token
 from abc import ABC, abstractmethod
 from collections import OrderedDict
-from typing import List, Union, Optional
+from typing import Callable, List, Union, Optional, Tuple
 
 
 PRIMITIVE_TYPES = OrderedDict([
@@ -153,12 +153,26 @@ class NumericLiteralAST(TokenAST):
 
 
 class IdAST(TokenAST):
-    """ An identifier (can be a variable or function name)
+    """ An identifier (can be a variable or function name). Once bound (see binder.bind()), decl is the
+    IdAST declaring it (itself, for declarations) and address is its (scope depth, slot) pair, or both None
+    if unresolved
     """
+    def __init__(self, token: Token):
+        super().__init__(token)
+        # Set here, so that instances keep their attributes inline (binding them would allocate a dict for each)
+        self.decl: Optional[IdAST] = None
+        self.address: Optional[Tuple[int, int]] = None
+
     @property
     def var_name(self) -> str:
         return self.token.value
 
+    @property
+    def name_id(self) -> Optional[int]:
+        """ Id of the name in the string table of the compilation
+        """
+        return self.token.name_id
+
     def emit(self) -> str:
         return self.var_name
 
@@ -181,6 +195,16 @@ class SentenceAST(AST, ABC):
     pass
 
 
+class ErrorAST(SentenceAST):
+    """ A sentence with syntax errors, skipped by the parser on error recovery
+    """
+    def __init__(self, token: Token):
+        self.token = token  # First token of the sentence
+
+    def emit(self) -> str:
+        return '/* syntax error at line {} */'.format(self.token.line)
+
+
 class ExpressionAST(AST, ABC):
     pass
 
@@ -246,6 +270,8 @@ class VarDeclAST(SentenceAST):
 
 
 class BlockAST(SentenceAST):
+    slots: int = 0  # Number of variables and functions declared in its scope, once bound (see binder.bind())
+
     def __init__(self, sentences: List[SentenceAST]):
         self.sentences = sentences
 
@@ -262,16 +288,36 @@ class ParamListAST(AST):
 
 
 class FunctionDeclAST(AST):
-    def __init__(self, func: IdAST, paramlist: ParamListAST, type_: TypeAST, body: BlockAST):
+    """ A function declaration. Its body can be given as a function parsing it,
+    which will be called on first access, or None if not available (i.e. when declared
+    from an interface).
+    """
+    slots: int = 0  # Number of names declared in its scope (parameters and the body ones), once bound
+
+    def __init__(self, func: IdAST, paramlist: ParamListAST, type_: TypeAST,
+                 body: Union[BlockAST, Callable[[], Optional[BlockAST]]]):
         self.func = func
         self.parameters = paramlist
         self.type_ = type_
-        self.body = body
+        self._body = body
 
     @property
     def name(self) -> str:
         return self.func.var_name
 
+    @property
+    def body(self) -> Optional[BlockAST]:
+        """ The body block (None if it could not be parsed)
+        """
+        if not self.body_parsed:
+            self._body = self._body()
+
+        return self._body
+
+    @property
+    def body_parsed(self) -> bool:
+        return not callable(self._body)
+
     def emit(self) -> str:
         return '{} {}{} {}'.format(self.type_.emit(), self.name, self.parameters.emit(), self.body.emit())
 
@@ -0,0 +1,678 @@
+# -*- coding: utf-8 -*-
+
+# Benchmarks. Run as: python bench.py [BENCHMARK ...] [--size MB]
+
+import argparse
+import io
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from lexer import Lexer, Token, TokenID, TokenStream, LEXER_ENGINES, TOKEN_MAP
+from ast_ import BlockAST, TypeAST
+from parser import Parser
+from interface import Interface
+from main import write_interface
+from string_table import StringTable
+from symbol_table import SymbolTable
+import binder
+import log
+import visitor
+import xref
+
+
+def generate_program(size: int, seed: int = 0) -> str:
+    """ Returns a synthetic (machine generated like) program of at least size chars
+    """
+    chunks = []
+    total = 0
+    i = seed
+
+    while total < size:
+        chunk = """
+// Function number {0}
+fn func_{0}(a: int32, b: int32, s: str): int32 {{
+    var x_{0}: int32;
+    var y_{0}: float;
+    /* Some block comment
+       spanning several lines */
+    x_{0} = (a + {0}) * b ** 2 - a / 3 % 7;
+    y_{0} = 3.1415e-2 * .5 + 1.;
+    s = "a string with \\"quotes\\" inside";
+    while x_{0} >= 10 {{
+        if x_{0} != 0
+            x_{0} = x_{0} - 1;
+        else
+            x_{0} = f(x_{0}, 'c', -{0});
+    }}
+    return x_{0} + b;
+}}
+""".format(i)
+        chunks.append(chunk)
+        total += len(chunk)
+        i += 1
+
+    return ''.join(chunks)
+
+
+def generate_symbols_program(size: int) -> str:
+    """ Returns a program of at least size chars made of functions declaring many local variables
+    """
+    chunks = []
+    total = 0
+    i = 0
+
+    while total < size:
+        lines = ['fn func_{}(a: int32, b: int32): int32 {{'.format(i)]
+        lines.extend('    var v_{}: int32;'.format(k) for k in range(20))
+        lines.extend('    v_{0} = v_{1} + a * b;'.format(k, (k + 1) % 20) for k in range(20))
+        lines.append('    return v_0;\n}\n')
+        chunks.append('\n'.join(lines))
+        total += len(chunks[-1])
+        i += 1
+
+    return ''.join(chunks)
+
+
+def generate_blocks_program(size: int, seed: int = 0) -> str:
+    """ Returns a program of at least size chars made of blocks of declarations and assignments
+    (which the code generator supports), with a bounded set of identifiers
+    """
+    chunks = []
+    total = 0
+    i = seed
+
+    while total < size:
+        chunk = """{{
+    var x: int32;
+    var y: int32;
+    x = (x + {0}) * 2 - y / 3;
+    y = x;
+}}
+""".format(i)
+        chunks.append(chunk)
+        total += len(chunk)
+        i += 1
+
+    return ''.join(chunks)
+
+
+def generate_scopes_program(size: int, depth: int, symbols: int = 4) -> str:
+    """ Returns a program of at least size chars made of functions with depth nested blocks,
+    each one declaring symbols variables and using the ones of the outermost block
+    """
+    chunks = []
+    total = 0
+    i = 0
+
+    while total < size:
+        lines = ['fn func_{}(a: int32): int32 {{'.format(i)]
+        for level in range(depth):
+            lines.append('if a > {} {{'.format(level))
+            lines.extend('var v_{}_{}: int32;'.format(level, k) for k in range(symbols))
+            lines.append('v_{0}_0 = v_0_1 + v_{0}_{1} * a;'.format(level, symbols - 1))
+        lines.append('}' * depth + '\nreturn a;\n}\n')
+        chunks.append('\n'.join(lines))
+        total += len(chunks[-1])
+        i += 1
+
+    return ''.join(chunks)
+
+
+def timeit(func: Callable, *args, **kwargs):
+    """ Returns (seconds, result) of calling func
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def count_tokens(lexer: Lexer) -> int:
+    result = 0
+    while lexer.get_token() != TokenID.EOF:
+        result += 1
+
+    return result
+
+
+def bench_lexer(options):
+    """ Tokens per second of every Lexer engine on a multi-MB input
+    """
+    program = generate_program(options.size << 20)
+    for engine in LEXER_ENGINES:
+        elapsed, tokens = timeit(lambda: count_tokens(Lexer(io.StringIO(program), engine=engine)))
+        print('lexer ({}): {:.2f} MB, {} tokens in {:.3f}s: {:,.0f} tokens/s'.format(
+            engine, len(program) / (1 << 20), tokens, elapsed, tokens / elapsed))
+
+
+def bench_operators(options):
+    """ Tokens per second of every Lexer engine on inputs made of a single operator
+    """
+    operators = sorted((x for x in TOKEN_MAP if not x.isalpha()), key=lambda x: (len(x), x)) + ['/', '/=']
+    for oper in operators:
+        line = 'a {} 1\n'.format(oper)
+        program = line * ((options.size << 20) // 8 // len(line))
+        results = []
+        for engine in LEXER_ENGINES:
+            elapsed, tokens = timeit(lambda: count_tokens(Lexer(io.StringIO(program), engine=engine)))
+            results.append('{}: {:,.0f} tokens/s'.format(engine, tokens / elapsed))
+        print('operators ({}): {}'.format(oper, ', '.join(results)))
+
+
+def traced_peak(func: Callable, *args, **kwargs):
+    """ Returns (peak traced memory in bytes, result) of calling func
+    """
+    tracemalloc.start()
+    try:
+        result = func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1], result
+    finally:
+        tracemalloc.stop()
+
+
+def token_list(lexer: Lexer) -> List[Token]:
+    result = [lexer.get_token()]
+    while result[-1] != TokenID.EOF:
+        result.append(lexer.get_token())
+
+    return result
+
+
+def bench_token_memory(options):
+    """ Peak memory per million tokens of a list of Tokens vs. a TokenStream
+    """
+    program = generate_program(options.size << 20)
+    for name, func in (('list of Token', token_list), ('TokenStream', TokenStream.from_lexer)):
+        peak, tokens = traced_peak(lambda: func(Lexer(io.StringIO(program))))
+        print('token memory ({}): {} tokens, peak {:.1f} MB, {:.1f} MB per million tokens'.format(
+            name, len(tokens), peak / (1 << 20), peak / (1 << 20) * 1e6 / len(tokens)))
+
+
+def bench_interning(options):
+    """ Time, peak memory and string table stats of parsing a symbol heavy program
+    """
+    program = generate_symbols_program(options.size << 20)
+    elapsed, parser_ = timeit(lambda: Parser(io.StringIO(program)))
+    parse_elapsed, ast = timeit(parser_.parse_program)
+    assert ast is not None
+    print('interning: {:.2f} MB parsed in {:.3f}s'.format(len(program) / (1 << 20), elapsed + parse_elapsed))
+
+    parser_ = Parser(io.StringIO(program))
+    peak, _ = traced_peak(parser_.parse_program)
+    print('interning: peak {:.1f} MB, {} symbols'.format(peak / (1 << 20), parser_.symbol_table.symbol_count))
+    print('interning: {}'.format(parser_.string_table.stats()))
+
+
+def bench_scopes(options):
+    """ Parsing programs with blocks nested 10, 100 and 1000 deep, declaring and resolving symbols in them
+    """
+    for depth in (10, 100, 1000):
+        program = generate_scopes_program(options.size << 20, depth)
+        parser_ = Parser(io.StringIO(program))
+        elapsed, ast = timeit(parser_.parse_program)
+        assert ast is not None
+        print('scopes (depth {}): {:.2f} MB, {} symbols in {:.3f}s: {:.2f} MB/s'.format(
+            depth, len(program) / (1 << 20), parser_.symbol_table.symbol_count, elapsed,
+            len(program) / (1 << 20) / elapsed))
+
+
+def walk_resolve(symbol_table: SymbolTable, name_id: int) -> Optional[TypeAST]:
+    """ Resolves the name walking up the scopes, without the resolution cache
+    """
+    scope = symbol_table.scope
+    while scope is not None:
+        result = scope.get(name_id)
+        if result is not None:
+            return result
+        scope = scope.parent
+
+    return None
+
+
+def bench_resolve(options):
+    """ Resolving the variables of a function (and their type) from 10k loop bodies nested 10, 100 and 1000
+    deep in it, 10 times each, with the resolution cache vs. walking up the scopes
+    """
+    for depth in (10, 100, 1000):
+        symbol_table = Parser(io.StringIO('')).symbol_table  # With the primitive types
+        symbol_table.push_scope('f')
+        int32 = symbol_table.resolve_symbol('int32')
+        for name in ('i', 'j', 'n'):
+            symbol_table.declare_symbol(Token(TokenID.ID, 0, name), int32)
+        for level in range(depth):
+            symbol_table.push_scope('L{}'.format(level))
+            symbol_table.declare_symbol(Token(TokenID.ID, 0, 'v'), int32)
+        name_ids = [symbol_table.string_table.find(x) for x in ('i', 'j', 'n', 'int32')] * 10
+
+        def resolve_bodies(resolve: Callable[[int], Optional[TypeAST]]):
+            for body in range(10000):
+                symbol_table.push_scope('B{}'.format(body))
+                for name_id in name_ids:
+                    resolve(name_id)
+                symbol_table.pop_scope()
+
+        walk_elapsed, _ = timeit(resolve_bodies, lambda name_id: walk_resolve(symbol_table, name_id))
+        elapsed, _ = timeit(resolve_bodies, symbol_table.resolve_id)
+        print('resolve (depth {}): {} lookups in {:.3f}s (walking up: {:.3f}s): {:.1f}x'.format(
+            depth, len(name_ids) * 10000, elapsed, walk_elapsed, walk_elapsed / elapsed))
+        print('resolve (depth {}): {}'.format(depth, symbol_table.stats()))
+
+
+class SnapshotParser(Parser):
+    """ Takes a snapshot of the symbol table after every stride variable declarations (or copies
+    the symbols of every scope instead, if copy)
+    """
+    def __init__(self, *args, stride: int = 1, copy: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stride, self.copy = stride, copy
+        self.declarations = 0
+        self.snapshots = []
+
+    def match_var_decl(self):
+        result = super().match_var_decl()
+        self.declarations += 1
+        if not self.declarations % self.stride:
+            if self.copy:
+                self.snapshots.append({x.id_: {**x.symbols, **x.recent} for x in self.symbol_table.scopes()})
+            else:
+                self.snapshots.append(self.symbol_table.snapshot())
+        return result
+
+
+def bench_snapshots(options):
+    """ Memory of 10k snapshots of the symbol table taken while parsing a symbol heavy program,
+    vs. copying its symbols (measured on 100 copies)
+    """
+    program = generate_symbols_program(options.size << 20)
+    stride = -(-program.count('var ') // 10000)  # At most 10k snapshots
+
+    def traced_parse(**kwargs) -> Tuple[int, SnapshotParser]:
+        parser_ = SnapshotParser(io.StringIO(program), **kwargs)
+        tracemalloc.start()
+        try:
+            assert parser_.parse_program() is not None
+            return tracemalloc.get_traced_memory()[0], parser_
+        finally:
+            tracemalloc.stop()
+
+    base, _ = traced_parse(stride=len(program))
+    size, parser_ = traced_parse(stride=stride)
+    snapshots = parser_.snapshots
+    for i, snapshot in enumerate(snapshots):  # Sees the variables of its function declared before it, only
+        parser_.symbol_table.restore(snapshot)
+        declared = (i + 1) * stride % 20 or 20
+        assert parser_.symbol_table.resolve_symbol('v_{}'.format(declared - 1)) is not None
+        assert declared == 20 or parser_.symbol_table.resolve_symbol('v_{}'.format(declared)) is None
+    print('snapshots: {} snapshots of {} symbols (at most) in {:.2f} MB: {:.2f} MB, {:.0f} bytes per snapshot'.format(
+        len(snapshots), parser_.symbol_table.symbol_count, len(program) / (1 << 20), (size - base) / (1 << 20),
+        (size - base) / len(snapshots)))
+
+    size, parser_ = traced_parse(stride=stride * 100, copy=True)
+    print('snapshots: {} copies: {:.2f} MB, {:.0f} bytes per copy'.format(
+        len(parser_.snapshots), (size - base) / (1 << 20), (size - base) / len(parser_.snapshots)))
+
+
+def bench_xref(options):
+    """ Building the cross reference index of a symbol heavy program (100k symbols with the default size),
+    serializing it, and the latency of queries on it, vs. walking the AST to find the references
+    """
+    program = generate_symbols_program(options.size << 20)
+    parser_ = Parser(io.StringIO(program))
+    ast = parser_.parse_program()
+    assert ast is not None
+    elapsed, index = timeit(xref.build_index, ast, parser_.string_table)
+    print('xref: {} symbols, {} uses in {:.2f} MB indexed in {:.3f}s'.format(
+        len(index), len(index.uses), len(program) / (1 << 20), elapsed))
+
+    dumps_elapsed, data = timeit(index.dumps)
+    loads_elapsed, loaded = timeit(xref.XrefIndex.loads, data)
+    assert loaded.positions == index.positions
+    print('xref: serialized to {:.2f} MB ({:.1f} bytes per symbol) in {:.3f}s, loaded in {:.3f}s'.format(
+        len(data) / (1 << 20), len(data) / len(index), dumps_elapsed, loads_elapsed))
+
+    rng = random.Random(0)
+    symbols = [rng.randrange(len(index)) for _ in range(100000)]
+    offsets = [index.positions[rng.randrange(len(index.positions))] for _ in range(100000)]
+    for name, query, args in (('references', index.references, symbols),
+                              ('occurrences', index.occurrences, symbols),
+                              ('symbol_at', index.symbol_at, offsets)):
+        elapsed, _ = timeit(lambda: deque(map(query, args), maxlen=0))  # Not keeping the results
+        print('xref: {} in {:.2f} us'.format(name, elapsed / len(args) * 1e6))
+
+    elapsed, _ = timeit(xref.build_index, ast, parser_.string_table)  # Finds the references of every symbol
+    print('xref: walking the AST (to find the references of a symbol) in {:.3f}s'.format(elapsed))
+
+
+def resolve_by_name(program: BlockAST, string_table: StringTable) -> int:
+    """ A pass finding the declaration of every identifier by name, as passes did before binding them.
+    Returns the number of them resolved
+    """
+    symbol_table = SymbolTable(string_table=string_table)
+    resolved = 0
+    for event, node in binder.walk(program):
+        if event == binder.Event.USE:
+            resolved += symbol_table.resolve_symbol(node.var_name) is not None
+        elif event == binder.Event.ENTER:
+            symbol_table.push_scope(str(id(node)))
+        elif event == binder.Event.EXIT:
+            symbol_table.pop_scope()
+        elif symbol_table.scope.get(symbol_table.name_id(node.token)) is None:
+            symbol_table.declare_symbol(node.token, node)
+
+    return resolved
+
+
+def resolve_bound(program: BlockAST) -> int:
+    """ The same pass on a bound program, accessing the frame slot of every identifier (in a display
+    of the frames of the scopes entered) by its address
+    """
+    display: List[list] = []
+    resolved = 0
+    for event, node in binder.walk(program):
+        if event == binder.Event.USE:
+            if node.address is not None:
+                depth, slot = node.address
+                display[depth][slot] = node
+                resolved += 1
+        elif event == binder.Event.ENTER:
+            display.append([None] * node.slots)
+        elif event == binder.Event.EXIT:
+            display.pop()
+
+    return resolved
+
+
+def bench_binder(options):
+    """ Binding the identifiers of a symbol heavy program, and a pass resolving them by name vs. by address
+    (walking the AST the same way)
+    """
+    program = generate_symbols_program(options.size << 20)
+    parser_ = Parser(io.StringIO(program))
+    ast = parser_.parse_program()
+    assert ast is not None
+    elapsed, bindings = timeit(binder.bind, ast, parser_.string_table)
+    print('binder: {} names, {} uses in {:.2f} MB bound in {:.3f}s'.format(
+        len(bindings), len(bindings.uses), len(program) / (1 << 20), elapsed))
+
+    walk_elapsed, _ = timeit(lambda: sum(1 for _ in binder.walk(ast)))
+    name_elapsed, by_name = timeit(resolve_by_name, ast, parser_.string_table)
+    bound_elapsed, bound = timeit(resolve_bound, ast)
+    assert by_name == bound == len(bindings.uses)
+    print('binder: resolving by name in {:.3f}s, by address in {:.3f}s (walking the AST alone: {:.3f}s): '
+          '{:.1f}x ({:.1f}x without the walk)'.format(name_elapsed, bound_elapsed, walk_elapsed,
+                                                     name_elapsed / bound_elapsed,
+                                                     (name_elapsed - walk_elapsed) / (bound_elapsed - walk_elapsed)))
+
+
+def bench_parallel(options):
+    """ Lexing a multi-MB source into a TokenStream with 1, 2, 4 and 8 worker processes
+    """
+    program = generate_program(options.size << 20)
+    serial = None
+    for workers in (1, 2, 4, 8):
+        elapsed, stream = timeit(TokenStream.from_source, program, workers=workers)
+        serial = serial or (elapsed, stream)
+        assert (stream.ids, stream.starts, stream.ends) == (serial[1].ids, serial[1].starts, serial[1].ends)
+        print('parallel ({} workers): {:.2f} MB, {} tokens in {:.3f}s: {:.2f}x'.format(
+            workers, len(program) / (1 << 20), len(stream), elapsed, serial[0] / elapsed))
+
+
+def bench_expressions(options):
+    """ Parsing expressions of 10k, 100k and 1M terms (which should take linear time)
+    """
+    for oper in ('+', '**'):
+        for terms in (10000, 100000, 1000000):
+            program = ' {} '.format(oper).join(['a'] * terms)
+            parser_ = Parser(io.StringIO(program))
+            elapsed, ast = timeit(parser_.match_binary_or_unary)
+            assert ast is not None and parser_.lookahead == TokenID.EOF
+            print('expressions ({}): {} terms in {:.3f}s: {:,.0f} terms/s'.format(
+                oper, terms, elapsed, terms / elapsed))
+
+
+def bench_reparse(options):
+    """ Reparsing a one line edit of a 50k lines file vs. parsing it again
+    """
+    program = generate_program(1)
+    program = ''.join(generate_program(1, seed=i) for i in range(50000 // program.count('\n')))
+    parser_ = Parser(io.StringIO(program))
+    elapsed, ast = timeit(parser_.parse_program)
+    print('reparse: full parsing of {} lines, {} sentences: {:.3f}s'.format(
+        program.count('\n'), len(ast.sentences), elapsed))
+
+    offset = program.index('x_{0} = (a + {0})'.format(len(ast.sentences) // 2))
+    edits = (('(a + ', '(a - '), (';\n', ';\n    var extra: int32;\n'),
+             ('// Function', 'fn extra(): int32 { return 1; }\n// Function'))
+    for old, new in edits:
+        start = program.index(old, offset)
+        edited = program[:start] + new + program[start + len(old):]
+        elapsed, ast = timeit(parser_.reparse, ast, program, edited)
+        assert ast is not None
+        program = edited
+        offset = start + len(new)
+        print('reparse: replacing {} with {}: {:.4f}s'.format(repr(old), repr(new), elapsed))
+
+
+def signatures(parser_: Parser) -> List[str]:
+    ast = parser_.parse_program()
+    return ['{} {}{}'.format(x.type_.name, x.name, x.parameters.emit()) for x in ast.sentences if hasattr(x, 'func')]
+
+
+def bench_signatures(options):
+    """ Scanning the function signatures of a program, with lazy function bodies vs. a full parse
+    """
+    program = generate_program(options.size << 20)
+    results = {}
+    for lazy_bodies in (False, True):
+        parser_ = Parser(io.StringIO(program), lazy_bodies=lazy_bodies)
+        elapsed, results[lazy_bodies] = timeit(signatures, parser_)
+        print('signatures ({}): {:.2f} MB, {} functions in {:.3f}s: {:.2f} MB/s'.format(
+            'lazy bodies' if lazy_bodies else 'full parse', len(program) / (1 << 20), len(results[lazy_bodies]),
+            elapsed, len(program) / (1 << 20) / elapsed))
+
+    assert results[False] == results[True]
+
+
+def bench_interfaces(options):
+    """ Writing the interface of a big module (parsing it with lazy bodies), and loading it into a symbol
+    table, vs. parsing the module to get its function signatures
+    """
+    program = generate_program(options.size << 20)
+    elapsed, ast = timeit(Parser(io.StringIO(program)).parse_program)
+    assert ast is not None
+    print('interfaces: parsing {:.2f} MB in {:.3f}s'.format(len(program) / (1 << 20), elapsed))
+
+    output = io.StringIO()
+    write_elapsed, written = timeit(write_interface, program, output)
+    assert written
+    data = output.getvalue()
+    print('interfaces: written in {:.3f}s: {:.2f} MB'.format(write_elapsed, len(data) / (1 << 20)))
+
+    parser_ = Parser(io.StringIO(''))  # With the primitive types
+    loads_elapsed, interface = timeit(Interface.loads, data)
+    declare_elapsed, declared = timeit(parser_.declare_interface, interface)
+    assert declared
+    load_elapsed = loads_elapsed + declare_elapsed
+    print('interfaces: {} signatures loaded in {:.3f}s (declared in {:.3f}s): {:.0f}x faster than parsing'.format(
+        len(interface), load_elapsed, declare_elapsed, elapsed / load_elapsed))
+
+
+def bench_literals(options):
+    """ Parsing a program made of numeric literals of every type
+    """
+    line = 'a = 1 + 200 + 70000 + 3000000000 + 5000000000 + 18000000000000000000 + 1.5 + 2;\n'
+    program = 'var a: int32;\n' + line * ((options.size << 20) // len(line))
+    literals = (program.count('\n') - 1) * 8
+    parser_ = Parser(io.StringIO(program))
+    elapsed, ast = timeit(parser_.parse_program)
+    assert ast is not None
+    print('literals: {:.2f} MB, {} literals in {:.3f}s: {:,.0f} literals/s'.format(
+        len(program) / (1 << 20), literals, elapsed, literals / elapsed))
+
+
+def bench_relex(options):
+    """ Re-lexing a one char and a one line edit of a 100k lines file vs. lexing it again
+    """
+    program = generate_program(1)
+    lines = program.count('\n')
+    program = program * (100000 // lines)
+    stream = TokenStream.from_lexer(Lexer(io.StringIO(program)))
+    offset = program.index('x_0 =', len(program) // 2)
+    elapsed, _ = timeit(lambda: TokenStream.from_lexer(Lexer(io.StringIO(program))))
+    print('relex: full lexing of {} lines, {} tokens: {:.3f}s'.format(program.count('\n'), len(stream), elapsed))
+
+    for removed, inserted in ((0, 'y'), (0, 'var z: int32;\n'), (3, '/*'), (0, '/* a */')):
+        elapsed, result = timeit(stream.relex, offset, removed, inserted)
+        print('relex: replacing {} chars with {}: {} tokens scanned in {:.4f}s'.format(
+            removed, repr(inserted), result.relexed_tokens, elapsed))
+
+
+def bench_recovery(options):
+    """ Parsing programs with a syntax error per function, with error recovery
+    (which should take linear time)
+    """
+    output, max_errors = log.OUTPUT, log.MAX_ERRORS_ALLOWED
+    log.OUTPUT, log.MAX_ERRORS_ALLOWED = io.StringIO(), 0
+    try:
+        for size in (options.size << 18, options.size << 19, options.size << 20):
+            program = generate_program(size).replace(' - a / 3', ' - / 3')
+            log.ERROR_COUNT = 0
+            parser_ = Parser(io.StringIO(program), recover=True)
+            elapsed, ast = timeit(parser_.parse_program)
+            assert ast is not None and parser_.lookahead == TokenID.EOF
+            print('recovery: {:.2f} MB, {} errors in {:.3f}s: {:.2f} MB/s'.format(
+                len(program) / (1 << 20), log.ERROR_COUNT, elapsed, len(program) / (1 << 20) / elapsed))
+    finally:
+        log.OUTPUT, log.MAX_ERRORS_ALLOWED, log.ERROR_COUNT = output, max_errors, 0
+
+
+class GeneratedStream(io.TextIOBase):
+    """ A non seekable text stream of (at least) size chars of generated program
+    """
+    def __init__(self, size: int, generate: Callable[[int, int], str] = generate_program):
+        self._remaining = size
+        self._seed = 0
+        self._pending = ''
+        self._generate = generate
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while len(self._pending) < size and self._remaining > 0:
+            chunk = self._generate(1, self._seed)
+            self._seed += 1
+            self._remaining -= len(chunk)
+            self._pending += chunk
+
+        result, self._pending = self._pending[:size], self._pending[size:]
+        return result
+
+
+def max_rss() -> int:
+    """ Peak resident set size of this process in bytes
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss << 10
+
+
+def bench_streaming(options):
+    """ Peak RSS while lexing a generated (non seekable) stream in streaming mode.
+    It should not grow with the input size (i.e. try --size 4096).
+    """
+    size = options.size << 20
+    lexer = Lexer(GeneratedStream(size), streaming=True)
+    start = time.perf_counter()
+    tokens = 0
+    next_report = size // 8
+
+    while lexer.get_token() != TokenID.EOF:
+        tokens += 1
+        if lexer.scanned_chars >= next_report:
+            print('streaming: {:.0f} MB scanned, peak RSS {:.1f} MB'.format(
+                lexer.scanned_chars / (1 << 20), max_rss() / (1 << 20)))
+            next_report += size // 8
+
+    elapsed = time.perf_counter() - start
+    print('streaming: {:.0f} MB, {} tokens in {:.3f}s: {:,.0f} tokens/s, peak RSS {:.1f} MB'.format(
+        size / (1 << 20), tokens, elapsed, tokens / elapsed, max_rss() / (1 << 20)))
+
+
+class NullOutput(io.TextIOBase):
+    """ A text stream discarding whatever is written to it
+    """
+    def writable(self):
+        return True
+
+    def write(self, s):
+        return len(s)
+
+
+def emit_program(parser_: Parser, mode: str):
+    vis = visitor.Visitor(NullOutput())
+    if mode == 'whole program':
+        vis.visit(parser_.parse_program())
+    elif mode == 'iter_program':
+        vis.visit_sentences(parser_.iter_program())
+    else:
+        vis.visit_sentences(parser_.iter_program_threaded())
+
+
+def bench_pipeline(options):
+    """ Peak traced memory and time of emitting C from a streamed program, once parsed whole vs.
+    sentence by sentence, also with parsing and emission in separate threads. Only the whole
+    program one should grow with the input size.
+    """
+    for size in (options.size << 18, options.size << 20):
+        for mode in ('whole program', 'iter_program', 'pipelined'):
+            parser_ = Parser(GeneratedStream(size, generate_blocks_program), streaming=True)
+            elapsed, _ = timeit(emit_program, parser_, mode)
+            parser_ = Parser(GeneratedStream(size, generate_blocks_program), streaming=True)
+            peak, _ = traced_peak(emit_program, parser_, mode)
+            print('pipeline ({}): {:.0f} MB in {:.3f}s, peak {:.1f} MB'.format(
+                mode, size / (1 << 20), elapsed, peak / (1 << 20)))
+
+
+BENCHMARKS: Dict[str, Callable] = {
+    'binder': bench_binder,
+    'expressions': bench_expressions,
+    'interfaces': bench_interfaces,
+    'interning': bench_interning,
+    'lexer': bench_lexer,
+    'literals': bench_literals,
+    'operators': bench_operators,
+    'parallel': bench_parallel,
+    'pipeline': bench_pipeline,
+    'recovery': bench_recovery,
+    'relex': bench_relex,
+    'resolve': bench_resolve,
+    'scopes': bench_scopes,
+    'reparse': bench_reparse,
+    'signatures': bench_signatures,
+    'snapshots': bench_snapshots,
+    'streaming': bench_streaming,
+    'token_memory': bench_token_memory,
+    'xref': bench_xref,
+}
+
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('BENCHMARK', type=str, nargs='*',
+                            help='Benchmarks to run (all by default): {}'.format(', '.join(sorted(BENCHMARKS))))
+    arg_parser.add_argument('--size', type=int, default=4, help='Size (in MB) of the generated input')
+
+    options = arg_parser.parse_args(argv[1:])
+    for name in options.BENCHMARK:
+        if name not in BENCHMARKS:
+            arg_parser.error("unknown benchmark '{}'".format(name))
+
+    for name in options.BENCHMARK or sorted(BENCHMARKS):
+        BENCHMARKS[name](options)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+from enum import IntEnum
+from typing import Iterator, List, Tuple
+
+import ast_
+from string_table import StringTable
+from symbol_table import SymbolTable
+
+
+class SymbolKind(IntEnum):
+    VARIABLE = 0
+    PARAMETER = 1
+    FUNCTION = 2
+
+
+class Event(IntEnum):
+    ENTER = 0  # A scope, owned by the node (a BlockAST or a FunctionDeclAST)
+    EXIT = 1
+    USE = 2  # A name, by the IdAST
+    VARIABLE = 3  # Definitions of a name of each SymbolKind, by the IdAST
+    PARAMETER = 4
+    FUNCTION = 5
+
+
+_KINDS = {Event.VARIABLE: SymbolKind.VARIABLE, Event.PARAMETER: SymbolKind.PARAMETER,
+          Event.FUNCTION: SymbolKind.FUNCTION}
+
+
+def _define_functions(sentences: List[ast_.AST]) -> Iterator[Tuple[Event, ast_.AST]]:
+    for sentence in sentences:
+        if isinstance(sentence, ast_.FunctionDeclAST):
+            yield Event.FUNCTION, sentence.func
+
+
+def walk(program: ast_.BlockAST) -> Iterator[Tuple[Event, ast_.AST]]:
+    """ Walks the program (with an explicit stack, so any nesting depth is fine) yielding the scopes
+    entered and exited, and the names defined and used in them, in source order. Function names are
+    defined at the beginning of their block instead, so they can be called from sentences before them.
+    Function bodies parsed lazily are parsed now.
+    """
+    yield Event.ENTER, program
+    yield from _define_functions(program.sentences)
+    pending: List[object] = [(Event.EXIT, program)]
+    pending.extend(reversed(program.sentences))
+    while pending:
+        node = pending.pop()
+        if isinstance(node, tuple):
+            yield node
+        elif isinstance(node, ast_.IdAST):
+            yield Event.USE, node
+        elif isinstance(node, (ast_.BinaryExprAST, ast_.UnaryExprAST, ast_.FunctionCallAST)):
+            if isinstance(node, ast_.BinaryExprAST):
+                pending.extend((node.right, node.left))
+            elif isinstance(node, ast_.UnaryExprAST):
+                pending.append(node.primary)
+            else:
+                pending.extend(reversed(node.args.args))
+                pending.append(node.name)
+        elif isinstance(node, ast_.VarDeclAST):
+            yield Event.VARIABLE, node.var
+        elif isinstance(node, ast_.AssignmentAST):
+            pending.extend((node.rvalue, node.lvalue))
+        elif isinstance(node, ast_.BlockAST):
+            yield Event.ENTER, node
+            yield from _define_functions(node.sentences)
+            pending.append((Event.EXIT, node))
+            pending.extend(reversed(node.sentences))
+        elif isinstance(node, ast_.FunctionDeclAST):
+            yield Event.ENTER, node
+            for parameter in node.parameters.parameters:
+                yield Event.PARAMETER, parameter.var
+            pending.append((Event.EXIT, node))
+            if node.body is not None:  # The body is in the scope of the parameters
+                yield from _define_functions(node.body.sentences)
+                pending.extend(reversed(node.body.sentences))
+        elif isinstance(node, ast_.IfSentenceAST):
+            pending.extend(x for x in (node.else_, node.then, node.condition) if x is not None)
+        elif isinstance(node, ast_.WhileSentenceAST):
+            pending.extend((node.block, node.condition))
+        elif isinstance(node, ast_.ReturnSentenceAST):
+            if node.value is not None:
+                pending.append(node.value)
+
+
+class Bindings:
+    """ The names declared in a program and their uses, as bound by bind()
+    """
+    def __init__(self):
+        self.declarations: List[ast_.IdAST] = []  # In declaration order
+        self.kinds: List[SymbolKind] = []  # Of every declaration
+        self.uses: List[ast_.IdAST] = []  # Resolved ones, in source order
+        self.unresolved: List[ast_.IdAST] = []
+
+    def __len__(self) -> int:
+        return len(self.declarations)
+
+
+def bind(program: ast_.BlockAST, string_table: StringTable) -> Bindings:
+    """ Binds every identifier of the program parsed (the string table is the one of the parser) to its
+    declaration, so later passes need no name lookups: every IdAST gets the IdAST declaring it (decl)
+    and its address, the (depth, slot) pair of the scope it's declared in (the program one has depth 0)
+    and its index among the names declared in it. Scopes get their number of slots.
+    Names declared twice in a scope (already reported by the parser) are bound to the first declaration.
+    """
+    symbol_table = SymbolTable(string_table=string_table)
+    result = Bindings()
+    slots: List[int] = []  # Slots taken in every scope entered
+    scope_count = 0
+    for event, node in walk(program):
+        if event == Event.USE:
+            decl = symbol_table.resolve_id(symbol_table.name_id(node.token))
+            if decl is None:
+                node.decl = node.address = None  # Might have been bound before a reparse
+                result.unresolved.append(node)
+                continue
+
+            node.decl, node.address = decl, decl.address
+            result.uses.append(node)
+        elif event == Event.ENTER:
+            symbol_table.push_scope(str(scope_count))
+            scope_count += 1
+            slots.append(0)
+        elif event == Event.EXIT:
+            node.slots = slots.pop()
+            symbol_table.pop_scope()
+        else:
+            name_id = symbol_table.name_id(node.token)
+            decl = symbol_table.scope.get(name_id)
+            if decl is not None:
+                node.decl, node.address = decl, decl.address
+                continue
+
+            node.decl, node.address = node, (len(slots) - 1, slots[-1])
+            slots[-1] += 1
+            symbol_table.declare_symbol(node.token, node)
+            result.declarations.append(node)
+            result.kinds.append(_KINDS[event])
+
+    return result
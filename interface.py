@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+from typing import List, NamedTuple, Tuple
+
+import ast_
+import log
+from lexer import Token, TokenID
+from symbol_table import SymbolTable
+
+
+def source_hash(text: str) -> str:
+    """ Hash of the content of a source, to tell whether its interface is up to date
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class FunctionSignature(NamedTuple):
+    name: str
+    parameters: List[Tuple[str, str]]  # Name and type name of every parameter
+    type_name: str  # Of the returned value
+
+
+class Interface:
+    """ The signatures of the top level functions of a source, and the hash of its content,
+    which can be declared in the scope of a program without parsing the source.
+    Serialized as a header line with the hash, followed by a line per function with its name,
+    return type, and the name and type of every parameter, separated by spaces.
+    """
+    MAGIC = 'phi'
+    VERSION = 1
+
+    def __init__(self, content_hash: str, functions: List[FunctionSignature]):
+        self.content_hash = content_hash
+        self.functions = functions
+
+    def __len__(self) -> int:
+        return len(self.functions)
+
+    @classmethod
+    def from_program(cls, program: ast_.BlockAST, text: str) -> 'Interface':
+        """ The interface of the program parsed from the given source text. Function bodies are
+        not needed (so it can be parsed with lazy bodies, which are not parsed then)
+        """
+        return cls(source_hash(text), [
+            FunctionSignature(x.name, [(p.var.var_name, p.type_.name) for p in x.parameters.parameters], x.type_.name)
+            for x in program.sentences if isinstance(x, ast_.FunctionDeclAST)
+        ])
+
+    def is_current(self, text: str) -> bool:
+        """ Whether this is the interface of the given source text
+        """
+        return self.content_hash == source_hash(text)
+
+    def dumps(self) -> str:
+        lines = ['{} {} {}\n'.format(self.MAGIC, self.VERSION, self.content_hash)]
+        for name, parameters, type_name in self.functions:
+            lines.append(' '.join([name, type_name] + [x for parameter in parameters for x in parameter]) + '\n')
+        return ''.join(lines)
+
+    @classmethod
+    def loads(cls, text: str) -> 'Interface':
+        """ Returns the interface serialized in text by dumps()
+        """
+        lines = text.splitlines()
+        header = lines[0].split() if lines else []
+        if len(header) != 3 or header[0] != cls.MAGIC or header[1] != str(cls.VERSION):
+            raise ValueError('Not an interface file (version {})'.format(cls.VERSION))
+
+        functions = []
+        for line in lines[1:]:
+            fields = line.split()
+            if len(fields) < 2 or len(fields) % 2:
+                raise ValueError('Malformed function signature in interface file: {}'.format(line))
+            functions.append(FunctionSignature(fields[0], list(zip(fields[2::2], fields[3::2])), fields[1]))
+
+        return cls(header[2], functions)
+
+    def declare(self, symbol_table: SymbolTable) -> bool:
+        """ Declares the functions in the current scope of the symbol table (i.e. that of the program,
+        see Parser.declare_interface()), as FunctionDeclASTs without a body. Their types must be
+        resolved from it. Returns False on errors
+        """
+        success = True
+        for name, parameters, type_name in self.functions:
+            type_names = [type_name] + [x for _, x in parameters]
+            types = [symbol_table.resolve_symbol(x) for x in type_names]
+            unknown = next((x for x, type_ in zip(type_names, types) if type_ is None), None)
+            if unknown is not None:
+                log.error('unknown type {} in the signature of {}'.format(unknown, name))
+                success = False
+                continue
+
+            param_list = ast_.ParamListAST([
+                ast_.VarDeclAST(ast_.IdAST(Token(TokenID.ID, 0, param)), type_)
+                for (param, _), type_ in zip(parameters, types[1:])
+            ])
+            func = ast_.IdAST(Token(TokenID.ID, 0, name))
+            success &= symbol_table.declare_symbol(func.token, ast_.FunctionDeclAST(func, param_list, types[0], None))
+
+        return success
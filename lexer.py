@@ -1,10 +1,18 @@
 # -*- coding: utf-8 -*-
 
 
+import copy
+import re
 import sys
-from typing import Union, TextIO, Optional
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_left, bisect_right
+from collections import deque
+from typing import Union, TextIO, Optional, Tuple, List, NamedTuple
 from enum import IntEnum
-from io import StringIO, SEEK_SET
+from io import StringIO, TextIOBase
+
+from string_table import StringTable
 
 
 class TokenID(IntEnum):
@@ -104,74 +112,416 @@ TOKEN_MAP = {
 }
 
 
+# Line ends
+_NEWLINE = re.compile('\n')
+
+
+class LineIndex:
+    """ Converts source offsets to (line, column) locations with a sorted array of
+    the offsets where lines start. It is only built when a location is first needed.
+    The text can also be a fragment of a source, starting at the given offset and location.
+    """
+    __slots__ = ('_text', '_starts', 'offset', 'line', 'col', '_moved')
+
+    def __init__(self, text: str, offset: int = 0, line: int = 1, col: int = 1):
+        self._text = text
+        self._starts = None
+        self.offset = offset
+        self.line = line
+        self.col = col
+        # Once edited, (starts, shifts, LineIndex of the edited source): the text from starts[i] on
+        # (up to starts[i + 1]) moved shifts[i] chars. starts[0] is 0
+        self._moved: Optional[Tuple[List[int], List[int], LineIndex]] = None
+
+    def move(self, split: int, delta: int, index: 'LineIndex'):
+        """ The source was edited: the text from the split offset on moved delta chars, and
+        the edited source has the given index. Locations of the offsets in the unedited parts
+        (i.e. of the tokens which were not scanned again) are forwarded to that index from now on.
+        """
+        self._text = self._starts = None
+        self._moved = ([0, split], [0, delta], index) if split else ([0], [delta], index)
+
+    def _last_move(self) -> Tuple[List[int], List[int], 'LineIndex']:
+        """ Returns the moves of the text from this source to the last edited one. The indexes of
+        the sources edited in between are forwarded straight to it too (path compression), so
+        every later call follows a single move
+        """
+        chain = []
+        index = self
+        while index._moved[2]._moved is not None:
+            chain.append(index)
+            index = index._moved[2]
+
+        for index in reversed(chain):
+            starts, shifts, next_index = index._moved
+            index._moved = _compose_moves(starts, shifts, *next_index._moved)
+
+        return self._moved
+
+    def current_offset(self, offset: int) -> int:
+        """ Returns where the given source offset is in the last edited source
+        """
+        if self._moved is None:
+            return offset
+
+        starts, shifts, _ = self._last_move()
+        return offset + shifts[bisect_right(starts, offset) - 1]
+
+    def build(self) -> 'LineIndex':
+        """ Builds the index now (if not built yet). The text is not kept afterwards
+        """
+        if self._starts is None:
+            self._starts = array('i', [0])
+            self._starts.extend(match.end() for match in _NEWLINE.finditer(self._text))
+            self._text = None
+
+        return self
+
+    def location(self, offset: int) -> Tuple[int, int]:
+        """ Returns the (line, column) of the given source offset, both starting at 1
+        """
+        index = self
+        if self._moved is not None:
+            starts, shifts, index = self._last_move()
+            offset += shifts[bisect_right(starts, offset) - 1]
+
+        starts = index._starts if index._starts is not None else index.build()._starts
+        offset -= index.offset
+        i = bisect_right(starts, offset) - 1
+        if not i:
+            return index.line, index.col + offset
+
+        return index.line + i, offset - starts[i] + 1
+
+
+def _compose_moves(starts: List[int], shifts: List[int], next_starts: List[int], next_shifts: List[int],
+                   index: LineIndex) -> Tuple[List[int], List[int], LineIndex]:
+    """ Composes the moves of the text of a source (see LineIndex.move()) with the ones of the source
+    it was edited into, which are to the given index
+    """
+    result_starts: List[int] = []
+    result_shifts: List[int] = []
+    for i, (start, shift) in enumerate(zip(starts, shifts)):
+        end = starts[i + 1] if i + 1 < len(starts) else None
+        k = max(bisect_right(next_starts, start + shift) - 1, 0)
+        while True:
+            total = shift + next_shifts[k]
+            if not result_shifts or result_shifts[-1] != total:
+                result_starts.append(start)
+                result_shifts.append(total)
+            k += 1
+            if k == len(next_starts):
+                break
+            start = next_starts[k] - shift
+            if end is not None and start >= end:
+                break
+
+    return result_starts, result_shifts, index
+
+
 class Token:
+    __slots__ = ('id_', 'offset', 'value', 'line_index', 'name_id', '_num_val')
+
     id_: int
-    col: int
-    line: int
+    offset: int  # Source offset of the token start
     value: str
-    num_val: Union[int, float]
+    line_index: Optional[LineIndex]  # Of the token source. None for tokens not coming from one
+    name_id: Optional[int]  # Id of the value in the string table, for identifiers and keywords
 
-    def __init__(self, id_: int, line: int, col: int, value: str):
+    def __init__(self, id_: int, offset: int, value: str, line_index: LineIndex = None, name_id: int = None):
         self.id_ = id_
-        self.line = line
-        self.col = col
+        self.offset = offset
         self.value = value
+        self.line_index = line_index
+        self.name_id = name_id
+        self._num_val = None
+
+    @property
+    def line(self) -> int:
+        """ Line where the token starts (0 if it has no source)
+        """
+        return self.line_index.location(self.offset)[0] if self.line_index is not None else 0
+
+    @property
+    def col(self) -> int:
+        """ Column where the token starts (0 if it has no source)
+        """
+        return self.line_index.location(self.offset)[1] if self.line_index is not None else 0
+
+    @property
+    def num_val(self) -> Union[int, float]:
+        """ Numeric value of INT and FLOAT literals. Computed on first use
+        """
+        if self._num_val is None:
+            if self.id_ == TokenID.INT_LITERAL:
+                self._num_val = int(self.value)
+            elif self.id_ == TokenID.FLOAT_LITERAL:
+                self._num_val = float(self.value)
+            else:
+                raise AttributeError("Token {} has no numeric value".format(repr(self)))
 
-        if self.id_ == TokenID.INT_LITERAL:
-            self.num_val = int(value)
-        elif self.id_ == TokenID.FLOAT_LITERAL:
-            self.num_val = float(value)
+        return self._num_val
 
     def __eq__(self, other):
-        if isinstance(other, TokenID):
-            return self.id_ == other
+        if other.__class__ is Token:
+            return self.id_ == other.id_ and self.value == other.value
 
-        return self.id_ == other.id_ and self.value == other.value
+        return self.id_ == other  # A TokenID
 
     def __repr__(self):
         return 'Token<{} {}:{} {}>'.format(repr(self.id_), self.line, self.col, self.value)
 
 
+# Runs of identifier chars (\w is exactly str.isalnum() or '_')
+_WORD_RUN = re.compile(r'\w*')
+
+# Runs of digits. Only ASCII ones, as other numeric chars (i.e. '²') are no valid int() literals
+_DIGIT_RUN = re.compile(r'[0-9]*')
+
+# Single char punctuation tokens: those which are no prefix of a longer one
+_PUNCTUATION = ''.join(x for x in TOKEN_MAP if len(x) == 1 and not x.isalpha()
+                       and not any(y != x and y.startswith(x) for y in TOKEN_MAP))
+
+
+def _operator_dfa():
+    """ Builds the DFA recognizing the (non punctuation) operators of TOKEN_MAP.
+    Returns its transition table, with a row of 128 next states (for ASCII chars)
+    per state, and the token accepted by each state (if any). 0 is the initial state,
+    which is never a next state, so it also means "no transition".
+    """
+    transitions = [[0] * 128]
+    accepted = [None]
+
+    for oper, id_ in TOKEN_MAP.items():
+        if oper.isalpha() or oper in _PUNCTUATION:
+            continue
+
+        state = 0
+        for char in oper:
+            if not transitions[state][ord(char)]:
+                transitions[state][ord(char)] = len(transitions)
+                transitions.append([0] * 128)
+                accepted.append(None)
+            state = transitions[state][ord(char)]
+        accepted[state] = id_
+
+    return transitions, accepted
+
+
+_OPER_TRANSITIONS, _OPER_ACCEPTED = _operator_dfa()
+
+# Char classes, used by the char engine to dispatch on the first char of a token
+_SKIP, _INVALID, _ID, _DIGIT, _DOT, _PUNCT, _OPER, _SLASH, _STR, _CHAR = range(10)
+
+
+def _ascii_char_classes() -> List[int]:
+    """ Returns the class of every ASCII char (chars to skip are set by each Lexer)
+    """
+    result = [_INVALID] * 128
+    for code in range(128):
+        char = chr(code)
+        if char.isalpha() or char == '_':
+            result[code] = _ID
+        elif char in '0123456789':
+            result[code] = _DIGIT
+        elif char in _PUNCTUATION:
+            result[code] = _PUNCT
+        elif _OPER_TRANSITIONS[0][code]:
+            result[code] = _OPER
+
+    result[ord('.')] = _DOT
+    result[ord('/')] = _SLASH
+    result[ord('"')] = _STR
+    result[ord("'")] = _CHAR
+    return result
+
+
+_ASCII_CHAR_CLASSES = _ascii_char_classes()
+
+# Runs of blanks (chars to skip), line comments and closed block comments.
+# Like skip_until_close_comment(), the '*' opening a block comment can also close it: /*/
+_SKIP_RUN = r'(?:[{}]+|//[^\n]*|/\*(?:.*?\*)??/)*'
+
+# Token alternatives of the regex engine (verbose syntax). Operators are tried longest first.
+# A '.' not followed by a digit is the DOT punctuation token, and a '/' starting a comment is no DIV.
+_MASTER_RE = r'''(?:
+    (?P<ID>[^\W\d]\w*)
+  | (?P<NUMBER>(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][-+]?[0-9]+)?)
+  | (?P<PUNCT>[{}])
+  | (?P<OPER>{})
+  | (?P<DIV>/=|/(?![*/]))
+  | "(?P<STR>(?:[^"\\\n]|\\.)*)"
+  | '(?P<CHAR>[^'])'
+)'''.format(re.escape(_PUNCTUATION),
+           '|'.join(re.escape(x) for x in sorted(TOKEN_MAP, key=len, reverse=True)
+                    if not x.isalpha() and x not in _PUNCTUATION))
+
+# An escaped char within a string literal
+_ESCAPED_CHAR = re.compile(r'\\(.)', re.DOTALL)
+
+# Chars which stop the scanning of a string literal
+_STRING_STOP = re.compile(r'["\\\n]')
+
+
 class LexException(BaseException):
     pass
 
 
 class Lexer:
-    """ Implements a simple utf-8 Lexer
+    """ Implements a simple utf-8 Lexer.
+    The whole source is loaded into a single string which is walked with an
+    integer cursor, so token texts are sliced out of it instead of being
+    built char by char. In streaming mode that string is a sliding window over
+    the input instead.
+    Locations are source offsets, only converted to lines and columns (with
+    the line_index) when needed.
     """
-    _stream: TextIO
+    _buffer: str  # The whole source, or a sliding window of it in streaming mode
+    _length: int
+    _pos: int  # Index of current_char within the buffer (_length on EOF)
+    _base: int  # Source offset of the buffer start (always 0 unless streaming)
+    line_index: LineIndex  # Of the buffer
     current_char: str = ''
-    col: int
-    line: int
     _token_counter: int
     text: str
+    scanned_tokens: int  # Number of tokens scanned so far
+    token_start: int  # Source offset of the last scanned token (it ends at the current position)
+
+    def __new__(cls, *args, engine: str = 'char', **kwargs):
+        if cls is Lexer:
+            if engine not in LEXER_ENGINES:
+                raise ValueError("Unknown lexer engine '{}'".format(engine))
+            cls = LEXER_ENGINES[engine]
+
+        return super().__new__(cls)
 
     def __init__(self,
                  input_stream: Union[str, TextIO, StringIO],
                  encoding: str = 'utf-8',
-                 skip_chars: str = ' \n\r\t'):
-        if isinstance(input_stream, (TextIO, StringIO)):
+                 skip_chars: str = ' \n\r\t',
+                 engine: str = 'char',
+                 streaming: bool = False,
+                 chunk_size: int = 1 << 16,
+                 string_table: StringTable = None):
+        """ engine selects the scanning implementation: 'char' (char by char) or 'regex'.
+        In streaming mode the source is read in chunks of chunk_size chars (so it can be
+        a pipe or stdin) and only a sliding window of it is kept in memory.
+        Identifiers and keywords are interned in the given string table (a new one by default).
+        """
+        self.string_table = string_table if string_table is not None else StringTable()
+        self._streaming = streaming
+        self._stream = None  # Streaming mode: the input, until it is exhausted
+        self._own_stream = False
+        self._base = 0
+        self._pos = -1
+
+        if streaming:
+            if not isinstance(input_stream, (TextIO, TextIOBase)):
+                input_stream = open(input_stream, 'rt', encoding=encoding)
+                self._own_stream = True
             self._stream = input_stream
+            self._chunk_size = chunk_size
+            self._buffer = ''
+            self.line_index = LineIndex('')
+            self._fill()
         else:
-            self._stream = open(input_stream, 'rt', encoding=encoding)
-
-        self.line = 1
-        self.col = 0
+            if isinstance(input_stream, (TextIO, TextIOBase)):
+                self._buffer = input_stream.read()
+            else:
+                with open(input_stream, 'rt', encoding=encoding) as f:
+                    self._buffer = f.read()
+            self.line_index = LineIndex(self._buffer)
+
+        self._length = len(self._buffer)
         self._skip_chars = skip_chars
+        self._skip_run = re.compile(_SKIP_RUN.format(re.escape(skip_chars)), re.DOTALL)
+        self._char_classes = list(_ASCII_CHAR_CLASSES)
+        for char in skip_chars:
+            if char < '\x80':
+                self._char_classes[ord(char)] = _SKIP
+
+        # Scanner of the tokens starting with a char of each class (None for comments)
+        self._scanners = [None, self.error_invalid_char, self.get_identifier, self.get_number, self.get_number,
+                          self.get_punctuation, self.get_oper, self.get_slash, self.get_string, self.get_char]
+        self._lookahead_tokens = deque()
+        self._rewound_chars = 0
+        self.scanned_tokens = 0
         _token_counter = 1
         self.current_char = self.get_next_char()
 
-    def get_next_char(self) -> str:
-        if self.current_char == '\n':
-            self.line += 1
-            self.col = 0
+    def _fill(self):
+        """ Streaming mode: drops the chars before current_char from the window
+        and appends the next chunk of the stream to it
+        """
+        start = max(self._pos, 0)
+        line, col = self.line_index.location(self._base + start)
+        chunk = self._stream.read(self._chunk_size)
+        self._buffer = self._buffer[start:] + chunk
+        self._length = len(self._buffer)
+        self._base += start
+        self._pos -= start
+        # Built right away, so tokens referencing it do not keep the window alive
+        self.line_index = LineIndex(self._buffer, self._base, line, col).build()
+
+        if not chunk:
+            if self._own_stream:
+                self._stream.close()
+            self._stream = None
+
+    @property
+    def line(self) -> int:
+        """ Line of current_char
+        """
+        return self.line_index.location(self._base + self._pos)[0]
+
+    @property
+    def col(self) -> int:
+        """ Column of current_char. On EOF, the one of the last char (0 if it is a newline)
+        """
+        col = self.line_index.location(self._base + self._pos)[1]
+        return col if self._pos < self._length else col - 1
 
-        self.current_char = self._stream.read(1)
-        if self.current_char:
-            self.col += 1
+    def _location(self, index: int) -> Tuple[int, int]:
+        """ Returns the (line, column) of the given buffer index
+        """
+        return self.line_index.location(self._base + index)
+
+    def get_next_char(self) -> str:
+        pos = self._pos + 1
+        if pos < self._length:
+            self._pos = pos
+            self.current_char = self._buffer[pos]
+        else:
+            self._pos = self._length
+            self.current_char = ''
 
         return self.current_char
 
+    def _advance_to(self, index: int):
+        """ Moves the cursor forward until current_char is the one at the given index (or EOF)
+        """
+        if index < self._length:
+            self._pos = index
+            self.current_char = self._buffer[index]
+        else:
+            self._pos = self._length
+            self.current_char = ''
+
+    def _digits_end(self, pos: int) -> int:
+        """ Returns the index of the first non digit char at or after pos
+        """
+        return _DIGIT_RUN.match(self._buffer, pos).end()
+
+    def _char_class(self, char: str) -> int:
+        """ Class of a non ASCII char
+        """
+        if char in self._skip_chars:
+            return _SKIP
+        if char.isalpha():
+            return _ID
+
+        return _INVALID
+
     def error_invalid_char(self, line=None, col=None, char=None):
         """ Raises an invalid char exception
         """
@@ -185,209 +535,733 @@ class Lexer:
         raise LexException("Invalid char '{}' at line {}, column {}".format(char, line, col))
 
     def skip_to_eol(self):
-        while self.current_char and self.current_char != '\n':
-            self.get_next_char()
+        end = self._buffer.find('\n', self._pos)
+        self._advance_to(end if end >= 0 else self._length)
 
     def skip_until_close_comment(self):
         """ Skips until finding a closing */ or EOF (in which case raises an error)
         """
-        while self.current_char:
-            if self.current_char == '*':
-                self.get_next_char()
-
-                if self.current_char == '/':
-                    self.get_next_char()
-                    return
-
-                if self.current_char == '*':
-                    continue
-
-            self.get_next_char()
+        end = self._buffer.find('*/', self._pos)
+        if end >= 0:
+            self._advance_to(end + 2)
+            return
 
+        self._advance_to(self._length)
         raise LexException("Unclosed comment at line {}, column {}".format(self.line, self.col))
 
     def get_identifier(self) -> Token:
-        initial_col = self.col
-        while self.current_char.isalnum() or self.current_char == '_':
-            self.text += self.current_char
-            self.get_next_char()
+        start = self._pos
+        end = _WORD_RUN.match(self._buffer, start).end()
+        name_id = self.string_table.intern(self._buffer[start:end])
+        self.text = text = self.string_table.strings[name_id]
+        self._advance_to(end)
 
-        return Token(TOKEN_MAP.get(self.text, TokenID.ID), line=self.line, col=initial_col, value=self.text)
+        return Token(TOKEN_MAP.get(text, TokenID.ID), start, text, self.line_index, name_id)
 
     def get_number(self) -> Token:
         """ Returns either an integer or a float
         """
-        initial_col = self.col
-        while self.current_char.isnumeric():
-            self.text += self.current_char
-            self.get_next_char()
-
-        if self.current_char not in '.eE':
-            return Token(TokenID.INT_LITERAL, line=self.line, col=initial_col, value=self.text)
+        buffer = self._buffer
+        start = self._pos
+        end = self._digits_end(start)
 
-        if self.current_char == '.':
-            self.text += '.'
-            self.get_next_char()
-
-            while self.current_char.isnumeric():
-                self.text += self.current_char
-                self.get_next_char()
-
-            if self.text == '.':
-                return Token(TokenID.DOT, line=self.line, col=self.col, value='.')
-
-        if self.current_char in 'eE':
-            # Here we have either an integer, or a float number
-            self.text += 'e'
-            self.get_next_char()
-
-            if self.current_char in '-+':
-                self.text += self.current_char
-                self.get_next_char()
+        if buffer[end:end + 1] == '.':
+            end = self._digits_end(end + 1)
+            if end == start + 1:
+                self.text = '.'
+                self._advance_to(end)
+                return Token(TokenID.DOT, start, '.', self.line_index)
 
-            while self.current_char.isnumeric():
-                self.text += self.current_char
-                self.get_next_char()
+        if buffer[end:end + 1] in ('e', 'E'):
+            exponent = end + 1
+            if buffer[exponent:exponent + 1] in ('-', '+'):
+                exponent += 1
 
-            if self.text[-1] in '+-':
-                # No numbers after the NUM. i.e. 2e+. Means a syntax error probably
-                self.rewind()
-                self.text = self.text[:-1]  # Remove trailing e
+            exponent_end = self._digits_end(exponent)
+            if exponent_end > exponent:  # Otherwise (i.e. 2e+) the 'e' is not part of the number
+                end = exponent_end
 
-            if self.text[-1] == 'e':
-                self.rewind()
-                self.text = self.text[:-1]  # Remove trailing e
+        self.text = buffer[start:end].replace('E', 'e')
+        self._advance_to(end)
 
         if 'e' in self.text or '.' in self.text:
-            return Token(TokenID.FLOAT_LITERAL, line=self.line, col=initial_col, value=self.text)
+            return Token(TokenID.FLOAT_LITERAL, start, self.text, self.line_index)
 
-        return Token(TokenID.INT_LITERAL, line=self.line, col=initial_col, value=self.text)
+        return Token(TokenID.INT_LITERAL, start, self.text, self.line_index)
 
     def get_oper(self) -> Token:
-        ini_col = self.col
+        """ Scans the longest operator, running the operator DFA
+        """
+        buffer = self._buffer
+        length = self._length
+        start = pos = end = self._pos
+        state = 0
+        id_ = None
+
+        while pos < length:
+            code = ord(buffer[pos])
+            state = _OPER_TRANSITIONS[state][code] if code < 128 else 0
+            if not state:
+                break
+            pos += 1
+            if _OPER_ACCEPTED[state] is not None:
+                id_ = _OPER_ACCEPTED[state]
+                end = pos
+
+        if id_ is None:
+            self.text = buffer[start:pos]
+            self._advance_to(pos)
+            self.error_invalid_char(*self._location(start), char=self.text)
+
+        self.text = buffer[start:end]
+        self._advance_to(end)
+        return Token(id_, start, self.text, self.line_index)
+
+    def get_punctuation(self) -> Token:
+        self.text = char = self.current_char
+        self.get_next_char()
+        return Token(TOKEN_MAP[char], self.token_start, char, self.line_index)
+
+    def get_slash(self) -> Optional[Token]:
+        """ Scans a DIV or A_DIV operator, or skips a comment (returning None)
+        """
+        end = self._skip_run.match(self._buffer, self._pos).end()
+        if end != self._pos:
+            self._advance_to(end)
+            return None
 
-        self.text = self.current_char
         self.get_next_char()
+        if self.current_char == '/':  # Line comment?
+            self.skip_to_eol()
+            return None
+
+        if self.current_char == '*':  # Block comment?
+            self.skip_until_close_comment()
+            return None
 
-        while self.current_char and self.text + self.current_char in TOKEN_MAP:
-            self.text += self.current_char
+        if self.current_char == '=':
             self.get_next_char()
+            return Token(TokenID.A_DIV, self.token_start, '/=', self.line_index)
 
-        if self.text not in TOKEN_MAP:
-            self.error_invalid_char(col=ini_col, char=self.text)
+        return Token(TokenID.DIV, self.token_start, '/', self.line_index)
 
-        return Token(TOKEN_MAP[self.text], self.line, ini_col, self.text)
+    def seek(self, offset: int):
+        """ Moves the cursor to the given source offset, which must be a token
+        boundary (i.e. the end of a token). Looked ahead tokens are discarded.
+        Not available in streaming mode.
+        """
+        assert not self._streaming, "Cannot seek a streaming lexer"
+        scanned_chars = self.scanned_chars
+        self._lookahead_tokens.clear()
+        self._pos = min(offset, self._length)
+        self._rewound_chars = scanned_chars - min(self._pos + 1, self._length)  # Skipped chars are not scanned
+        self.current_char = self._buffer[offset:offset + 1]
+
+    def fork(self, offset: int) -> 'Lexer':
+        """ Returns another lexer of the same source (which is shared, not copied) with
+        its cursor at the given offset (see seek()). Not available in streaming mode.
+        """
+        assert not self._streaming, "Cannot fork a streaming lexer"
+        result = copy.copy(self)
+        result._scanners = [None] + [getattr(result, x.__name__) for x in self._scanners[1:]]
+        result._lookahead_tokens = deque()
+        result.scanned_tokens = 0
+        result.seek(offset)
+        return result
 
     def rewind(self, n=1):
         """ Rewinds n characters back. Defaults rewind 1 char
+        (in streaming mode, not beyond the start of the current token)
         """
-        self._stream.seek(max(0, self._stream.tell() - n), SEEK_SET)
+        pos = max(0, self._pos - n)
+        self._rewound_chars += min(self._pos + 1, self._length) - pos - 1
+        self._pos = pos
+        self.current_char = self._buffer[pos:pos + 1]
 
     def get_string(self) -> Token:
         """ Catches a string literal
         """
-        ini_col = self.col
-        self.text = ''
+        buffer = self._buffer
+        start = self._pos
+        pos = start + 1
+        chunks = []
 
         while True:
-            self.get_next_char()
-            if self.current_char == '\\':
-                self.get_next_char()
-                self.text += self.current_char
-                continue
-            elif self.current_char == '"':
-                self.get_next_char()
+            match = _STRING_STOP.search(buffer, pos)
+            if match is None or buffer[match.start()] == '\n':
+                self._advance_to(self._length if match is None else match.start())
+                raise LexException('Unclosed string literal at line {}, column {}'.format(
+                    self.line, self._location(start)[1]))
+
+            stop = match.start()
+            chunks.append(buffer[pos:stop])
+            if buffer[stop] == '"':
+                pos = stop + 1
                 break
-            elif self.current_char == '' or self.current_char == '\n':
-                raise LexException('Unclosed string literal at line {}, column {}'.format(self.line, ini_col))
 
-            self.text += self.current_char
+            chunks.append(buffer[stop + 1:stop + 2])  # Escaped char
+            pos = stop + 2
 
-        return Token(TokenID.STR_LITERAL, line=self.line, col=ini_col, value=self.text)
+        self.text = ''.join(chunks)
+        self._advance_to(pos)
+        return Token(TokenID.STR_LITERAL, start, self.text, self.line_index)
 
     def get_char(self) -> Token:
         """ Scans a quoted char
         """
+        start = self._pos
         char = self.get_next_char()
         if char == "'":
             raise LexException("Empty char value not allowed")
 
-        col = self.col
         if self.get_next_char() != "'":
             raise LexException("Unclosed char literal. Expected ' at line {}, column {}".format(self.line, self.col))
 
         self.get_next_char()
-        return Token(TokenID.CHAR_LITERAL, self.line, col, char)
+        return Token(TokenID.CHAR_LITERAL, start, char, self.line_index)
 
-    def get_token(self) -> Token:
+    def scan_token(self) -> Token:
+        """ Scans the next token from the source (the char by char engine)
+        """
         self.text = ''
+        classes = self._char_classes
+        scanners = self._scanners
 
         while self.current_char:
-            if self.current_char in self._skip_chars:
-                self.get_next_char()
+            char = self.current_char
+            kind = classes[ord(char)] if char < '\x80' else self._char_class(char)
+            if kind == _SKIP:
+                self._advance_to(self._skip_run.match(self._buffer, self._pos).end())
                 continue
 
-            if self.current_char == '/':
-                self.get_next_char()
+            self.token_start = self._pos
+            token = scanners[kind]()
+            if token is not None:
+                return token
 
-                if self.current_char == '/':  # Line comment?
-                    self.skip_to_eol()
-                    continue
+        self.token_start = self._pos
+        return Token(TokenID.EOF, self._pos, '', self.line_index)
 
-                if self.current_char == '*':  # Block comment?
-                    self.skip_until_close_comment()
-                    continue
+    def get_token(self) -> Token:
+        """ Returns the next token. Tokens already scanned by lookahead() are not scanned again.
+        """
+        if self._lookahead_tokens:
+            return self._lookahead_tokens.popleft()
 
-                if self.current_char == '=':
-                    result = Token(TokenID.A_DIV, self.line, self.col - 1, value='/=')
-                    self.get_next_char()
-                    return result
+        self.scanned_tokens += 1
+        return self._scan_streamed() if self._streaming else self.scan_token()
 
-                return Token(TokenID.DIV, self.line, self.col - 1, value='/')
+    def lookahead(self, n: int = 1) -> Optional[Token]:
+        """ Looks ahead n tokens. Those are scanned once and queued for get_token(),
+        so line, col and current_char refer to the position after the last one.
+        """
+        if n < 1:
+            return None
 
-            if self.current_char.isalpha() or self.current_char == '_':
-                return self.get_identifier()
+        queue = self._lookahead_tokens
+        while len(queue) < n:
+            self.scanned_tokens += 1
+            queue.append(self._scan_streamed() if self._streaming else self.scan_token())
 
-            if self.current_char.isnumeric() or self.current_char == '.':
-                return self.get_number()
+        return queue[n - 1]
 
-            if self.current_char in '+-*%<>=!':
-                return self.get_oper()
+    @property
+    def scanned_chars(self) -> int:
+        """ Number of source chars scanned so far (chars scanned again after a rewind are counted twice)
+        """
+        return self._base + min(self._pos + 1, self._length) + self._rewound_chars
 
-            if self.current_char in '.,:;[](){}':
-                self.text = self.current_char
-                self.get_next_char()
-                return Token(TOKEN_MAP[self.text], self.line, self.col, self.text)
+    def _scan_streamed(self) -> Token:
+        """ Scans the next token in streaming mode. The window is refilled ahead of the scan.
+        Scanners read at most 2 chars past the token they return (the "2e+" case), so if a scan
+        gets closer to the window end than that (or fails there) the token might be truncated:
+        it is scanned again from the same position once the next chunk is in the window.
+        """
+        if self._stream is not None and self._length - self._pos < self._chunk_size:
+            self._fill()
 
-            if self.current_char == '"':
-                return self.get_string()
+        while True:
+            state = self._pos, self.current_char
+            try:
+                token = self.scan_token()
+                if self._stream is None or self._pos + 2 < self._length:
+                    self.token_start += self._base
+                    token.offset += self._base
+                    return token
+            except LexException:
+                if self._stream is None or self._pos + 2 < self._length:
+                    raise
+
+            self._pos, self.current_char = state
+            self._fill()
+
+
+class RegexLexer(Lexer):
+    """ Lexer engine which recognizes every token (and the blanks and comments
+    before it) with a single match of a compiled regular expression.
+    Input it cannot match (i.e. lexical errors) is handed to the char by char
+    engine, so diagnostics are the same.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (?=(...))\1 makes the skipping atomic, so failing to match a token never backtracks into a comment
+        self._master = re.compile(r'(?=({}))\1'.format(_SKIP_RUN.format(re.escape(self._skip_chars))) + _MASTER_RE,
+                                  re.DOTALL | re.VERBOSE)
 
-            if self.current_char == "'":
-                return self.get_char()
+    def scan_token(self) -> Token:
+        self.text = ''
+        match = self._master.match(self._buffer, self._pos) if self.current_char else None
+        if match is None:
+            return super().scan_token()
 
-            self.error_invalid_char()
+        kind = match.lastgroup
+        if kind is None:  # Just blanks and comments
+            self._advance_to(match.end())
+            return super().scan_token()
 
-        return Token(TokenID.EOF, line=self.line, col=self.col, value='')
+        if kind == 'ID' and match.group(kind)[0] >= '\x80' and not match.group(kind)[0].isalpha():
+            self._advance_to(match.start(kind))  # [^\W\d] also matches numeric chars like '²'
+            return super().scan_token()
 
-    def lookahead(self, n: int = 1) -> Optional[Token]:
-        """ Looks ahead n tokens
+        start = match.start(kind)
+        if start != self._pos:
+            self._advance_to(start)
+
+        if kind == 'STR' or kind == 'CHAR':
+            start -= 1  # Include the opening quote
+        self.token_start = start
+        self.text = text = match.group(kind)
+        self._advance_to(match.end())
+
+        if kind == 'ID':
+            name_id = self.string_table.intern(text)
+            self.text = text = self.string_table.strings[name_id]
+            return Token(TOKEN_MAP.get(text, TokenID.ID), start, text, self.line_index, name_id)
+
+        if kind == 'PUNCT' or kind == 'OPER':
+            return Token(TOKEN_MAP[text], start, text, self.line_index)
+
+        if kind == 'NUMBER':
+            if 'e' in text or 'E' in text or '.' in text:
+                self.text = text = text.replace('E', 'e')
+                return Token(TokenID.FLOAT_LITERAL, start, text, self.line_index)
+            return Token(TokenID.INT_LITERAL, start, text, self.line_index)
+
+        if kind == 'STR':
+            if '\\' in text:
+                self.text = text = _ESCAPED_CHAR.sub(r'\1', text)
+            return Token(TokenID.STR_LITERAL, start, text, self.line_index)
+
+        if kind == 'DIV':
+            return Token(TokenID.DIV if text == '/' else TokenID.A_DIV, start, text, self.line_index)
+
+        return Token(TokenID.CHAR_LITERAL, start, text, self.line_index)
+
+
+LEXER_ENGINES = {
+    'char': Lexer,
+    'regex': RegexLexer,
+}
+
+
+# Source text items: code, or a whole comment, string or char literal (verbose syntax)
+_CODE_ITEM_RE = r'''(?:
+    [^/"']+
+  | /\*(?:.*?\*)??/
+  | //[^\n]*
+  | "(?:[^"\\\n]|\\.)*"
+  | '[^']'
+  | /(?!\*)
+)'''
+
+# Runs of source text items, i.e. with no unfinished comment, string or char literal:
+# any newline within one is a safe place to split the source to lex its parts separately
+_CODE_RUN = re.compile(_CODE_ITEM_RE + '*', re.DOTALL | re.VERBOSE)
+_CODE_ITEM = re.compile(_CODE_ITEM_RE, re.DOTALL | re.VERBOSE)
+
+
+def _split_points(source: str, parts: int) -> List[int]:
+    """ Returns the offsets (starting with 0) where the source can be split into (at most)
+    the given number of parts of similar size, which can be lexed separately: right after
+    newlines outside comments, strings and char literals.
+    """
+    result = [0]
+    pos = 0
+
+    for i in range(1, parts):
+        newline = source.find('\n', max(pos, len(source) * i // parts))
+        while newline >= 0:
+            pos = _CODE_RUN.match(source, pos, newline + 1).end()
+            if pos == newline + 1:
+                result.append(pos)
+                break
+
+            # The newline is within a comment, string or char literal starting at pos. Skip it
+            item = _CODE_ITEM.match(source, pos)
+            if item is None:
+                return result  # Unfinished (i.e. an unclosed comment). It won't lex anyway
+
+            pos = item.end()
+            newline = source.find('\n', pos)
+
+    return result
+
+
+def _lex_part(source: str, offset: int, engine: str, skip_chars: str) -> Tuple[array, array, array]:
+    """ Returns the token ids, starts and ends arrays of the given part of a source, which starts
+    at the given offset of it (run by worker processes, so the parent only has to join them)
+    """
+    stream = TokenStream(source, engine, skip_chars)
+    stream._scan(Lexer(StringIO(source), skip_chars=skip_chars, engine=engine), offset)
+    return stream.ids, stream.starts, stream.ends
+
+
+def _shifted(values: array, delta: int) -> array:
+    """ Returns the given array with delta added to all its values
+    """
+    return array(values.typecode, map(delta.__add__, values)) if delta else values
+
+
+# Chunk size of the streaming lexer of TokenStream.relex(), which reads the edited source from the edit on
+_RELEX_CHUNK_SIZE = 1 << 12
+# Number of consecutive edits after which TokenStream.relex() builds the source and joins the segments,
+# so the old streams it refers to, and the segments, don't grow with the edits
+_MAX_EDIT_DEPTH = 64
+
+
+class _Segment(NamedTuple):
+    """ Run of tokens of a TokenStream: those from lo to hi (excluded) in the arrays,
+    which may be shared with other streams, with delta added to their offsets
+    """
+    ids: array
+    starts: array
+    ends: array
+    lo: int
+    hi: int
+    delta: int
+
+
+class _SourceReader(TextIOBase):
+    """ Reads the source of a TokenStream from the given offset on, without building it whole
+    """
+    def __init__(self, stream: 'TokenStream', offset: int):
+        super().__init__()
+        self._stream = stream
+        self._offset = offset
+
+    def read(self, size: int = -1) -> str:
+        end = self._stream._length if size < 0 else min(self._offset + size, self._stream._length)
+        text = self._stream._text(self._offset, end)
+        self._offset = end
+        return text
+
+
+class TokenStream:
+    """ Compact sequence of the tokens of a source, stored as a struct of arrays
+    (token ids and start/end offsets in the source).
+    Token objects are only created when indexed, slicing their value out of the source.
+    The arrays are split in segments, so that relex() shares those of the tokens it does
+    not scan with the old stream, shifting their offsets only when they are read. The ids,
+    starts and ends properties join the segments into single arrays (once).
+    """
+    relexed_tokens: int  # Number of tokens scanned to build this stream
+    relexed_chars: int  # Number of source chars scanned by relex() to build this stream
+
+    def __init__(self, source: Optional[str], engine: str = 'char', skip_chars: str = ' \n\r\t'):
+        self._source = source  # Built from _edit when first needed, if None
+        self._edit = None  # (stream, offset, removed chars, inserted text) the source results from
+        self._depth = 0  # Number of edits since the source was built (i.e. of streams in the _edit chain)
+        self._length = len(source) if source is not None else 0  # Of the source
+        self.engine = engine
+        self.skip_chars = skip_chars
+        self._line_index = None
+        self._segments: List[_Segment] = []
+        self._counts: List[int] = []  # Number of tokens up to the end of every segment
+        self._firsts: List[int] = []  # Start of the first token of every segment
+        self._lasts: List[int] = []  # End of the last token of every segment
+        self.relexed_tokens = 0
+        self.relexed_chars = 0
+
+    @property
+    def source(self) -> str:
+        if self._source is None:
+            self._source = self._text(0, self._length)
+            self._edit = None  # The old streams are no longer needed
+            self._depth = 0
+        return self._source
+
+    @property
+    def line_index(self) -> LineIndex:
+        if self._line_index is None:
+            self._line_index = LineIndex(self.source)
+        return self._line_index
+
+    @property
+    def ids(self) -> array:
+        return self._columns()[0]
+
+    @property
+    def starts(self) -> array:
+        return self._columns()[1]
+
+    @property
+    def ends(self) -> array:
+        return self._columns()[2]
+
+    @classmethod
+    def from_lexer(cls, lexer: Lexer) -> 'TokenStream':
+        """ Scans all the remaining tokens of the lexer, up to EOF (included)
         """
-        col = self.col
-        line = self.line
-        current_char = self.current_char
-        pos = self._stream.tell()
+        assert not lexer._lookahead_tokens, "Cannot build a TokenStream from a lexer with looked ahead tokens"
+        assert not lexer._streaming, "Cannot build a TokenStream from a streaming lexer"
+        engine = next(name for name, class_ in LEXER_ENGINES.items() if class_ is type(lexer))
+        result = cls(lexer._buffer, engine, lexer._skip_chars)
+        result._scan(lexer)
+        return result
 
-        result = None
-        for _ in range(n):
-            result = self.get_token()
+    @classmethod
+    def from_source(cls, source: str, engine: str = 'char', skip_chars: str = ' \n\r\t',
+                    workers: int = 1) -> 'TokenStream':
+        """ Scans all the tokens of the source. With several workers, the source is split at safe
+        newlines into that many parts, which are lexed in parallel by worker processes.
+        The result is the same as lexing it serially. So are lexical errors: if a part
+        fails to lex, the whole source is lexed again serially to report them.
+        """
+        points = _split_points(source, workers) if workers > 1 and '\n' in skip_chars else [0]
+        if len(points) == 1:
+            return cls.from_lexer(Lexer(StringIO(source), skip_chars=skip_chars, engine=engine))
+
+        parts = [source[start:end] for start, end in zip(points, points[1:] + [len(source)])]
+        try:
+            with ProcessPoolExecutor(workers) as executor:
+                results = list(executor.map(_lex_part, parts, points, [engine] * len(parts),
+                                            [skip_chars] * len(parts)))
+        except LexException:
+            return cls.from_lexer(Lexer(StringIO(source), skip_chars=skip_chars, engine=engine))
+
+        result = cls(source, engine, skip_chars)
+        all_ids, all_starts, all_ends = array('i'), array('i'), array('i')
+        for i, (ids, starts, ends) in enumerate(results):
+            count = len(ids) if i == len(results) - 1 else len(ids) - 1  # Only the last EOF token is kept
+            all_ids.extend(ids[:count])
+            all_starts.extend(starts[:count])
+            all_ends.extend(ends[:count])
+            result.relexed_tokens += len(ids)
+
+        result._append(all_ids, all_starts, all_ends, 0, len(all_ids), 0)
+        return result
 
-        self.col = col
-        self.line = line
-        self.current_char = current_char
-        self._stream.seek(pos, SEEK_SET)
+    def _scan(self, lexer: Lexer, base: int = 0, sync: 'TokenStream' = None, sync_from: int = 0,
+              delta: int = 0) -> int:
+        """ Appends the tokens scanned by the lexer (of the source from base on) up to EOF, or until
+        a token starting at or after sync_from is also in the sync stream (shifted delta chars).
+        Returns the index of that token in the sync stream (its length if none).
+        """
+        ids, starts, ends = array('i'), array('i'), array('i')
+        append_id = ids.append
+        append_start = starts.append
+        append_end = ends.append
+        scan = lexer._scan_streamed if lexer._streaming else lexer.scan_token
+        result = len(sync) if sync is not None else 0
 
+        while True:
+            lexer.scanned_tokens += 1
+            self.relexed_tokens += 1
+            tok = scan()
+            start = base + lexer.token_start
+            if sync is not None and start >= sync_from:
+                i = sync._starting_at(start - delta)
+                if i is not None:
+                    result = i
+                    break
+
+            append_id(tok.id_)
+            append_start(start)
+            append_end(base + lexer._base + lexer._pos)
+            if tok.id_ == TokenID.EOF:
+                break
+
+        self._append(ids, starts, ends, 0, len(ids), 0)
+        return result
+
+    def relex(self, offset: int, removed: int, inserted: str) -> 'TokenStream':
+        """ Returns the TokenStream of the source resulting from replacing the removed
+        chars at offset with the inserted text. Only the tokens around the edit are scanned:
+        from the last token boundary not affected by it, until the new tokens line up
+        with the old ones again. The others are shared with this stream, and so is the source,
+        which is only built when needed: the time taken does not depend on the size of the source.
+        Every _MAX_EDIT_DEPTH consecutive edits, the source is built and the segments joined, so that
+        reading the source of the result does not depend on the number of edits it results from.
+        """
+        new_end = offset + len(inserted)
+        delta = len(inserted) - removed
+        result = TokenStream(None, self.engine, self.skip_chars)
+        result._edit = self, offset, removed, inserted
+        result._depth = self._depth + 1
+        result._length = self._length + delta
+
+        # Scanning a token looks up to 2 chars beyond its end (i.e. 2e+), so tokens
+        # ending at least 3 chars before the edit are not affected by it
+        first = self._ending_after(offset - 3)
+        self._copy(result, 0, first, 0)
+        base = self._token(first - 1)[2] if first else 0
+
+        lexer = Lexer(_SourceReader(result, base), skip_chars=self.skip_chars, engine=self.engine,
+                      streaming=True, chunk_size=_RELEX_CHUNK_SIZE)
+        try:
+            sync = result._scan(lexer, base, self, new_end, delta)
+            result.relexed_chars = lexer.scanned_chars
+        except LexException:
+            # Scanned again within the whole source, for the error to report its line and column
+            lexer = Lexer(StringIO(result.source), skip_chars=self.skip_chars, engine=self.engine)
+            lexer.seek(base)
+            result._scan(lexer, 0, self, new_end, delta)
+            raise
+
+        self._copy(result, sync, len(self), delta)
+        if result._depth >= _MAX_EDIT_DEPTH:
+            result.source  # Drops the old streams
+            result._columns()
         return result
 
+    def _append(self, ids: array, starts: array, ends: array, lo: int, hi: int, delta: int):
+        """ Appends the tokens from lo to hi (excluded) of the arrays, adding delta to their offsets
+        """
+        if lo == hi:
+            return
+
+        segments = self._segments
+        if segments and segments[-1].ids is ids and segments[-1].hi == lo and segments[-1].delta == delta:
+            segments[-1] = segments[-1]._replace(hi=hi)  # Continues it
+            self._counts[-1] += hi - lo
+            self._lasts[-1] = ends[hi - 1] + delta
+        else:
+            segments.append(_Segment(ids, starts, ends, lo, hi, delta))
+            self._counts.append(len(self) + hi - lo)
+            self._firsts.append(starts[lo] + delta)
+            self._lasts.append(ends[hi - 1] + delta)
+
+    def _copy(self, result: 'TokenStream', lo: int, hi: int, delta: int):
+        """ Appends the tokens from lo to hi (excluded) to the result, shifted delta chars (sharing the arrays)
+        """
+        counts = self._counts
+        k = bisect_right(counts, lo)
+        while lo < hi:
+            segment = self._segments[k]
+            first = counts[k - 1] if k else 0
+            end = min(hi, counts[k])
+            result._append(segment.ids, segment.starts, segment.ends, segment.lo + lo - first,
+                           segment.lo + end - first, segment.delta + delta)
+            lo = end
+            k += 1
+
+    def _columns(self) -> Tuple[array, array, array]:
+        """ The ids, starts and ends arrays of the stream, joining its segments into a single one
+        """
+        if not self._segments:
+            return array('i'), array('i'), array('i')
+
+        ids, starts, ends, lo, hi, delta = self._segments[0]
+        if len(self._segments) > 1 or lo or hi != len(ids) or delta:
+            ids, starts, ends = array('i'), array('i'), array('i')
+            for segment in self._segments:
+                ids.extend(segment.ids[segment.lo:segment.hi])
+                starts.extend(_shifted(segment.starts[segment.lo:segment.hi], segment.delta))
+                ends.extend(_shifted(segment.ends[segment.lo:segment.hi], segment.delta))
+
+            self._segments, self._counts, self._firsts, self._lasts = [], [], [], []
+            self._append(ids, starts, ends, 0, len(ids), 0)
+
+        return ids, starts, ends
+
+    def _token(self, i: int) -> Tuple[int, int, int]:
+        """ Id, start and end of the i-th token
+        """
+        k = bisect_right(self._counts, i)
+        segment = self._segments[k]
+        j = segment.lo + i - (self._counts[k - 1] if k else 0)
+        return segment.ids[j], segment.starts[j] + segment.delta, segment.ends[j] + segment.delta
+
+    def _ending_after(self, offset: int) -> int:
+        """ Index of the first token ending after the offset (the length of the stream if none)
+        """
+        k = bisect_right(self._lasts, offset)
+        if k == len(self._segments):
+            return len(self)
+
+        ids, starts, ends, lo, hi, delta = self._segments[k]
+        return (self._counts[k - 1] if k else 0) + bisect_right(ends, offset - delta, lo, hi) - lo
+
+    def _starting_at(self, offset: int) -> Optional[int]:
+        """ Index of the token starting at the offset, if any
+        """
+        k = bisect_right(self._firsts, offset) - 1
+        if k < 0:
+            return None
+
+        ids, starts, ends, lo, hi, delta = self._segments[k]
+        j = bisect_left(starts, offset - delta, lo, hi)
+        return (self._counts[k - 1] if k else 0) + j - lo if j < hi and starts[j] == offset - delta else None
+
+    def _text(self, start: int, end: int) -> str:
+        """ Returns source[start:end], without building the whole source
+        """
+        pieces = []
+        pending = [(self, start, end)]  # Stream and range of its source, or text, left to add (in reverse)
+        while pending:
+            item = pending.pop()
+            if isinstance(item, str):
+                pieces.append(item)
+                continue
+
+            stream, start, end = item
+            if stream._source is not None:
+                pieces.append(stream._source[start:end])
+                continue
+
+            old, offset, removed, inserted = stream._edit
+            new_end = offset + len(inserted)
+            delta = len(inserted) - removed
+            if end > new_end:
+                pending.append((old, max(start, new_end) - delta, end - delta))
+            if start < new_end and end > offset:
+                pending.append(inserted[max(start, offset) - offset:min(end, new_end) - offset])
+            if start < offset:
+                pending.append((old, start, min(end, offset)))
+
+        return ''.join(pieces)
+
+    def __len__(self) -> int:
+        return self._counts[-1] if self._counts else 0
+
+    def __getitem__(self, i: int) -> Token:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('token index out of range')
+
+        id_, start, _ = self._token(i)
+        return Token(TokenID(id_), start, self.value(i), self.line_index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def value(self, i: int) -> str:
+        """ Returns the value of the i-th token, as the Lexer would do
+        """
+        id_, start, end = self._token(i)
+        text = self._source[start:end] if self._source is not None else self._text(start, end)
+
+        if id_ == TokenID.STR_LITERAL:
+            return _ESCAPED_CHAR.sub(r'\1', text[1:-1])
+        if id_ == TokenID.CHAR_LITERAL:
+            return text[1]
+        if id_ == TokenID.FLOAT_LITERAL:
+            return text.replace('E', 'e')
+
+        return text
+
 
 if __name__ == '__main__':
     l = Lexer(sys.argv[1])
@@ -21,7 +21,7 @@ class LogLevel(Enum):
 SEVERITY = LogLevel.WARNING
 OUTPUT: TextIO = sys.stderr
 ERROR_COUNT = 0
-MAX_ERRORS_ALLOWED = 1
+MAX_ERRORS_ALLOWED = 1  # 0 means no limit
 
 
 class CriticalError(BaseException):
@@ -41,7 +41,7 @@ def log(msg: str, loglevel: LogLevel = None):
 
     if loglevel >= LogLevel.ERROR:
         ERROR_COUNT += 1
-        if ERROR_COUNT >= MAX_ERRORS_ALLOWED:
+        if MAX_ERRORS_ALLOWED and ERROR_COUNT >= MAX_ERRORS_ALLOWED:
             sys.exit(1)
 
     if loglevel >= LogLevel.CRITICAL:
@@ -50,3 +50,7 @@ def log(msg: str, loglevel: LogLevel = None):
 
 def error(msg: str):
     log(msg, LogLevel.ERROR)
+
+
+def warning(msg: str):
+    log(msg, LogLevel.WARNING)
@@ -3,22 +3,224 @@
 import argparse
 import sys
 import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Sequence, TextIO, Tuple
 
+from lexer import LexException
 from parser import Parser
+from interface import Interface
 import visitor
+import log
+
+
+SOURCE_EXTENSION = '.ph'
+INTERFACE_EXTENSION = '.phi'
+
+
+def load_interfaces(paths: List[str]) -> List[Interface]:
+    """ Loads the given interface files (see write_interface()). Raises OSError or ValueError
+    """
+    result = []
+    for path in paths:
+        with open(path, 'rt', encoding='utf-8') as f:
+            result.append(Interface.loads(f.read()))
+    return result
+
+
+def translate(parser: Parser, output: TextIO, pipelined: bool = False, interfaces: Sequence[Interface] = ()) -> bool:
+    """ Writes the C translation unit of the program to output, sentence by sentence as they are
+    parsed (in another thread if pipelined), once the given interfaces are declared in its scope.
+    Returns False on errors (the output is incomplete then). Syntax errors are reported before the
+    ones translating the sentences (which are only raised if the program has no syntax errors),
+    as if it was translated once parsed.
+    """
+    for interface in interfaces:
+        parser.declare_interface(interface)
+    if log.ERROR_COUNT:
+        return False
+
+    vis = visitor.Visitor(output)
+    sentences = parser.iter_program_threaded() if pipelined else parser.iter_program()
+    try:
+        vis.visit_sentences(sentences)
+    except Exception:
+        for _ in sentences:  # Parses the rest of the program, for its syntax errors
+            pass
+        if not log.ERROR_COUNT:
+            raise
+
+    return not log.ERROR_COUNT
+
+
+def write_interface(text: str, output: TextIO, recover: bool = False) -> bool:
+    """ Writes the interface of the program in text (its function signatures, see interface.Interface)
+    to output. Function bodies are skipped, not parsed. Returns False on errors (nothing is written then).
+    """
+    program = Parser(io.StringIO(text), recover=recover, lazy_bodies=True).parse_program()
+    if program is None or log.ERROR_COUNT:
+        return False
+
+    output.write(Interface.from_program(program, text).dumps())
+    return True
+
+
+def compile_file(source: str, target: str, max_errors: int, interface: bool = False,
+                 interfaces: Sequence[Interface] = ()) -> Tuple[bool, str]:
+    """ Compiles the source file into the target one (or writes its interface to it), with the
+    functions of the given interfaces declared. Returns
+    (success, diagnostics). Runs in the worker processes of a batch, so the log state is reset for every file.
+    Lexical errors, files which cannot be read or written and internal errors are reported in the diagnostics too.
+    """
+    diagnostics = io.StringIO()
+    log.OUTPUT, log.ERROR_COUNT, log.MAX_ERRORS_ALLOWED = diagnostics, 0, max_errors
+    output = io.StringIO()
+    try:
+        with open(source, 'rt', encoding='utf-8') as f:  # Closed even if the parsing stops before the end
+            if interface:
+                success = write_interface(f.read(), output, recover=max_errors != 1)
+            else:
+                success = translate(Parser(f, streaming=True, recover=max_errors != 1), output,
+                                    interfaces=interfaces)
+        if success:
+            with open(target, 'wt', encoding='utf-8') as f:
+                f.write(output.getvalue() if interface else output.getvalue() + '\n')
+    except SystemExit:  # Too many errors
+        success = False
+    except (LexException, OSError, UnicodeDecodeError) as e:
+        diagnostics.write('{}: {}\n'.format(log.LogLevel.ERROR, e))  # Not logged, as it could exit
+        success = False
+    except Exception as e:  # A compiler bug, reported so the rest of the batch goes on
+        diagnostics.write('{}: internal error: {}: {}\n'.format(log.LogLevel.ERROR, type(e).__name__, e))
+        success = False
+
+    return success, diagnostics.getvalue()
+
+
+def _compile_job(job: Tuple[str, str, int, bool, Sequence[Interface]]) -> Tuple[bool, str]:
+    return compile_file(*job)
+
+
+def find_sources(paths: List[str]) -> List[Tuple[str, str]]:
+    """ Returns the (source file, path relative to its input argument) of every file given,
+    and of every SOURCE_EXTENSION file within the given directories (recursively, sorted)
+    """
+    result = []
+    for path in paths:
+        if not os.path.isdir(path):
+            result.append((path, os.path.basename(path)))
+            continue
+
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith(SOURCE_EXTENSION):
+                    source = os.path.join(root, name)
+                    result.append((source, os.path.relpath(source, path)))
+
+    return result
+
+
+def target_name(source: str, relpath: str, output_dir: str = None, extension: str = '.c') -> str:
+    """ <name>.c (or the given extension) next to the source, or at the same relative path within output_dir
+    """
+    path = source if output_dir is None else os.path.join(output_dir, relpath)
+    return os.path.splitext(path)[0] + extension
+
+
+def compile_batch(paths: List[str], output_dir: str = None, jobs: int = 1, max_errors: int = 1,
+                  interface: bool = False, interfaces: Sequence[Interface] = ()) -> int:
+    """ Compiles every given file and directory (or writes their interfaces to <name>.phi files),
+    reusing jobs worker processes across files. The functions of the given interfaces are declared
+    in every program. Diagnostics are written to log.OUTPUT in the order
+    of the files. Returns the number of files which could not be compiled.
+    """
+    start = time.perf_counter()
+    batch = []
+    for source, relpath in find_sources(paths):
+        target = target_name(source, relpath, output_dir, INTERFACE_EXTENSION if interface else '.c')
+        os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+        batch.append((source, target, max_errors, interface, interfaces))
+
+    output, error_count, max_errors_allowed = log.OUTPUT, log.ERROR_COUNT, log.MAX_ERRORS_ALLOWED
+    try:
+        if jobs > 1 and len(batch) > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                results = list(executor.map(_compile_job, batch, chunksize=max(1, len(batch) // (jobs * 4))))
+        else:
+            results = [_compile_job(job) for job in batch]
+    finally:
+        log.OUTPUT, log.ERROR_COUNT, log.MAX_ERRORS_ALLOWED = output, error_count, max_errors_allowed
+
+    failed = 0
+    for (source, *_), (success, diagnostics) in zip(batch, results):
+        failed += not success
+        for line in diagnostics.splitlines():
+            log.OUTPUT.write('{}: {}\n'.format(source, line))
+
+    elapsed = time.perf_counter() - start
+    print('compiled {} files ({} failed) in {:.3f}s: {:.1f} files/s'.format(
+        len(batch), failed, elapsed, len(batch) / elapsed if elapsed else 0.0), file=sys.stderr)
+    return failed
 
 
 def main(argv):
     arg_parser = argparse.ArgumentParser()
-    arg_parser.add_argument('FILENAME', type=str, help='Program name')
+    arg_parser.add_argument('FILENAME', type=str, nargs='+',
+                            help="Program names or directories ('-' reads a program from stdin). A single "
+                                 "program is translated to stdout, otherwise to <name>.c files")
+    arg_parser.add_argument('--stats', action='store_true', help='Prints compilation stats to stderr')
+    arg_parser.add_argument('--max-errors', type=int, default=log.MAX_ERRORS_ALLOWED,
+                            help='Stops after this number of errors (0 = no limit, default: %(default)s)')
+    arg_parser.add_argument('-o', '--output-dir', type=str, default=None,
+                            help='Directory for the <name>.c files (default: next to each program)')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes')
+    arg_parser.add_argument('--pipeline', action='store_true',
+                            help='Emits a single program while parsing it, in another thread, '
+                                 'instead of once it is parsed without errors')
+    arg_parser.add_argument('--interface', action='store_true',
+                            help='Writes the interface of the programs (their function signatures) instead of '
+                                 'translating them, to <name>{} files (to stdout for \'-\')'.format(INTERFACE_EXTENSION))
+    arg_parser.add_argument('-i', '--import', dest='imports', type=str, action='append', default=[],
+                            metavar='INTERFACE',
+                            help='Declares the functions of an interface file (written with --interface) in the '
+                                 'programs translated, without parsing its source. Can be given several times')
 
     options = arg_parser.parse_args(argv[1:])
-    parser = Parser(options.FILENAME)
-    ast_ = parser.parse_program()
-    strout = io.StringIO()
-    vis = visitor.Visitor(strout, ast_)
-    vis.visit()
-    print(strout.getvalue())
+    if options.jobs < 1:
+        arg_parser.error('the number of jobs must be at least 1')
+    try:
+        interfaces = load_interfaces(options.imports)
+    except (OSError, ValueError) as e:
+        arg_parser.error('cannot load interface: {}'.format(e))
+
+    if options.interface and options.FILENAME == ['-']:
+        log.MAX_ERRORS_ALLOWED = options.max_errors
+        if not write_interface(sys.stdin.read(), sys.stdout, recover=options.max_errors != 1):
+            sys.exit(1)
+        return
+
+    if (len(options.FILENAME) > 1 or options.output_dir is not None or os.path.isdir(options.FILENAME[0])
+            or options.interface):
+        if '-' in options.FILENAME:
+            arg_parser.error("'-' can only be used alone")
+        if compile_batch(options.FILENAME, options.output_dir, options.jobs, options.max_errors, options.interface,
+                         interfaces):
+            sys.exit(1)
+        return
+
+    log.MAX_ERRORS_ALLOWED = options.max_errors
+    recover = options.max_errors != 1
+    parser = Parser(sys.stdin if options.FILENAME[0] == '-' else options.FILENAME[0], streaming=True, recover=recover)
+    output = sys.stdout if options.pipeline else io.StringIO()
+    success = translate(parser, output, pipelined=options.pipeline, interfaces=interfaces)
+    if options.stats:
+        print(parser.string_table.stats(), file=sys.stderr)
+        print(parser.symbol_table.stats(), file=sys.stderr)
+    if not success:
+        sys.exit(1)
+    print(output.getvalue() if output is not sys.stdout else '')
 
 if __name__ == '__main__':
     main(sys.argv)
@@ -1,11 +1,20 @@
 # -*- coding: utf-8 -*-
 
-from typing import Union, TextIO, List, Optional
+import queue
+import re
+import threading
+from bisect import bisect_right
+from collections import Counter
+from itertools import chain
+from types import GeneratorType
+from typing import Callable, FrozenSet, Generator, Iterator, NamedTuple, Union, TextIO, List, Optional, Dict, Set, Tuple
 from io import StringIO
 
 from lexer import Lexer, Token, TokenID, TOKEN_MAP
 import ast_
-from symbol_table import SymbolTable
+from symbol_table import Scope, SymbolTable
+from interface import Interface
+from string_table import StringTable
 import log
 
 
@@ -14,39 +23,201 @@ class ParserSyntaxErrorException(BaseException):
 
 
 # Binary operator precedence (higher value, higher priority)
-OPERATOR_PRECEDENCE = {
-    '>': 10,
-    '<': 10,
-    '==': 10,
-    '<=': 10,
-    '>=': 10,
-    '!=': 10,
-    '+': 20,
-    '-': 20,
-    '*': 30,
-    '/': 30,
-    '%': 30,
-    '**': 40,
+OPERATOR_PRECEDENCE: Dict[TokenID, int] = {
+    TokenID.GT: 10,
+    TokenID.LT: 10,
+    TokenID.EQ: 10,
+    TokenID.LE: 10,
+    TokenID.GE: 10,
+    TokenID.NE: 10,
+    TokenID.PLUS: 20,
+    TokenID.MINUS: 20,
+    TokenID.MUL: 30,
+    TokenID.DIV: 30,
+    TokenID.MOD: 30,
+    TokenID.POW: 40,
 }
 
+# Binary operators which are right associative (i.e. 2 ** 3 ** 2 == 2 ** (3 ** 2))
+RIGHT_ASSOCIATIVE_OPERATORS = {TokenID.POW}
+
+# (precedence, is right associative) of every TokenID, indexed by it. Precedence is 0 for non binary operators
+_BINARY_OPERATORS: List[Tuple[int, bool]] = [
+    (OPERATOR_PRECEDENCE.get(id_, 0), id_ in RIGHT_ASSOCIATIVE_OPERATORS) for id_ in range(max(TokenID) + 1)
+]
+
+
+def _make_primitive_types() -> List[ast_.PrimitiveScalarTypeAST]:
+    """ Returns the AST of every primitive type. They are immutable, so all parsers share them
+    """
+    result = []
+    for type_name in ast_.PRIMITIVE_TYPES:
+        token = Token(TokenID.ID, 0, type_name)
+
+        if type_name in ('str', 'char', 'bool'):
+            result.append(ast_.PrimitiveScalarTypeAST(token))
+        elif type_name.startswith('u'):  # Unsigned?
+            result.append(ast_.UnsignedIntType(token))
+        else:
+            result.append(ast_.SignedIntType(token))
+
+    return result
+
+
+def _int_literal_index(types: List[ast_.TypeAST]) -> Tuple[List[int], List[Optional[ast_.IntTypeAST]]]:
+    """ Returns a sorted range index of the integer types, as (bounds, types), where types[i] is the type
+    of the integer literals in [bounds[i - 1], bounds[i]): the first one (in declaration order) whose range
+    includes them, or None if there's none. So the type of a literal is types[bisect_right(bounds, value)].
+    """
+    int_types = [x for x in types if isinstance(x, ast_.IntTypeAST)]
+    bounds = sorted({x.min_val for x in int_types} | {x.max_val + 1 for x in int_types})
+    result = [None]
+    for start in bounds:
+        result.append(next((x for x in int_types if x.min_val <= start <= x.max_val), None))
+
+    return bounds, result
+
+
+PRIMITIVE_TYPE_ASTS: List[ast_.PrimitiveScalarTypeAST] = _make_primitive_types()
+FLOAT_TYPE, STR_TYPE, CHAR_TYPE = (next(x for x in PRIMITIVE_TYPE_ASTS if x.name == name)
+                                   for name in ('float', 'str', 'char'))
+_INT_LITERAL_BOUNDS, _INT_LITERAL_TYPES = _int_literal_index(PRIMITIVE_TYPE_ASTS)
+
+# Tokens starting a sentence. On error recovery, parsing resumes at them
+SENTENCE_START_TOKENS = {TokenID.VAR, TokenID.IF, TokenID.WHILE, TokenID.FN, TokenID.RETURN}
+
+# Tokens an expression can start with
+EXPRESSION_FIRST = frozenset({TokenID.ID, TokenID.INT_LITERAL, TokenID.FLOAT_LITERAL, TokenID.STR_LITERAL,
+                              TokenID.CHAR_LITERAL, TokenID.LP, TokenID.PLUS, TokenID.MINUS})
+
+
+class Statement(NamedTuple):
+    """ A production of the sentence grammar
+    """
+    name: str
+    first: FrozenSet[TokenID]  # FIRST set: the tokens the sentence can start with
+    handler: str  # Name of the Parser method parsing it (returning the sentence, or the steps to parse it)
+    second: Optional[FrozenSet[TokenID]] = None  # If given, the token after the first one must be in it (LL(2))
+
+
+class OldSentences(NamedTuple):
+    """ The top level sentences of the last program parsed, while parsing it again (see Parser.reparse())
+    """
+    starts: List[int]  # Source offsets in the old text
+    symbols: List[List[Tuple[Scope, int]]]  # Keys of the symbols each one declared
+    delta: int  # Shift of the sentences after the edit
+    removed: List[Tuple[Scope, int, ast_.TypeAST]]  # Symbols removed so far (added back on errors)
+    changed: Set[int]  # Ids of the names declared or removed by the sentences parsed again
+    taken: Dict[int, Set[Tuple[int, int]]]  # (scope id, name id) of the symbols taken over from each kept one
+
+# Steps of parsing a construct: a generator which yields the steps of parsing each
+# of its nested sentences (or their result, if parsed already), gets their result
+# back, and returns the construct result (see Parser.parse_steps())
+ParseSteps = Generator[Union['ParseSteps', Optional[ast_.AST]], Optional[ast_.AST], Optional[ast_.AST]]
+# Parses a sentence (or returns the steps to parse it)
+StatementHandler = Callable[['Parser'], Union[ParseSteps, Optional[ast_.AST]]]
+
+# Runs of identifier chars
+_WORD_RUN = re.compile(r'\w*')
+
+
+def _common_prefix_length(a: str, b: str) -> int:
+    """ Length of the longest common prefix of both strings, found by bisection
+    (so the chars are compared by slices, not one by one)
+    """
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) >> 1
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+
+    return lo
+
+
+def _common_suffix_length(a: str, b: str, limit: int) -> int:
+    """ Length of the longest common suffix of both strings, up to limit chars
+    """
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) >> 1
+        if a[len(a) - mid:len(a) - lo] == b[len(b) - mid:len(b) - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+
+    return lo
+
 
 class Parser:
     """ Implements an LL parser
     """
     lookahead: Token
 
+    # Sentence grammar. Sentences are parsed by the handler of the production for the lookahead
+    # (see build_statement_dispatch()). Subclasses can extend it
+    statements: List[Statement] = [
+        Statement('var', frozenset({TokenID.VAR}), 'match_var_decl'),
+        Statement('assignment', frozenset({TokenID.ID}), 'match_var_assignment', frozenset({TokenID.ASSIGN})),
+        Statement('if', frozenset({TokenID.IF}), 'if_sentence_steps'),
+        Statement('while', frozenset({TokenID.WHILE}), 'while_sentence_steps'),
+        Statement('return', frozenset({TokenID.RETURN}), 'match_return_sentence'),
+        Statement('fn', frozenset({TokenID.FN}), 'funcdecl_steps'),
+        Statement('expression', EXPRESSION_FIRST, 'match_expression_sentence'),
+    ]
+    # Handler of the sentences starting with each TokenID, indexed by it
+    _statement_dispatch: List[StatementHandler]
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._statement_dispatch = build_statement_dispatch(cls)
+
     def __init__(self,
                  input_stream: Union[str, TextIO, StringIO],
-                 encoding: str = 'utf-8'
+                 encoding: str = 'utf-8',
+                 engine: str = 'char',
+                 streaming: bool = False,
+                 recover: bool = False,
+                 lazy_bodies: bool = False
                  ):
+        """ If recover is True, a sentence with syntax errors does not stop the parsing: it's
+        replaced by an ErrorAST node and the parser goes on with the next one (panic mode),
+        so every error is reported in a single pass (see log.MAX_ERRORS_ALLOWED).
+        If lazy_bodies is True, function bodies are skipped (only checking their braces match),
+        and parsed on first access to them. Not available in streaming mode.
+        """
+        assert not (lazy_bodies and streaming), "Cannot parse function bodies lazily in streaming mode"
+        self.string_table = StringTable()  # Shared by the lexer and the symbol table
         self.lex = Lexer(
             input_stream=input_stream,
-            encoding=encoding
+            encoding=encoding,
+            engine=engine,
+            streaming=streaming,
+            string_table=self.string_table
         )
+        self.engine = engine
+        self.streaming = streaming
         self.lookahead = self.lex.get_token()
-        self.symbol_table = SymbolTable()
+        self.symbol_table = SymbolTable(string_table=self.string_table)
         self.primitive_types = []
         self.scope_counter = 0
+        self.recover = recover
+        self.lazy_bodies = lazy_bodies
+
+        # Last program parsed, and the source offset of each of its sentences and
+        # the keys of the symbols each one declared (for incremental parsing)
+        self.program: Optional[ast_.BlockAST] = None
+        self.sentence_starts: List[int] = []
+        self.sentence_symbols: List[List[Tuple[Scope, int]]] = []
+        self.sentence_names: List[Set[int]] = []  # Ids of the names each one depends on (see depend_on())
+        self._dependencies: Dict[int, int] = Counter()  # Number of sentences depending on each name id
+        self._main_scope: Optional[str] = None
+        self._current_symbols: Optional[List[Tuple[Scope, int]]] = None  # Symbols of the current top level sentence
+        self._current_names: Optional[Set[int]] = None  # And the names it depends on
+        # While reparsing, the old sentences and the index of the first one whose symbols are still declared
+        self._old_sentences: Optional[OldSentences] = None
+        self._old_sentence = 0
 
         # Populates symbol table
         self._declare_primitive_types()
@@ -60,17 +231,8 @@ class Parser:
     def _declare_primitive_types(self):
         """ Declares primitive types
         """
-        for type_name in ast_.PRIMITIVE_TYPES:
-            token = Token(TokenID.ID, 0, 0, type_name)
-
-            if type_name in ('str', 'char', 'bool'):
-                type_ = ast_.PrimitiveScalarTypeAST(token)
-            elif type_name.startswith('u'):  # Unsigned?
-                type_ = ast_.UnsignedIntType(token)
-            else:
-                type_ = ast_.SignedIntType(token)
-
-            self.symbol_table.declare_symbol(token, type_)
+        for type_ in PRIMITIVE_TYPE_ASTS:
+            self.symbol_table.declare_symbol(type_.token, type_)
             self.primitive_types.append(type_)
 
     def start_scope(self, id_: str = None):
@@ -89,6 +251,24 @@ class Parser:
         """
         self.symbol_table.pop_scope()
 
+    def start_program_scope(self):
+        """ Starts the scope of the program, nested in the global one (with the primitive types).
+        It's the same every time (i.e. for the interfaces declared before parsing the program)
+        """
+        if self._main_scope is None:
+            self._main_scope = 'S{}'.format(self.scope_counter)
+            self.scope_counter += 1
+        self.start_scope(self._main_scope)
+
+    def declare_interface(self, interface: Interface) -> bool:
+        """ Declares the functions of the interface (of another source) in the scope of the program,
+        before parsing it. Returns False on errors
+        """
+        self.start_program_scope()
+        success = interface.declare(self.symbol_table)
+        self.end_scope()
+        return success
+
     @property
     def current_scope(self) -> str:
         """ Returns current scope in use
@@ -110,29 +290,67 @@ class Parser:
 
         result: List[Token] = []
         for tok in tokens:
-            if self.lookahead.id_ == tok:
-                result.append(self.lookahead)
-                self.lookahead = self.lex.get_token()
-            else:
+            if self.lookahead.id_ != tok:
                 self.error_unexpected_token()
+                return []
+
+            result.append(self.lookahead)
+            self.lookahead = self.lex.get_token()
+
+        return result
+
+    def synchronize(self, start: Token):
+        """ Panic mode: skips tokens up to a point where parsing can go on, that is,
+        past a ';' or before a '}' or a sentence start token, not counting those
+        within skipped braces. start is the first token of the sentence with errors.
+        If it was not consumed, it's skipped too, so the parser always makes progress.
+        A '}' it stops before is left to the enclosing block (or reported on its own at the top level).
+        """
+        depth = 0  # Nesting level of the skipped braces
+        while self.lookahead.id_ != TokenID.EOF:
+            id_ = self.lookahead.id_
+            if not depth:
+                if id_ == TokenID.SC:
+                    self.lookahead = self.lex.get_token()
+                    return
+                if (id_ == TokenID.RBR or id_ in SENTENCE_START_TOKENS) and self.lookahead is not start:
+                    return
+
+            if id_ == TokenID.LBR:
+                depth += 1
+            elif id_ == TokenID.RBR and depth:
+                depth -= 1
+            self.lookahead = self.lex.get_token()
+
+    def recover_sentence(self, start: Token, scope_depth: int) -> ast_.ErrorAST:
+        """ Recovers from a syntax error in the sentence starting at the given token:
+        closes the scopes it left open, and skips the rest of it.
+        """
+        while self.symbol_table.scope_depth > scope_depth:
+            self.end_scope()
+
+        self.synchronize(start)
+        return ast_.ErrorAST(start)
+
+    def match_sentence_or_error(self) -> Union[None, ast_.BlockAST, ast_.SentenceAST]:
+        """ Like match_sentence_or_block(), but returns an ErrorAST on syntax errors
+        if error recovery is enabled.
+        """
+        start = self.lookahead
+        scope_depth = self.symbol_table.scope_depth
+        result = self.match_sentence_or_block()
+        if result is None and self.recover:
+            return self.recover_sentence(start, scope_depth)
 
         return result
 
     def match_number_literal(self) -> Optional[ast_.NumericLiteralAST]:
         if self.lookahead == TokenID.INT_LITERAL:
             token = self.match(TokenID.INT_LITERAL)[0]
-            for t in self.primitive_types:
-                if not isinstance(t, ast_.IntTypeAST):
-                    continue
-
-                if t.min_val <= token.num_val <= t.max_val:
-                    type_ = t
-                    break
-            else:
-                type_ = self.symbol_table.resolve_symbol('float')
+            type_ = _INT_LITERAL_TYPES[bisect_right(_INT_LITERAL_BOUNDS, token.num_val)] or FLOAT_TYPE
         elif self.lookahead == TokenID.FLOAT_LITERAL:
             token = self.match(TokenID.FLOAT_LITERAL)[0]
-            type_ = self.symbol_table.resolve_symbol('float')
+            type_ = FLOAT_TYPE
         else:
             self.error_unexpected_token()
             return None
@@ -153,9 +371,13 @@ class Parser:
             return None
 
         token = token[0]
-        type_ = self.symbol_table.resolve_symbol(token.value)
+        name_id = self.symbol_table.name_id(token)
+        self.depend_on(name_id)
+        self.take_over_lookup(name_id)
+        type_ = self.symbol_table.resolve_id(name_id)
         if type_ is None:
             self.error(token.line, "unknown type {}".format(token.value))
+            return None
 
         if not isinstance(type_, ast_.TypeAST):
             self.error(token.line, "{} is not a type".format(token.value))
@@ -168,7 +390,7 @@ class Parser:
             return
 
         result = ast_.StringLiteralAST(token[0])
-        result.type = self.symbol_table.resolve_symbol('str')
+        result.type = STR_TYPE
         return result
 
     def match_char_literal(self) -> Optional[ast_.CharLiteralAST]:
@@ -177,7 +399,7 @@ class Parser:
             return
 
         result = ast_.CharLiteralAST(token[0])
-        result.type = self.symbol_table.resolve_symbol('char')
+        result.type = CHAR_TYPE
         return result
 
     def match_primary(self) -> Union[None, ast_.NumericLiteralAST, ast_.StringLiteralAST, ast_.CharLiteralAST]:
@@ -192,7 +414,8 @@ class Parser:
         if self.lookahead == TokenID.LP:
             self.match(TokenID.LP)
             result = self.match_binary_or_unary()
-            self.match(TokenID.RP)
+            if result is None or not self.match(TokenID.RP):
+                return None
             return result
         if self.lookahead == TokenID.ID:
             return self.match_id_or_fcall()
@@ -205,65 +428,79 @@ class Parser:
                                    ast_.StringLiteralAST,
                                    ast_.CharLiteralAST,
                                    ast_.UnaryExprAST]:
-        if self.lookahead in (TokenID.PLUS, TokenID.MINUS):
-            oper = self.lookahead
+        opers: List[Token] = []
+        while self.lookahead.id_ in (TokenID.PLUS, TokenID.MINUS):
+            opers.append(self.lookahead)
             self.lookahead = self.lex.get_token()
             if self.lookahead in (TokenID.CHAR_LITERAL, TokenID.STR_LITERAL):
                 self.error_unexpected_token()
                 return None
 
-            primary = self.match_unary()
-            if primary is None:
-                return None
-
-            return ast_.UnaryExprAST(op=oper, primary=primary)
-
-        return self.match_primary()
-
-    def match_binary_right_side(self, left: Union[ast_.UnaryExprAST, ast_.BinaryExprAST]) \
-            -> Union[None, ast_.UnaryExprAST, ast_.BinaryExprAST]:
-        oper = self.lookahead
-        self.lookahead = self.lex.get_token()
-
-        right = self.match_unary()
-        if right is None:
+        result = self.match_primary()
+        if result is None:
             return None
 
-        if self.lookahead.value not in OPERATOR_PRECEDENCE or \
-                OPERATOR_PRECEDENCE[oper.value] >= OPERATOR_PRECEDENCE[self.lookahead.value]:
-            return ast_.BinaryExprAST(op=oper, left=left, right=right)
-
-        # Another operator
-        right = self.match_binary_right_side(right)
-        if right is None:
-            return None
+        for oper in reversed(opers):
+            result = ast_.UnaryExprAST(op=oper, primary=result)
 
-        return ast_.BinaryExprAST(op=oper, left=left, right=right)
+        return result
 
     def match_binary_or_unary(self) -> Union[None, ast_.UnaryExprAST, ast_.BinaryExprAST]:
+        """ Matches an expression with binary operators by (iterative) precedence climbing:
+        operands and operators are pushed to stacks, and the stacked operators which bind
+        tighter than the incoming one are reduced first.
+        """
         left = self.match_unary()
         if left is None:
             return None
 
-        while self.lookahead.value in OPERATOR_PRECEDENCE:
-            left = self.match_binary_right_side(left)
+        operands = [left]
+        operators: List[Tuple[Token, int]] = []  # (operator, precedence)
 
-        return left
+        while True:
+            oper = self.lookahead
+            precedence, right_associative = _BINARY_OPERATORS[oper.id_]
+            if not precedence:
+                break
+
+            while operators and (operators[-1][1] > precedence or
+                                 operators[-1][1] == precedence and not right_associative):
+                right = operands.pop()
+                operands[-1] = ast_.BinaryExprAST(op=operators.pop()[0], left=operands[-1], right=right)
+
+            self.lookahead = self.lex.get_token()
+            right = self.match_unary()
+            if right is None:
+                return None
+
+            operators.append((oper, precedence))
+            operands.append(right)
+
+        while operators:
+            right = operands.pop()
+            operands[-1] = ast_.BinaryExprAST(op=operators.pop()[0], left=operands[-1], right=right)
+
+        return operands[0]
 
     def match_arg_list(self) -> Optional[ast_.ArgListAST]:
-        self.match(TokenID.LP)
+        if not self.match(TokenID.LP):
+            return None
         args = []
 
         while True:
             if self.lookahead == TokenID.RP:
                 break
-            args.append(self.match_binary_or_unary())
+            arg = self.match_binary_or_unary()
+            if arg is None:
+                return None
+            args.append(arg)
 
             if self.lookahead != TokenID.COMMA:
                 break
             self.match(TokenID.COMMA)
 
-        self.match(TokenID.RP)
+        if not self.match(TokenID.RP):
+            return None
         return ast_.ArgListAST(args)
 
     def match_id_or_fcall(self) -> Union[None, ast_.IdAST, ast_.FunctionCallAST]:
@@ -297,7 +534,7 @@ class Parser:
 
     def match_typedecl(self) -> Optional[ast_.TypeAST]:
         token = self.match(TokenID.CO)
-        if token is None:
+        if not token:
             return None
 
         return self.match_type()
@@ -307,7 +544,7 @@ class Parser:
             return None
 
         result = self.match_param()  # a param is like a local variable
-        if not self.match(TokenID.SC):
+        if result is None or not self.match(TokenID.SC):
             return None
 
         return result
@@ -327,37 +564,66 @@ class Parser:
 
         return ast_.ReturnSentenceAST(expr)
 
-    def match_sentence(self) -> Optional[ast_.SentenceAST]:
-        if self.lookahead == TokenID.VAR:
-            result = self.match_var_decl()
-        elif self.lookahead == TokenID.ID and self.peek(1) == TokenID.ASSIGN:
-            result = self.match_var_assignment()
-        elif self.lookahead == TokenID.IF:
-            result = self.match_if_sentence()
-        elif self.lookahead == TokenID.WHILE:
-            result = self.match_while_sentence()
-        elif self.lookahead == TokenID.RETURN:
-            result = self.match_return_sentence()
-        elif self.lookahead == TokenID.FN:
-            result = self.match_funcdecl()
-        else:
-            result = self.match_binary_or_unary()
-            if result is not None:
-                tok = self.match(TokenID.SC)
-                if not tok:
-                    return None
+    @staticmethod
+    def parse_steps(steps: Union[ParseSteps, Optional[ast_.AST]]) -> Optional[ast_.AST]:
+        """ Runs the steps of parsing a construct, and returns its result. The steps of its
+        nested sentences are run in turn with an explicit stack, instead of recursively,
+        so the nesting depth is only limited by memory.
+        """
+        if not isinstance(steps, GeneratorType):
+            return steps  # Already parsed
+
+        stack: List[ParseSteps] = [steps]
+        result = None
+        while stack:
+            try:
+                nested = stack[-1].send(result)
+            except StopIteration as stop:
+                stack.pop()
+                result = stop.value
+                continue
+
+            if isinstance(nested, GeneratorType):
+                stack.append(nested)
+                result = None
+            else:
+                result = nested
 
         return result
 
-    def match_if_sentence(self) -> Optional[ast_.IfSentenceAST]:
+    def sentence_steps(self) -> Union[ParseSteps, Optional[ast_.SentenceAST]]:
+        """ Returns the steps of parsing the next sentence, or the sentence itself if it
+        has no nested sentences
+        """
+        return self._statement_dispatch[self.lookahead.id_](self)
+
+    def match_expression_sentence(self) -> Optional[ast_.ExpressionAST]:
+        result = self.match_binary_or_unary()
+        if result is not None:
+            tok = self.match(TokenID.SC)
+            if not tok:
+                return None
+
+        return result
+
+    def match_unexpected_sentence(self) -> None:
+        """ Handler of the tokens no sentence starts with
+        """
+        self.error_unexpected_token()
+        return None
+
+    def match_sentence(self) -> Optional[ast_.SentenceAST]:
+        return self.parse_steps(self.sentence_steps())
+
+    def if_sentence_steps(self) -> ParseSteps:
         if not self.match(TokenID.IF):
             return None
-        
+
         cond = self.match_binary_or_unary()
         if cond is None:
             return None
 
-        then = self.match_sentence_or_block()
+        then = yield self.sentence_or_block_steps()
         if then is None:
             return None
 
@@ -367,16 +633,16 @@ class Parser:
         if not self.match(TokenID.ELSE):
             return None
 
-        else_ = self.match_sentence_or_block()
+        else_ = yield self.sentence_or_block_steps()
         if else_ is None:
             return None
 
         return ast_.IfSentenceAST(cond, then, else_)
 
-    def match_block(self, enter_new_scope: bool = True) -> Optional[ast_.BlockAST]:
-        """ Will start a new block (which allows nested variable declarations if a new scope is entered).
-        If enter_new_scope is False, the scope remains the same.
-        """
+    def match_if_sentence(self) -> Optional[ast_.IfSentenceAST]:
+        return self.parse_steps(self.if_sentence_steps())
+
+    def block_steps(self, enter_new_scope: bool = True) -> ParseSteps:
         tokens = self.match(TokenID.LBR)
         if not tokens:
             return None
@@ -385,10 +651,14 @@ class Parser:
             self.start_scope()
 
         sentences: List[ast_.SentenceAST] = []
-        while self.lookahead != TokenID.RBR:
-            sentence = self.match_sentence_or_block()
+        while self.lookahead.id_ not in (TokenID.RBR, TokenID.EOF):
+            start = self.lookahead
+            scope_depth = self.symbol_table.scope_depth
+            sentence = yield self.sentence_or_block_steps()
             if sentence is None:
-                return None  # syntax error
+                if not self.recover:
+                    return None  # syntax error
+                sentence = self.recover_sentence(start, scope_depth)
 
             sentences.append(sentence)
 
@@ -401,11 +671,20 @@ class Parser:
 
         return ast_.BlockAST(sentences)
 
-    def match_sentence_or_block(self) -> Union[None, ast_.BlockAST, ast_.SentenceAST]:
+    def match_block(self, enter_new_scope: bool = True) -> Optional[ast_.BlockAST]:
+        """ Will start a new block (which allows nested variable declarations if a new scope is entered).
+        If enter_new_scope is False, the scope remains the same.
+        """
+        return self.parse_steps(self.block_steps(enter_new_scope))
+
+    def sentence_or_block_steps(self) -> Union[ParseSteps, Optional[ast_.SentenceAST]]:
         if self.lookahead == TokenID.LBR:
-            return self.match_block()
+            return self.block_steps()
+
+        return self.sentence_steps()
 
-        return self.match_sentence()
+    def match_sentence_or_block(self) -> Union[None, ast_.BlockAST, ast_.SentenceAST]:
+        return self.parse_steps(self.sentence_or_block_steps())
 
     def match_param(self) -> Optional[ast_.VarDeclAST]:
         """ An argument will be treated as a local variable in a new scope
@@ -418,7 +697,9 @@ class Parser:
         if type_ is None:
             return None
 
+        self.take_over(id_.token)
         if not self.symbol_table.declare_symbol(id_.token, type_):
+            self.depend_on(self.symbol_table.name_id(id_.token))
             return None
 
         return ast_.VarDeclAST(id_, type_)
@@ -444,7 +725,7 @@ class Parser:
 
         return ast_.ParamListAST(parameters)
 
-    def match_funcdecl(self) -> Optional[ast_.FunctionDeclAST]:
+    def funcdecl_steps(self) -> ParseSteps:
         token = self.match(TokenID.FN)
         if not token:
             return None
@@ -462,14 +743,77 @@ class Parser:
         if type_ is None:
             return None
 
-        block = self.match_block(enter_new_scope=False)
+        if self.lazy_bodies and self._old_sentences is None:  # Reparsed ones would see the symbols kept after them
+            block = self.skip_lazy_body()
+        else:
+            block = yield self.block_steps(enter_new_scope=False)
         if block is None:
             return None
 
         self.end_scope()
         return ast_.FunctionDeclAST(func, paramlist=params, type_=type_, body=block)
 
-    def match_while_sentence(self) -> Optional[ast_.WhileSentenceAST]:
+    def match_funcdecl(self) -> Optional[ast_.FunctionDeclAST]:
+        return self.parse_steps(self.funcdecl_steps())
+
+    def skip_block(self) -> bool:
+        """ Skips a block, just matching its braces. Returns False on error
+        """
+        if not self.match(TokenID.LBR):
+            return False
+
+        depth = 1
+        while depth:
+            id_ = self.lookahead.id_
+            if id_ == TokenID.LBR:
+                depth += 1
+            elif id_ == TokenID.RBR:
+                depth -= 1
+            elif id_ == TokenID.EOF:
+                self.error_unexpected_token()
+                return False
+            self.lookahead = self.lex.get_token()
+
+        return True
+
+    def skip_lazy_body(self) -> Optional[Callable[[], Optional[ast_.BlockAST]]]:
+        """ Skips a function body, returning a function which parses it (in the scope
+        of the function, which must be the current one)
+        """
+        lex, offset = self.lex, self.lookahead.offset
+        scope, symbols, names = self.symbol_table.snapshot(), self._current_symbols, self._current_names
+        if not self.skip_block():
+            return None
+
+        return lambda: self.match_lazy_body(lex, offset, scope, symbols, names)
+
+    def match_lazy_body(self, lex: Lexer, offset: int, scope: Scope, symbols: Optional[List[Tuple[Scope, int]]],
+                        names: Optional[Set[int]] = None) -> Optional[ast_.BlockAST]:
+        """ Parses a skipped function body starting at the given offset of the source of lex,
+        within the given scope. The keys of the symbols it declares are added to symbols,
+        and the ids of the names it depends on to names. The parser state is restored afterwards.
+        """
+        state = self.lex, self.lookahead, self.symbol_table.scope, self._current_names
+        declared = self.symbol_table.declared
+        mark = len(declared)
+        self.lex = lex.fork(offset)
+        self.lookahead = self.lex.get_token()
+        self.symbol_table.restore(scope)
+        self._current_names = set() if names is not None else None
+        try:
+            return self.match_block(enter_new_scope=False)
+        finally:
+            if symbols is not None:
+                symbols.extend(declared[mark:])
+            if names is not None:
+                new_names = self._current_names - names
+                names |= new_names
+                self._count_dependencies([new_names], 1)
+            del declared[mark:]
+            self.lex, self.lookahead, saved_scope, self._current_names = state
+            self.symbol_table.restore(saved_scope)
+
+    def while_sentence_steps(self) -> ParseSteps:
         if not self.match(TokenID.WHILE):
             return None
 
@@ -477,20 +821,343 @@ class Parser:
         if cond is None:
             return None
 
-        block = self.match_sentence_or_block()
+        block = yield self.sentence_or_block_steps()
         if block is None:
             return None
 
         return ast_.WhileSentenceAST(condition=cond, block=block)
 
+    def match_while_sentence(self) -> Optional[ast_.WhileSentenceAST]:
+        return self.parse_steps(self.while_sentence_steps())
+
+    def depend_on(self, name_id: int):
+        """ Records that the current top level sentence depends on the symbols with the given name
+        (it looked one up, or failed to declare one), so it's parsed again when they change (see reparse())
+        """
+        if self._current_names is not None:
+            self._current_names.add(name_id)
+
+    def _count_dependencies(self, sentence_names: List[Set[int]], count: int):
+        """ Adds count to the number of sentences depending on each name of the given sentences
+        """
+        dependencies = self._dependencies
+        for names in sentence_names:
+            for name_id in names:
+                dependencies[name_id] += count
+                if not dependencies[name_id]:
+                    del dependencies[name_id]
+
+    def take_over(self, token: Token):
+        """ While reparsing, removes the symbols of the old sentences after the edit which start
+        at or before the token (of the new text), as their text is being parsed again. If a kept
+        one declared the name of the token in the current scope, that symbol is taken over too
+        (it's declared first now), and the kept sentence will be parsed again
+        """
+        old = self._old_sentences
+        if old is None:
+            return
+
+        end = self._old_sentence
+        while end < len(old.starts) and old.starts[end] + old.delta <= token.offset:
+            end += 1
+        self._remove_old_sentences(end)
+
+        scope, name_id = self.symbol_table.scope, self.symbol_table.name_id(token)
+        if scope.get(name_id) is not None:
+            self._take_kept_symbol(scope, name_id)
+
+    def take_over_lookup(self, name_id: int):
+        """ While reparsing, takes over the symbols with the given name which kept sentences declared
+        in the scopes it's resolved from (see take_over()), as they are declared after it now
+        """
+        if self._old_sentences is None:
+            return
+
+        scope = self.symbol_table.scope
+        while scope.parent is not None:  # The outermost one only has the primitive types
+            if scope.get(name_id) is not None and not self._take_kept_symbol(scope, name_id):
+                return  # Declared before
+            scope = scope.parent
+
+    def _take_kept_symbol(self, scope: Scope, name_id: int) -> bool:
+        """ While reparsing, removes the symbol with the given name from the scope if a kept old
+        sentence declared it, and marks that sentence to be parsed again. Returns True if so
+        """
+        old = self._old_sentences
+        key = scope.id_, name_id
+        for i in range(self._old_sentence, len(old.starts)):
+            if key not in old.taken.get(i, ()) and any((x.id_, y) == key for x, y in old.symbols[i]):
+                old.removed.extend(self.symbol_table.remove_symbols([(scope, name_id)]))
+                old.changed.add(name_id)
+                old.taken.setdefault(i, set()).add(key)
+                return True
+
+        return False
+
+    def _remove_old_sentences(self, end: int):
+        """ While reparsing, removes the symbols of the old sentences up to end (not included)
+        which are still declared, but for the ones taken over already
+        """
+        old = self._old_sentences
+        for i in range(self._old_sentence, end):
+            keys = old.symbols[i]
+            taken = old.taken.get(i)
+            if taken is not None:
+                keys = [x for x in keys if (x[0].id_, x[1]) not in taken]
+            old.removed.extend(self.symbol_table.remove_symbols(keys))
+            old.changed.update(name_id for _, name_id in keys)
+        self._old_sentence = max(self._old_sentence, end)
+
+    def _next_dependent(self, names: List[Set[int]], start: int) -> int:
+        """ While reparsing, returns the index of the first old sentence from start which depends
+        on the names changed (or whose symbols were taken over), or len(names) if there's none
+        """
+        old = self._old_sentences
+        end = min((i for i in old.taken if i >= start), default=len(names))
+        if old.changed.isdisjoint(self._dependencies):
+            return end
+
+        return next((i for i in range(start, end) if not old.changed.isdisjoint(names[i])), end)
+
+    def match_program_sentence(self) -> Union[None, ast_.BlockAST, ast_.SentenceAST]:
+        """ Matches a top level sentence, recording where it starts and the symbols it declares
+        """
+        declared = self.symbol_table.declared
+        mark = len(declared)
+        start = self.lookahead.offset
+        self._current_symbols, self._current_names = symbols, names = [], set()  # Lazy function bodies add theirs
+        sentence = self.match_sentence_or_error()
+        self._current_symbols = self._current_names = None
+        if sentence is None:
+            return None
+
+        symbols.extend(declared[mark:])
+        self.sentence_starts.append(start)
+        self.sentence_symbols.append(symbols)
+        self.sentence_names.append(names)
+        return sentence
+
     def parse_program(self) -> Optional[ast_.BlockAST]:
         sentences: List[ast_.SentenceAST] = []
-        self.start_scope()  # Main scope
+        self.sentence_starts, self.sentence_symbols, self.sentence_names = [], [], []
+        self.start_program_scope()
         while self.lookahead != TokenID.EOF:
-            sentence = self.match_sentence_or_block()
+            sentence = self.match_program_sentence()
             if sentence is None:
                 return None
             sentences.append(sentence)
 
         self.end_scope()
-        return ast_.BlockAST(sentences=sentences)
+        self.symbol_table.declared.clear()
+        self._dependencies = Counter(chain.from_iterable(self.sentence_names))
+        self.program = ast_.BlockAST(sentences=sentences)
+        return self.program
+
+    def iter_program(self) -> Iterator[Union[ast_.BlockAST, ast_.SentenceAST]]:
+        """ Like parse_program(), but yields every top level sentence as soon as it's parsed,
+        so the program is never kept whole in memory. The symbols of the scopes closed by
+        each sentence are released too (unless function bodies are parsed lazily, as they
+        need them). Stops on syntax errors it cannot recover from (see log.ERROR_COUNT).
+        """
+        self.program = None
+        self.start_program_scope()
+        while self.lookahead != TokenID.EOF:
+            mark = self.symbol_table.mark()
+            sentence = self.match_sentence_or_error()
+            if sentence is None:
+                return
+
+            if not self.lazy_bodies:
+                self.symbol_table.release(mark)
+            yield sentence
+
+        self.end_scope()
+
+    def iter_program_threaded(self, queue_size: int = 64) -> Iterator[Union[ast_.BlockAST, ast_.SentenceAST]]:
+        """ Like iter_program(), but the parsing runs in another thread, up to queue_size
+        sentences ahead of the consumer (so lexing and parsing overlap with i.e. code emission).
+        Exceptions raised by the parsing (i.e. the SystemExit on too many errors) are raised here.
+        """
+        sentences = queue.Queue(maxsize=queue_size)  # Of (sentence, exception). None when done
+        stopped = threading.Event()  # Set when the consumer is gone
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    sentences.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def produce():
+            try:
+                for sentence in self.iter_program():
+                    put((sentence, None))
+                    if stopped.is_set():
+                        return
+            except BaseException as e:
+                put((None, e))
+            else:
+                put(None)
+
+        thread = threading.Thread(target=produce, name='parser', daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = sentences.get()
+                if item is None:
+                    return
+                sentence, exception = item
+                if exception is not None:
+                    raise exception
+                yield sentence
+        finally:
+            stopped.set()
+            thread.join()
+
+    def reparse(self, program: ast_.BlockAST, old_text: str, new_text: str) -> Optional[ast_.BlockAST]:
+        """ Incremental parsing: given the program last parsed (from old_text), returns the one
+        of new_text (or None on errors, keeping the last one). Only the top level sentences around
+        the edited text are parsed again (and the following ones, until the parser gets back in sync
+        with the old sentences), along with the kept ones depending on the names those declare or
+        remove: the ones which looked up one, failed to declare one, or declared one declared before
+        them now. The other AST nodes and the symbols they declared are kept. Function bodies parsed
+        again are not skipped (see lazy_bodies), and the skipped bodies of the kept sentences, if not
+        parsed yet, will see the symbols as they were then. Offsets of the kept tokens still refer to
+        the text they were scanned from, but their line and col are the ones in new_text.
+        """
+        assert program is self.program, "Not the last program parsed"
+        assert not self.streaming, "Cannot reparse a streamed program"
+        prefix = _common_prefix_length(old_text, new_text)
+        if prefix == len(old_text) == len(new_text):
+            return program
+
+        suffix = _common_suffix_length(old_text, new_text, min(len(old_text), len(new_text)) - prefix)
+        old_end = len(old_text) - suffix  # old_text[prefix:old_end] was replaced
+        delta = len(new_text) - len(old_text)
+
+        # The first sentence parsed again is the one with the edited text, or the previous one if its
+        # first token was edited (it's the lookahead which ended the previous sentence, i.e. an 'else').
+        # Old sentences from the first one starting after the edited text can be kept
+        starts, symbols, names = self.sentence_starts, self.sentence_symbols, self.sentence_names
+        sentences = program.sentences
+        first = max(bisect_right(starts, prefix) - 1, 0)
+        if first and _WORD_RUN.match(old_text, starts[first]).end() >= prefix:
+            first -= 1
+        # The symbols of the old sentences with edited text are removed. Those of the following ones are
+        # removed as the sentences parsed again take them over (see take_over()), so the ones kept once
+        # back in sync are never removed, unless they depend on the names changed
+        k = bisect_right(starts, old_end)
+        old = self._old_sentences = OldSentences(starts, symbols, delta, [], set(), {})
+
+        old_lex, old_lookahead = self.lex, self.lookahead
+        declared = self.symbol_table.declared
+        mark, scope_depth = len(declared), self.symbol_table.scope_depth
+        self.lex = Lexer(StringIO(new_text), engine=self.engine, string_table=self.string_table)
+        self.sentence_starts, self.sentence_symbols = starts[:first], symbols[:first]
+        self.sentence_names = names[:first]
+        new_sentences = sentences[:first]
+        replaced: List[Set[int]] = []  # Names of the old sentences parsed again
+        added: List[Set[int]] = []  # Names of the new ones
+        self.start_program_scope()
+
+        success = False
+        try:
+            i, offset, seen = first, starts[first] if first else 0, mark
+            while True:  # Parses again the old sentences from i, at least up to k (not included)
+                self._old_sentence = i
+                self._remove_old_sentences(k)
+                self.lex.seek(offset)
+                self.lookahead = self.lex.get_token()
+                while self.lookahead != TokenID.EOF:
+                    offset = self.lookahead.offset
+                    while k < len(starts) and starts[k] + delta < offset:  # Old sentences parsed again
+                        k += 1
+
+                    if k < len(starts) and starts[k] + delta == offset:
+                        break  # Back in sync
+
+                    sentence = self.match_program_sentence()
+                    if sentence is None:
+                        return None
+                    new_sentences.append(sentence)
+                    added.append(self.sentence_names[-1])
+                else:
+                    k = len(starts)
+                self._remove_old_sentences(k)  # Taken over without declaring anything after them
+                replaced.extend(names[i:k])
+                old.changed.update(name_id for _, name_id in declared[seen:])
+                seen = len(declared)
+
+                i = self._next_dependent(names, k)
+                self.sentence_starts.extend(map(delta.__add__, starts[k:i]))
+                self.sentence_symbols.extend(symbols[k:i])
+                self.sentence_names.extend(names[k:i])
+                new_sentences.extend(sentences[k:i])
+                if i == len(starts):
+                    break
+                offset, k = starts[i] + delta, i + 1
+            success = True
+        finally:
+            self._old_sentences = None
+            if not success:  # The last program (and its symbols) is still the one parsed
+                while self.symbol_table.scope_depth > scope_depth:
+                    self.end_scope()
+                self.symbol_table.remove_symbols(declared[mark:])
+                del declared[mark:]
+                self.symbol_table.add_symbols(old.removed)
+                self.lex, self.lookahead = old_lex, old_lookahead
+                self.sentence_starts, self.sentence_symbols, self.sentence_names = starts, symbols, names
+
+        self.end_scope()
+        declared.clear()
+        self._count_dependencies(replaced, -1)
+        self._count_dependencies(added, 1)
+        old_lex.line_index.move(old_end, delta, self.lex.line_index)
+        self.program = ast_.BlockAST(sentences=new_sentences)
+        return self.program
+
+
+def build_statement_dispatch(parser_class: type) -> List[StatementHandler]:
+    """ Returns the handler of the sentences starting with each TokenID (indexed by it) for the statements
+    of the given Parser class. Productions whose FIRST sets overlap must have disjoint second token sets,
+    but for at most one of them without it. Otherwise a warning about the conflict is logged, and the
+    production declared first is used.
+    """
+    unexpected = parser_class.match_unexpected_sentence
+    result = [unexpected] * (max(TokenID) + 1)
+
+    for id_ in TokenID:
+        statements = [x for x in parser_class.statements if id_ in x.first]
+        default = None
+        by_second: Dict[TokenID, Statement] = {}
+        for statement in statements:
+            if statement.second is None:
+                if default is not None:
+                    log.warning("FIRST/FIRST conflict between '{}' and '{}' sentences on {}".format(
+                        default.name, statement.name, repr(id_)))
+                    continue
+                default = statement
+                continue
+
+            for second in statement.second:
+                if second in by_second:
+                    log.warning("FIRST/FIRST conflict between '{}' and '{}' sentences on {} {}".format(
+                        by_second[second].name, statement.name, repr(id_), repr(second)))
+                    continue
+                by_second[second] = statement
+
+        default_handler = getattr(parser_class, default.handler) if default is not None else unexpected
+        if not by_second:
+            result[id_] = default_handler
+            continue
+
+        second_handlers = [default_handler] * (max(TokenID) + 1)
+        for second, statement in by_second.items():
+            second_handlers[second] = getattr(parser_class, statement.handler)
+        result[id_] = lambda parser_, handlers=second_handlers: handlers[parser_.peek(1).id_](parser_)
+
+    return result
+
+
+Parser._statement_dispatch = build_statement_dispatch(Parser)
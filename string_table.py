@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, List, Optional
+
+
+class StringTable:
+    """ Interns the identifier (and keyword) texts of a compilation,
+    giving each distinct one a small integer id.
+    """
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.strings: List[str] = []
+        self.lookups = 0  # Number of intern() calls
+        self.hits = 0  # Number of them which found the text already interned
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def __getitem__(self, id_: int) -> str:
+        return self.strings[id_]
+
+    def intern(self, text: str) -> int:
+        """ Returns the id of the given text, adding it to the table if not there yet
+        """
+        self.lookups += 1
+        id_ = self.ids.get(text)
+        if id_ is not None:
+            self.hits += 1
+            return id_
+
+        id_ = self.ids[text] = len(self.strings)
+        self.strings.append(text)
+        return id_
+
+    def find(self, text: str) -> Optional[int]:
+        """ Returns the id of the given text, or None if it's not in the table
+        """
+        return self.ids.get(text)
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def stats(self) -> str:
+        """ Returns a summary of the table usage
+        """
+        return 'string table: {} strings ({} chars), {} lookups, {} hits ({:.1%})'.format(
+            len(self.strings), sum(map(len, self.strings)), self.lookups, self.hits, self.hit_rate)
@@ -1,23 +1,246 @@
 # -*- coding: utf-8 -*-
 
-from typing import Dict, Optional
+from itertools import count
+from typing import Dict, Iterator, Optional, Tuple, List
 
 import ast_
 from lexer import Token
+from string_table import StringTable
 import log
 
 
+_stamps = count()  # Creation order of the versions of the scopes and of the snapshots
+_NO_SCOPES: Dict[str, 'Scope'] = {}  # Shared by the versions without nested scopes set (never modified)
+
+
+class Scope:
+    """ A version of a scope of the symbol table: the symbols declared in it, keyed by the string
+    table id of their names, and the version of the enclosing scope it was entered from.
+    Once shared (by a snapshot or a nested scope), a version is never modified: declaring into
+    it makes a new version, which shares most of the symbols with it. The versions of a scope
+    share its id and the latest versions of the scopes nested in it, keyed by their names.
+    Replaced versions which a snapshot can still see are linked from the new ones (previous).
+    The versions entered from this one since a snapshot was restored are kept in it (nested).
+    """
+    __slots__ = ('name', 'parent', 'id_', 'depth', 'symbols', 'recent', 'owns_symbols', 'shared',
+                 'resolved', 'children', 'stamp', 'previous', 'nested', 'recent_nested', 'horizon')
+
+    def __init__(self, name: str, parent: Optional['Scope'], id_: int):
+        self.name = name
+        self.parent = parent
+        self.id_ = id_  # Unique within the symbol table, in creation order
+        self.depth = parent.depth + 1 if parent is not None else 0
+        # The symbols are the ones in recent and in symbols (which can be shared with other versions,
+        # unless owns_symbols). Symbols are added to recent, which is merged into a new symbols dict
+        # once it outgrows its square root, so a new version copies O(sqrt(n)) symbols at most
+        self.symbols: Dict[int, ast_.TypeAST] = {}
+        self.recent: Dict[int, ast_.TypeAST] = {}
+        self.owns_symbols = True
+        self.shared = False
+        # Resolution cache: symbols of the outer scopes resolved from this one (or from nested ones).
+        # Shared by the versions with the same parent (outer scopes never change for them)
+        self.resolved: Dict[int, ast_.TypeAST] = {}
+        self.children: Dict[str, Scope] = {}
+        self.stamp = next(_stamps)
+        self.previous: Optional[Scope] = None  # Version replaced by this one, if a snapshot can see it
+        # Versions of the nested scopes made (or entered) from this one within a snapshot restored, shared with
+        # the next versions like the symbols, so a snapshot taken afterwards sees them (unlike the latest ones)
+        self.nested = self.recent_nested = _NO_SCOPES
+        # Snapshots only: they see the versions of the nested scopes above, or else the latest ones stamped
+        # before this (i.e. when the snapshot was taken, or the first one it descends from)
+        self.horizon: Optional[int] = None
+
+    def __repr__(self):
+        return 'Scope<{}>'.format(self.mangled_name())
+
+    def get(self, name_id: int) -> Optional[ast_.TypeAST]:
+        """ Returns the symbol declared in this scope with the given name id, if any
+        """
+        result = self.recent.get(name_id)
+        return result if result is not None else self.symbols.get(name_id)
+
+    def names(self) -> Iterator[int]:
+        """ Iterates over the name ids of the symbols declared in this scope
+        """
+        yield from self.symbols
+        yield from self.recent
+
+    def new_version(self, parent: 'Scope' = None) -> 'Scope':
+        """ Returns a new version of this scope (entered from the given version of its parent,
+        if any) sharing the symbols with it
+        """
+        result = Scope(self.name, self.parent if parent is None else parent, self.id_)
+        result.symbols, result.recent, result.owns_symbols = self.symbols, dict(self.recent), False
+        self.owns_symbols = False
+        if parent is None:
+            result.resolved = self.resolved
+        result.children = self.children
+        result.nested = self.nested
+        if self.recent_nested:
+            result.recent_nested = dict(self.recent_nested)
+        return result
+
+    def get_nested(self, name: str) -> Optional['Scope']:
+        """ Returns the version of the nested scope with the given name set in this version, if any
+        """
+        result = self.recent_nested.get(name)
+        return result if result is not None else self.nested.get(name)
+
+    def set_nested(self, name: str, scope: 'Scope'):
+        """ Sets the version of a nested scope in this (not shared) version. Like the symbols,
+        a new version copies O(sqrt(n)) of them at most
+        """
+        if self.recent_nested is _NO_SCOPES:
+            self.recent_nested = {}
+        recent = self.recent_nested
+        recent[name] = scope
+        if len(recent) > 8 and len(recent) ** 2 > len(self.nested):
+            self.nested = {**self.nested, **recent}
+            self.recent_nested = _NO_SCOPES
+
+    def add(self, name_id: int, symbol: ast_.TypeAST):
+        """ Adds the symbol to this (not shared) version
+        """
+        if self.owns_symbols:
+            self.symbols[name_id] = symbol
+            return
+
+        recent = self.recent
+        recent[name_id] = symbol
+        if len(recent) > 8 and len(recent) ** 2 > len(self.symbols):
+            self.symbols = {**self.symbols, **recent}
+            self.recent = {}
+            self.owns_symbols = True
+
+    def remove(self, name_id: int):
+        """ Removes the symbol from this (not shared) version
+        """
+        if name_id in self.recent:
+            del self.recent[name_id]
+        elif self.owns_symbols:
+            del self.symbols[name_id]
+        else:
+            self.symbols = {k: v for k, v in self.symbols.items() if k != name_id}
+            self.owns_symbols = True
+
+    def mangled_name(self, mangle_char: str = '.') -> str:
+        """ Returns the names of the scopes from the outermost one to this one
+        joined by mangle_char (i.e. '.scope1.scope2.')
+        """
+        names = []
+        scope = self
+        while scope.parent is not None:
+            names.append(scope.name)
+            scope = scope.parent
+
+        return mangle_char + ''.join(name + mangle_char for name in reversed(names))
+
+
 class SymbolTable:
-    """ Implements a simple symbol table using Dict.
-    Scope is given by
+    """ Implements a symbol table as a tree of persistent scopes, each one with the Dicts of
+    its symbols keyed by name ids from the string table of the compilation. Symbols are resolved
+    by walking up from the current scope, and cached in the scopes walked through. The state
+    can be saved with snapshot() and returned to with restore(), both O(1): the versions existing
+    when a snapshot is taken are never modified afterwards. Changes made within a snapshot restored
+    copy the versions of the current scope and the outer ones (once per snapshot taken), so every
+    snapshot refers to a fixed number of versions. Mangled names (i.e. '.scope1.scope2.')
+    are only built on request.
     """
-    def __init__(self, mangle: str = '.'):
-        self.symbols: Dict[str, ast_.TypeAST] = {}
+    def __init__(self, mangle: str = '.', string_table: StringTable = None):
+        self.string_table = string_table if string_table is not None else StringTable()
         self.mangle_char = mangle
-        self.current_scope: str = '.'
+        self.root = Scope('', None, 0)  # Latest version of the outermost scope
+        self.scope = self.root  # Current scope
+        self._scope_count = 1  # Next scope id
+        self.declared: List[Tuple[Scope, int]] = []  # Keys of the declared symbols, in declaration order
+        self.hits = 0  # Number of resolutions found in the cache of the current scope
+        self.misses = 0  # Number of resolutions which walked up to outer scopes
+        self._frozen_below = 0  # Versions stamped before it were taken by a snapshot
+        self._horizon: Optional[int] = None  # That of the snapshot restored, if any
+
+    @property
+    def current_scope(self) -> str:
+        """ Mangled name of the current scope
+        """
+        return self.scope.mangled_name(self.mangle_char)
+
+    @property
+    def scope_depth(self) -> int:
+        """ Number of scopes pushed (and not popped yet)
+        """
+        return self.scope.depth
+
+    def scopes(self) -> Iterator[Scope]:
+        """ Iterates over the latest version of every scope (not yet released)
+        """
+        pending = [self.root]
+        while pending:
+            scope = pending.pop()
+            yield scope
+            pending.extend(scope.children.values())
+
+    @property
+    def symbol_count(self) -> int:
+        return sum(len(scope.symbols) + len(scope.recent) for scope in self.scopes())
+
+    def snapshot(self) -> Scope:
+        """ Returns the current state of the symbol table (its current scope), to restore() it later.
+        Declaring or removing symbols afterwards does not change it, nor the scopes entered from it.
+        """
+        scope = self.scope
+        horizon = self._horizon if self._horizon is not None else next(_stamps)
+        if scope.horizon is not None and scope.horizon != horizon:  # Already a snapshot, of another state
+            scope = scope.new_version()
+        scope.horizon = horizon
+        self._frozen_below = next(_stamps)
+        if self._horizon is None and scope is self.scope:
+            self.scope = scope.new_version()  # The one to go on with
+            self._register(self.scope)
+        return scope
+
+    def restore(self, snapshot: Scope):
+        """ Returns to the state of the snapshot: scopes entered again by name from it are the versions
+        it saw, or the ones made since this restore. Given a scope which is not a snapshot (i.e. the current
+        one, saved to come back later), returns to it seeing the latest versions of the scopes.
+        """
+        self.scope = snapshot
+        self._horizon = snapshot.horizon
+
+    def _branch(self, scope: Scope) -> Scope:
+        """ Returns the given version of the current scope (or an outer one) if it was not taken by a snapshot.
+        Otherwise, a copy of it within copies of the outer scopes taken too, so the versions of the scopes
+        entered from it can be set without changing the snapshots
+        """
+        frozen = []
+        while scope is not None and scope.stamp < self._frozen_below:
+            frozen.append(scope)
+            scope = scope.parent
 
-    def pop_suffix(self, mangled_name: str) -> str:
-        return self.mangle_char.join(mangled_name.split(self.mangle_char)[:-1])
+        for original in reversed(frozen):
+            copy = original.new_version(scope)
+            copy.resolved = original.resolved  # The outer scopes have the same symbols
+            copy.shared = True  # The copy of the nested scope refers to it
+            if scope is not None:
+                scope.set_nested(copy.name, copy)
+            scope = copy
+        return scope
+
+    def _register(self, scope: Scope):
+        """ Makes the new version of a scope the latest one, in its parent. Within a snapshot restored,
+        it's the one entered from its parent too
+        """
+        parent = scope.parent
+        if parent is None:
+            self.root = scope
+            return
+
+        latest = parent.children.get(scope.name)
+        if latest is not None:
+            scope.previous = latest if latest.stamp < self._frozen_below else latest.previous
+        parent.children[scope.name] = scope
+        if parent.stamp >= self._frozen_below and (
+                self._horizon is not None or parent.get_nested(scope.name) is not None):
+            parent.set_nested(scope.name, scope)
 
     def get_mangled(self, symbol_name: str) -> str:
         assert self.mangle_char not in symbol_name, "Char '{}' not allowed in '{}'".format(
@@ -26,33 +249,199 @@ class SymbolTable:
         return self.current_scope + symbol_name
 
     def push_scope(self, namespace: str):
-        self.current_scope = self.get_mangled(namespace) + self.mangle_char
+        assert self.mangle_char not in namespace, "Char '{}' not allowed in '{}'".format(
+            self.mangle_char, namespace
+        )
+        parent = self.scope
+        if self._horizon is None:
+            scope = parent.children.get(namespace)
+        else:  # Within a snapshot restored
+            scope = parent.get_nested(namespace)
+            if scope is None:
+                scope = parent.children.get(namespace)
+                while scope is not None and scope.stamp >= self._horizon:
+                    scope = scope.previous
+
+        if scope is None or scope.parent is not parent:  # New, or entered again from another version of the parent
+            if self._horizon is not None:
+                parent = self._branch(parent)
+            if scope is None:
+                scope = Scope(namespace, parent, self._scope_count)
+                self._scope_count += 1
+            else:
+                scope = scope.new_version(parent)
+            self._register(scope)
+        parent.shared = True  # Its nested scope refers to it
+        self.scope = scope
 
     def pop_scope(self):
-        assert self.current_scope != self.mangle_char, "Symbol Table scope stack underflow"
-        self.current_scope = self.pop_suffix(self.current_scope[:-1]) + self.mangle_char
+        assert self.scope.parent is not None, "Symbol Table scope stack underflow"
+        self.scope = self.scope.parent
+
+    def _writable(self, scope: Scope) -> Scope:
+        """ Returns the given latest version of a scope (or the current one), or a new version of it
+        replacing it if shared (or taken by a snapshot)
+        """
+        if not scope.shared and scope.stamp >= self._frozen_below:
+            return scope
+
+        parent = scope.parent
+        if self._horizon is not None and scope is self.scope and parent is not None:
+            parent = self._branch(parent)
+        result = scope.new_version(parent)
+        result.resolved = scope.resolved  # The outer scopes have the same symbols
+        self._register(result)
+        if self.scope is scope:
+            self.scope = result
+        return result
+
+    def name_id(self, token: Token) -> int:
+        """ Returns the string table id of the token value
+        """
+        return token.name_id if token.name_id is not None else self.string_table.intern(token.value)
 
     def declare_symbol(self, token: Token, ast_node: ast_.TypeAST) -> bool:
         """ Returns True on success, False on error
         """
-        mangled_name = self.current_scope + token.value
-        if mangled_name in self.symbols:
+        scope, name_id = self.scope, self.name_id(token)
+        if scope.get(name_id) is not None:
             log.error('{}: duplicated name "{}"'.format(token.line, token.value))
             return False
 
-        self.symbols[mangled_name] = ast_node
+        scope = self._writable(scope)
+        scope.add(name_id, ast_node)
+        self.declared.append((scope, name_id))
         return True
 
+    def mark(self) -> Tuple[int, int]:
+        """ Returns a mark of the current state, to release() the scopes closed after it
+        """
+        return len(self.declared), self._scope_count
+
+    def release(self, mark: Tuple[int, int]):
+        """ Forgets the symbols declared after the mark in scopes no longer in use, and the
+        scopes created after it which are no longer in use (once closed, nothing but the
+        snapshots taken within them can refer to them)
+        """
+        declared_mark, scope_mark = mark
+        in_use = []  # Ids of the scopes in use, innermost first (so the one at depth d is in_use[-1 - d])
+        scope = self.scope
+        while scope is not None:
+            in_use.append(scope.id_)
+            scope = scope.parent
+
+        self.declared[declared_mark:] = [
+            key for key in self.declared[declared_mark:]
+            if key[0].depth < len(in_use) and in_use[-1 - key[0].depth] == key[0].id_
+        ]
+
+        # The scopes created after the mark and closed are nested in the ones in use
+        scope = self.scope
+        while scope is not None:
+            closed = []
+            for name, child in reversed(scope.children.items()):  # Newest first
+                if child.id_ < scope_mark:
+                    break
+                if child.depth >= len(in_use) or in_use[-1 - child.depth] != child.id_:
+                    closed.append(name)
+            for name in closed:
+                del scope.children[name]
+            scope = scope.parent
+
+    def _latest(self, scope: Scope) -> Optional[Scope]:
+        """ Returns the latest version of the given scope, if it was not released
+        """
+        latest = self.root if scope.parent is None else scope.parent.children.get(scope.name)
+        return latest if latest is not None and latest.id_ == scope.id_ else None
+
+    def remove_symbols(self, keys: List[Tuple[Scope, int]]) -> List[Tuple[Scope, int, ast_.TypeAST]]:
+        """ Removes the symbols with the given keys (i.e. a slice of self.declared) from the
+        latest versions of their scopes. Returns the ones removed, to add_symbols() them back
+        """
+        removed = []
+        for scope, name_id in keys:
+            latest = self._latest(scope)
+            symbol = latest.get(name_id) if latest is not None else None
+            if symbol is not None:
+                self._writable(latest).remove(name_id)
+                removed.append((scope, name_id, symbol))
+        if removed:
+            self._enter_latest()
+        return removed
+
+    def add_symbols(self, removed: List[Tuple[Scope, int, ast_.TypeAST]]):
+        """ Adds back symbols returned by remove_symbols() to the latest versions of their scopes
+        """
+        for scope, name_id, symbol in removed:
+            latest = self._latest(scope)
+            if latest is not None:
+                self._writable(latest).add(name_id, symbol)
+        if removed:
+            self._enter_latest()
+
+    def _enter_latest(self):
+        """ Enters the current scope again if the version of an outer one it was entered from was
+        replaced (i.e. by removing symbols from it), so it's the latest versions which are seen
+        """
+        names = []
+        scope, stale = self.scope, False
+        while scope.parent is not None:
+            stale = stale or self._latest(scope) is not scope
+            names.append(scope.name)
+            scope = scope.parent
+
+        if stale or scope is not self.root:
+            self.scope = self.root
+            for name in reversed(names):
+                self.push_scope(name)
+
     def resolve_symbol(self, symbol_name: str) -> Optional[ast_.TypeAST]:
-        scope = self.current_scope
-        mangled_name = scope + symbol_name
+        name_id = self.string_table.find(symbol_name)
+        return self.resolve_id(name_id) if name_id is not None else None
+
+    def resolve_id(self, name_id: int) -> Optional[ast_.TypeAST]:
+        """ Like resolve_symbol(), given the string table id of the name
+        """
+        scope = self.scope
+        result = scope.recent.get(name_id)
+        if result is not None:
+            return result
+
+        result = scope.symbols.get(name_id)
+        if result is not None:
+            return result
 
-        while True:
-            if mangled_name in self.symbols:
-                return self.symbols[mangled_name]
+        result = scope.resolved.get(name_id)
+        if result is not None:
+            self.hits += 1
+            return result
 
-            if scope == self.mangle_char:
-                return None  # Not found
+        self.misses += 1
+        walked = [scope]
+        scope = scope.parent
+        while scope is not None:
+            result = scope.get(name_id)
+            if result is None:
+                result = scope.resolved.get(name_id)
+                if result is None:
+                    walked.append(scope)
+                    scope = scope.parent
+                    continue
 
-            scope = self.pop_suffix(scope[:-1]) + self.mangle_char
-            mangled_name = scope + symbol_name
+            for scope in walked:
+                scope.resolved[name_id] = result
+            return result
+
+        return None  # Not found
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> str:
+        """ Returns a summary of the resolution cache usage
+        """
+        return 'symbol table: {} scopes, {} symbols, {} cached resolutions, {} hits, {} misses ({:.1%} hits)'.format(
+            sum(1 for _ in self.scopes()), self.symbol_count, sum(len(x.resolved) for x in self.scopes()),
+            self.hits, self.misses, self.hit_rate)
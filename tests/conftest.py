@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+
+@pytest.fixture
+def program_text() -> str:
+    """ A program with nested scopes, a shadowed variable, a call before the definition
+    of the function, and an unresolved name (b)
+    """
+    return """var a: int32;
+fn f(x: int32): int32 {
+    var y: int32;
+    y = x * g(a);
+    return y;
+}
+fn g(x: int32): int32 {
+    if x > 0 {
+        var a: int32;
+        a = x;
+    }
+    return a + x;
+}
+a = f(1) + g(b);
+"""
+
+
+@pytest.fixture(params=[False, True], ids=['eager', 'lazy bodies'])
+def lazy_bodies(request) -> bool:
+    """ Runs the tests using it with function bodies parsed eagerly, and lazily
+    """
+    return request.param
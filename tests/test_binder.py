@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+import io
+from typing import Tuple
+
+import pytest
+
+import ast_
+import binder
+import parser
+from binder import Event, SymbolKind
+
+
+def parse(text: str, **kwargs) -> parser.Parser:
+    parser_ = parser.Parser(io.StringIO(text), **kwargs)
+    assert parser_.parse_program() is not None
+    return parser_
+
+
+@pytest.fixture
+def bound(program_text, lazy_bodies) -> Tuple[ast_.BlockAST, binder.Bindings]:
+    parser_ = parse(program_text, lazy_bodies=lazy_bodies)
+    return parser_.program, binder.bind(parser_.program, parser_.string_table)
+
+
+def test_walk():
+    program = parse('var a: int32;\n{ a = a + 1; }\nfn f(x: int32): int32 { return x; }\n').program
+    assert [(event, getattr(node, 'var_name', type(node).__name__)) for event, node in binder.walk(program)] == [
+        (Event.ENTER, 'BlockAST'), (Event.FUNCTION, 'f'), (Event.VARIABLE, 'a'),
+        (Event.ENTER, 'BlockAST'), (Event.USE, 'a'), (Event.USE, 'a'), (Event.EXIT, 'BlockAST'),
+        (Event.ENTER, 'FunctionDeclAST'), (Event.PARAMETER, 'x'), (Event.USE, 'x'), (Event.EXIT, 'FunctionDeclAST'),
+        (Event.EXIT, 'BlockAST'),
+    ]
+
+
+def test_bind_declarations(bound):
+    program, bindings = bound
+    assert [(x.var_name, x.address, kind) for x, kind in zip(bindings.declarations, bindings.kinds)] == [
+        ('f', (0, 0), SymbolKind.FUNCTION), ('g', (0, 1), SymbolKind.FUNCTION), ('a', (0, 2), SymbolKind.VARIABLE),
+        ('x', (1, 0), SymbolKind.PARAMETER), ('y', (1, 1), SymbolKind.VARIABLE),
+        ('x', (1, 0), SymbolKind.PARAMETER), ('a', (2, 0), SymbolKind.VARIABLE),
+    ]
+    assert all(x.decl is x for x in bindings.declarations)
+
+    f, g = program.sentences[1], program.sentences[2]
+    assert (program.slots, f.slots, g.slots, g.body.sentences[0].then.slots) == (3, 2, 1, 1)
+
+
+def test_bind_uses(bound):
+    program, bindings = bound
+    assert [(x.var_name, x.address) for x in bindings.uses] == [
+        ('y', (1, 1)), ('x', (1, 0)), ('g', (0, 1)), ('a', (0, 2)), ('y', (1, 1)),
+        ('x', (1, 0)), ('a', (2, 0)), ('x', (1, 0)), ('a', (0, 2)), ('x', (1, 0)),
+        ('a', (0, 2)), ('f', (0, 0)), ('g', (0, 1)),
+    ]
+    assert [x.var_name for x in bindings.unresolved] == ['b']
+
+    assignment = program.sentences[3]
+    assert assignment.lvalue.decl is bindings.declarations[2]
+    assert assignment.rvalue.right.name.decl is program.sentences[2].func
+    unresolved = assignment.rvalue.right.args.args[0]
+    assert unresolved.decl is None and unresolved.address is None
+
+
+def test_bind_after_reparse(program_text):
+    parser_ = parse(program_text)
+    binder.bind(parser_.program, parser_.string_table)
+    a = parser_.program.sentences[1].body.sentences[1].rvalue.right.args.args[0]
+    assert a.address == (0, 2)
+    text = program_text.replace('var a: int32;\nfn', 'var b: int32;\nfn')
+    program = parser_.reparse(parser_.program, program_text, text)
+    bindings = binder.bind(program, parser_.string_table)
+    assert [(x.var_name, x.token.line) for x in bindings.unresolved] == [('a', 4), ('a', 12), ('a', 14)]
+    assert a.decl is None and a.address is None, "Kept by the reparse, and no longer declared"
+    b = program.sentences[3].rvalue.right.args.args[0]
+    assert b.decl is program.sentences[0].var and b.address == (0, 2)
+
+
+def test_bind_deep_nesting():
+    depth = 10000
+    text = 'var a: int32;\n' + 'if a > 0 {\n' * depth + 'var b: int32;\nb = a;\n' + '}' * depth + '\n'
+    parser_ = parse(text)
+    bindings = binder.bind(parser_.program, parser_.string_table)
+    assert [x.address for x in bindings.uses][-2:] == [(depth, 0), (0, 0)]
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import io
+
+import pytest
+
+import ast_
+import log
+import parser
+from interface import FunctionSignature, Interface
+
+
+PROGRAM = """var a: int32;
+fn f(x: int32, s: str): int8 {
+    return x;
+}
+fn g(): float {
+    var y: float;
+    return y;
+}
+a = f(1, "s");
+"""
+
+
+def interface_of(text: str) -> Interface:
+    program = parser.Parser(io.StringIO(text), lazy_bodies=True).parse_program()
+    assert program is not None
+    return Interface.from_program(program, text)
+
+
+def test_interface_from_program():
+    interface = interface_of(PROGRAM)
+    assert interface.functions == [
+        FunctionSignature('f', [('x', 'int32'), ('s', 'str')], 'int8'),
+        FunctionSignature('g', [], 'float'),
+    ]
+    assert interface.is_current(PROGRAM)
+    assert not interface.is_current(PROGRAM + '\n')
+
+
+def test_interface_serialization():
+    interface = interface_of(PROGRAM)
+    text = interface.dumps()
+    assert text.splitlines()[1:] == ['f int8 x int32 s str', 'g float']
+    loaded = Interface.loads(text)
+    assert loaded.content_hash == interface.content_hash
+    assert loaded.functions == interface.functions
+    assert len(Interface.loads(interface_of('').dumps())) == 0
+
+    with pytest.raises(ValueError):
+        Interface.loads('')
+    with pytest.raises(ValueError):
+        Interface.loads(text.replace('phi 1', 'phi 0'))
+    with pytest.raises(ValueError):
+        Interface.loads(text + 'h int8 x\n')
+
+
+def test_interface_declare():
+    parser_ = parser.Parser(io.StringIO('a = f(1, "s");\n'))
+    assert parser_.declare_interface(Interface.loads(interface_of(PROGRAM).dumps()))
+    assert parser_.symbol_table.resolve_symbol('f') is None, "Declared in the scope of the program"
+    parser_.start_program_scope()
+    f = parser_.symbol_table.resolve_symbol('f')
+    assert isinstance(f, ast_.FunctionDeclAST)
+    assert f.type_ is parser_.symbol_table.resolve_symbol('int8')
+    assert [(x.var.var_name, x.type_.name) for x in f.parameters.parameters] == [('x', 'int32'), ('s', 'str')]
+    assert f.body is None
+    parser_.end_scope()
+    assert parser_.parse_program() is not None
+    assert parser_.symbol_table.root.children['S0'].get(parser_.string_table.find('g')).type_.name == 'float'
+
+
+def test_interface_declare_errors(mocker):
+    mocker.patch('log.OUTPUT', io.StringIO())
+    mocker.patch('log.ERROR_COUNT', 0)
+    mocker.patch('log.MAX_ERRORS_ALLOWED', 0)
+    parser_ = parser.Parser(io.StringIO(''))
+    interface = Interface('', [FunctionSignature('f', [('x', 'int9')], 'int8'), FunctionSignature('g', [], 'int8'),
+                               FunctionSignature('g', [], 'int8')])
+    assert not parser_.declare_interface(interface)
+    parser_.start_program_scope()
+    assert parser_.symbol_table.resolve_symbol('f') is None
+    assert log.ERROR_COUNT == 2
+    assert 'unknown type int9 in the signature of f' in log.OUTPUT.getvalue()
+
+    parser_ = parser.Parser(io.StringIO('var f: int32;\n'))
+    assert parser_.declare_interface(interface_of(PROGRAM))
+    assert parser_.parse_program() is None, "Declared twice in the scope of the program"
+    assert log.OUTPUT.getvalue().endswith('1: duplicated name "f"\n')
@@ -1,6 +1,9 @@
 
 import io
-from lexer import Lexer, LexException, TokenID, Token
+import random
+from typing import Tuple
+from lexer import Lexer, LexException, TokenID, Token, RegexLexer, TokenStream, LineIndex, TOKEN_MAP
+import lexer
 import pytest
 
 
@@ -65,7 +68,7 @@ def test_raises_unexpected_char():
 def test_get_id():
     lex = Lexer(io.StringIO("    /*  */ _an_identifier"))
     tok = lex.get_token()
-    assert tok == Token(TokenID.ID, 0, 0, value='_an_identifier')
+    assert tok == Token(TokenID.ID, 0, '_an_identifier')
 
 
 def test_unput():
@@ -92,49 +95,64 @@ def test_num_is_dot():
 def test_num_is_int():
     lex = Lexer(io.StringIO("341e"))
     tok = lex.get_token()
-    assert tok == Token(TokenID.INT_LITERAL, 0, 0, '341')
+    assert tok == Token(TokenID.INT_LITERAL, 0, '341')
 
     lex = Lexer(io.StringIO("341 "))
     tok = lex.get_token()
-    assert tok == Token(TokenID.INT_LITERAL, 0, 0, '341')
+    assert tok == Token(TokenID.INT_LITERAL, 0, '341')
 
     lex = Lexer(io.StringIO("341e+"))
     tok = lex.get_token()
-    assert tok == Token(TokenID.INT_LITERAL, 0, 0, '341')
+    assert tok == Token(TokenID.INT_LITERAL, 0, '341')
+
+
+def test_num_backtracks_exponent():
+    lex = Lexer(io.StringIO("341e+ x\n5"))
+    for tok in [
+        Token(TokenID.INT_LITERAL, 0, '341'),
+        Token(TokenID.ID, 0, 'e'),
+        Token(TokenID.PLUS, 0, '+'),
+        Token(TokenID.ID, 0, 'x'),
+    ]:
+        assert lex.get_token() == tok
+
+    tok = lex.get_token()
+    assert tok == Token(TokenID.INT_LITERAL, 0, '5')
+    assert (tok.line, tok.col) == (2, 1)
 
 
 def test_num_is_float():
     lex = Lexer(io.StringIO("341."))
     tok = lex.get_token()
-    assert tok == Token(TokenID.FLOAT_LITERAL, 0, 0, '341.')
+    assert tok == Token(TokenID.FLOAT_LITERAL, 0, '341.')
 
     lex = Lexer(io.StringIO("341.5"))
     tok = lex.get_token()
-    assert tok == Token(TokenID.FLOAT_LITERAL, 0, 0, '341.5')
+    assert tok == Token(TokenID.FLOAT_LITERAL, 0, '341.5')
 
     lex = Lexer(io.StringIO(".341"))
     tok = lex.get_token()
-    assert tok == Token(TokenID.FLOAT_LITERAL, 0, 0, '.341')
+    assert tok == Token(TokenID.FLOAT_LITERAL, 0, '.341')
 
     lex = Lexer(io.StringIO("341.e"))
     tok = lex.get_token()
-    assert tok == Token(TokenID.FLOAT_LITERAL, 0, 0, '341.')
+    assert tok == Token(TokenID.FLOAT_LITERAL, 0, '341.')
 
     lex = Lexer(io.StringIO("341e1"))
     tok = lex.get_token()
-    assert tok == Token(TokenID.FLOAT_LITERAL, 0, 0, '341e1')
+    assert tok == Token(TokenID.FLOAT_LITERAL, 0, '341e1')
 
     lex = Lexer(io.StringIO("341e-1"))
     tok = lex.get_token()
-    assert tok == Token(TokenID.FLOAT_LITERAL, 0, 0, '341e-1')
+    assert tok == Token(TokenID.FLOAT_LITERAL, 0, '341e-1')
 
     lex = Lexer(io.StringIO("341.5e-1"))
     tok = lex.get_token()
-    assert tok == Token(TokenID.FLOAT_LITERAL, 0, 0, '341.5e-1')
+    assert tok == Token(TokenID.FLOAT_LITERAL, 0, '341.5e-1')
 
     lex = Lexer(io.StringIO(".0e-1"))
     tok = lex.get_token()
-    assert tok == Token(TokenID.FLOAT_LITERAL, 0, 0, '.0e-1')
+    assert tok == Token(TokenID.FLOAT_LITERAL, 0, '.0e-1')
 
 
 def test_operators():
@@ -204,13 +222,13 @@ def test_reserved_words():
 def test_string_literal():
     lex = Lexer(io.StringIO(r'   "  \"string\"  "'))
     tok = lex.get_token()
-    assert tok == Token(TokenID.STR_LITERAL, 0, 0, '  "string"  ')
+    assert tok == Token(TokenID.STR_LITERAL, 0, '  "string"  ')
 
     lex = Lexer(io.StringIO(r'   "  \"string\"  "  "another string" '))
     tok = lex.get_token()
-    assert tok == Token(TokenID.STR_LITERAL, 0, 0, '  "string"  ')
+    assert tok == Token(TokenID.STR_LITERAL, 0, '  "string"  ')
     tok = lex.get_token()
-    assert tok == Token(TokenID.STR_LITERAL, 0, 0, 'another string')
+    assert tok == Token(TokenID.STR_LITERAL, 0, 'another string')
 
     with pytest.raises(LexException) as ex:
         lex = Lexer(io.StringIO(r'   "  \"string\" '))
@@ -225,7 +243,7 @@ def test_string_literal():
 
 def test_char_literal():
     lex = Lexer(io.StringIO(" 'ñ' "))
-    assert lex.get_token() == Token(TokenID.CHAR_LITERAL, 1, 3, 'ñ')
+    assert lex.get_token() == Token(TokenID.CHAR_LITERAL, 1, 'ñ')
 
     lex = Lexer(io.StringIO(" 'a"))
     with pytest.raises(LexException) as ex:
@@ -238,8 +256,8 @@ def test_char_literal():
     assert "Empty char value not allowed" == ex.value.args[0]
 
     lex = Lexer(io.StringIO(" 'ñ' 'a' "))
-    assert lex.get_token() == Token(TokenID.CHAR_LITERAL, 1, 3, 'ñ')
-    assert lex.get_token() == Token(TokenID.CHAR_LITERAL, 1, 7, 'a')
+    assert lex.get_token() == Token(TokenID.CHAR_LITERAL, 1, 'ñ')
+    assert lex.get_token() == Token(TokenID.CHAR_LITERAL, 5, 'a')
 
 
 def test_token_lookahead():
@@ -247,3 +265,315 @@ def test_token_lookahead():
     tokens = [lex.lookahead(i + 1) for i in range(4)]
     for i in range(4):
         assert tokens[i] == lex.get_token(), "Failed lookahead {}".format(i + 1)
+
+
+def test_token_lookahead_scans_once():
+    program = " a = b ( 324 ) ; /* comment */ c = 1;"
+    lex = Lexer(io.StringIO(program))
+    assert lex.lookahead(3) == TokenID.ID
+    assert lex.lookahead(1) == TokenID.ID
+    assert lex.scanned_tokens == 3
+
+    tokens = []
+    while not tokens or tokens[-1] != TokenID.EOF:
+        lex.lookahead(1)
+        tokens.append(lex.get_token())
+
+    assert len(tokens) == 12
+    assert lex.scanned_tokens == 12
+    assert lex.scanned_chars == len(program)
+
+
+# Inputs used in the tests above, for the engines differential test
+LEXER_TEST_INPUTS = [
+    '  \n\r\t', '\n    // A skipped comment\n    ', '\n    / // A skipped comment\n    ',
+    '\n    // A skipped comment\n    /', '\n/* A skipped comment\n',
+    '\n       /* A skipped comment\n        /*\n        */\n        /', '!', '    /*  */ _an_identifier',
+    '.', '.e', '.e+1', '341e', '341 ', '341e+', '341e+ x\n5', '341.', '341.5', '.341', '341.e', '341e1', '341e-1',
+    '341.5e-1', '.0e-1', '!= == = + += - -= * *= / /= % %= < <= > >= ** **=', '( ) [ ] { } ., ; :',
+    'fn mut if else return while char', r'   "  \"string\"  "', r'   "  \"string\"  "  "another string" ',
+    r'   "  \"string\" ', '   "  \\"string\\" \n', " 'ñ' ", " 'a", " '' ", " 'ñ' 'a' ", " an_ID ( 324 )",
+]
+
+RANDOM_PROGRAM_PIECES = [
+    'a', 'foo_1', 'ñandú', 'fn', 'var', 'while', '12', '3.5', '.5', '7e3', '2E-4', '1.e', '5e+', '.', '+', '+=',
+    '*', '**', '**=', '/', '/=', '==', '!=', '<=', '<', '(', ')', '{', '}', ';', ':', ',', '"str"', r'"a\"b"',
+    '"a\\\nb"', "'c'", "'ñ'", '// comment\n', '/* multi\nline */', '/*/', ' ', '\n', '\t',
+    '!', '"unclosed', "''", '/*', '\\', '²', '٣',
+]
+
+
+class GeneratorStream(io.TextIOBase):
+    """ A non seekable text stream which reads the chunks produced by a generator
+    """
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = ''
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._pending) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._pending += chunk
+
+        size = len(self._pending) if size < 0 else size
+        result, self._pending = self._pending[:size], self._pending[size:]
+        return result
+
+
+def scan_all(program: str, engine: str, **kwargs):
+    """ Returns the list of (id, line, col, value) of every token, ending with the error (if any)
+    """
+    stream = GeneratorStream([program]) if kwargs.get('streaming') else io.StringIO(program)
+    lex = Lexer(stream, engine=engine, **kwargs)
+    result = []
+    try:
+        while True:
+            tok = lex.get_token()
+            result.append((tok.id_, tok.line, tok.col, tok.value))
+            if tok == TokenID.EOF:
+                return result
+    except LexException as e:
+        return result + [e.args[0]]
+
+
+def test_lexer_engine_selection():
+    assert isinstance(Lexer(io.StringIO(''), engine='regex'), RegexLexer)
+    assert not isinstance(Lexer(io.StringIO('')), RegexLexer)
+
+    with pytest.raises(ValueError):
+        Lexer(io.StringIO(''), engine='unknown')
+
+
+@pytest.mark.parametrize('program', LEXER_TEST_INPUTS)
+def test_regex_engine_same_as_char_engine(program):
+    assert scan_all(program, 'regex') == scan_all(program, 'char')
+
+
+def test_regex_engine_same_as_char_engine_random_programs():
+    rnd = random.Random(1)
+    for _ in range(2000):
+        program = ''.join(rnd.choice(RANDOM_PROGRAM_PIECES) + rnd.choice(('', ' ', '\n'))
+                          for _ in range(rnd.randint(0, 20)))
+        assert scan_all(program, 'regex') == scan_all(program, 'char'), 'Failed for {}'.format(repr(program))
+
+
+def test_token_num_val_is_lazy():
+    tok = Token(TokenID.INT_LITERAL, 0, '341')
+    assert tok._num_val is None
+    assert tok.num_val == 341
+    assert Token(TokenID.FLOAT_LITERAL, 0, '.5e1').num_val == 5.0
+
+    with pytest.raises(AttributeError):
+        Token(TokenID.ID, 0, 'a').num_val
+
+
+@pytest.mark.parametrize('engine', ['char', 'regex'])
+def test_token_stream_same_as_lexer(engine):
+    rnd = random.Random(2)
+    pieces = RANDOM_PROGRAM_PIECES[:RANDOM_PROGRAM_PIECES.index('!')]  # No lexical errors
+    for _ in range(500):
+        program = ''.join(rnd.choice(pieces) + rnd.choice(('', ' ', '\n')) for _ in range(rnd.randint(0, 20)))
+        stream = TokenStream.from_lexer(Lexer(io.StringIO(program), engine=engine))
+        assert [(tok.id_, tok.line, tok.col, tok.value) for tok in stream] == scan_all(program, engine)
+        assert [program[stream.starts[i]:stream.ends[i]].strip() for i in range(len(stream))] == \
+            [program[stream.starts[i]:stream.ends[i]] for i in range(len(stream))]
+
+
+def token_stream_columns(stream: TokenStream):
+    return [list(getattr(stream, column)) for column in ('ids', 'starts', 'ends')]
+
+
+def test_token_stream_relex_comments():
+    program = "a = 1;\nb = 2; /* c = 3; */\nd = 4;\n"
+    stream = TokenStream.from_lexer(Lexer(io.StringIO(program)))
+
+    opened = stream.relex(7, 0, '/*')  # Closed by the existing */
+    assert opened.source == "a = 1;\n/*b = 2; /* c = 3; */\nd = 4;\n"
+    assert token_stream_columns(opened) == token_stream_columns(TokenStream.from_lexer(Lexer(io.StringIO(opened.source))))
+    assert [tok.value for tok in opened] == ['a', '=', '1', ';', 'd', '=', '4', ';', '']
+
+    closed = opened.relex(7, 2, '')
+    assert token_stream_columns(closed) == token_stream_columns(stream)
+
+    with pytest.raises(LexException):
+        stream.relex(24, 2, '')  # Removes the */
+
+
+@pytest.mark.parametrize('engine', ['char', 'regex'])
+def test_token_stream_relex_random_edits(engine):
+    rnd = random.Random(3)
+    for _ in range(500):
+        program = ''.join(rnd.choice(RANDOM_PROGRAM_PIECES) + rnd.choice(('', ' ', '\n'))
+                          for _ in range(rnd.randint(0, 20)))
+        try:
+            stream = TokenStream.from_lexer(Lexer(io.StringIO(program), engine=engine))
+        except LexException:
+            continue
+
+        offset = rnd.randint(0, len(program))
+        removed = rnd.randint(0, min(5, len(program) - offset))
+        inserted = ''.join(rnd.choice(RANDOM_PROGRAM_PIECES) for _ in range(rnd.randint(0, 2)))
+        new_program = program[:offset] + inserted + program[offset + removed:]
+        try:
+            expected = token_stream_columns(TokenStream.from_lexer(Lexer(io.StringIO(new_program), engine=engine)))
+        except LexException as e:
+            expected = e.args[0]
+
+        try:
+            result = token_stream_columns(stream.relex(offset, removed, inserted))
+        except LexException as e:
+            result = e.args[0]
+
+        assert result == expected, "Failed for {} editing {}".format(repr(program), (offset, removed, inserted))
+
+
+def test_token_stream_relex_scans_only_the_edit():
+    program = "var a: int32;\na = a + 1;\n" * 10000
+    stream = TokenStream.from_lexer(Lexer(io.StringIO(program)))
+    offset = len(program) // 2 + 14  # The 'a' of an assignment
+    assert program[offset:offset + 2] == 'a '
+    result = stream.relex(offset, 1, 'abc')
+    assert result.relexed_tokens < 5
+    assert result.source.count('abc') == 1
+    assert result[len(result) - 1].line == 20001
+
+
+def test_token_stream_relex_work_does_not_grow_with_source_size():
+    def relex_work(repeats: int) -> Tuple[int, int, int]:
+        program = "var a: int32;\na = a + 1;\n" * repeats
+        stream = TokenStream.from_lexer(Lexer(io.StringIO(program)))
+        result = stream.relex(len(program) // 2 + 14, 1, 'abc')
+        assert result._source is None, "The source should not be built"
+        assert result.value(len(result) // 2 + 5) == 'abc'
+        return result.relexed_tokens, result.relexed_chars, len(result._segments)
+
+    small, large = relex_work(10000), relex_work(160000)
+    assert small == large, "16 times the source: {} vs. {} (tokens, chars, segments)".format(large, small)
+    assert small[1] < 100
+
+
+def test_token_stream_relex_many_edits():
+    program = "var a: int32;\na = a + 1;\n" * 1000
+    stream = TokenStream.from_lexer(Lexer(io.StringIO(program)))
+    rnd = random.Random(5)
+    for _ in range(3000):
+        offset = rnd.randrange(len(program) // 14) * 14  # Start of a sentence
+        inserted = rnd.choice(('a = 2;\n', 'b;', ''))
+        removed = 0 if inserted else program.find('\n', offset) + 1 - offset
+        program = program[:offset] + inserted + program[offset + removed:]
+        stream = stream.relex(offset, removed, inserted)
+
+        depth, old = 0, stream
+        while old._edit is not None:
+            depth, old = depth + 1, old._edit[0]
+        assert depth < lexer._MAX_EDIT_DEPTH, "The chain of old streams should be bounded"
+        assert len(stream._segments) <= 3 * lexer._MAX_EDIT_DEPTH
+
+    assert stream.source == program
+    assert token_stream_columns(stream) == token_stream_columns(TokenStream.from_lexer(Lexer(io.StringIO(program))))
+
+
+@pytest.mark.parametrize('engine', ['char', 'regex'])
+def test_streaming_same_as_whole_source(engine):
+    rnd = random.Random(6)
+    for _ in range(500):
+        program = ''.join(rnd.choice(RANDOM_PROGRAM_PIECES) + rnd.choice(('', ' ', '\n'))
+                          for _ in range(rnd.randint(0, 20)))
+        chunk_size = rnd.randint(1, 8)
+        assert scan_all(program, engine, streaming=True, chunk_size=chunk_size) == scan_all(program, engine), \
+            'Failed for {} in chunks of {}'.format(repr(program), chunk_size)
+
+
+def test_streaming_window_is_bounded():
+    lines = ("var a_{0}: float;\n/* comment\n{0} */ a_{0} = 2e+{0} ** .5;\n".format(i) for i in range(20000))
+    stream = GeneratorStream(lines)
+    assert not stream.seekable()
+
+    lex = Lexer(stream, streaming=True, chunk_size=1024)
+    max_window = tokens = 0
+    while lex.get_token() != TokenID.EOF:
+        max_window = max(max_window, len(lex._buffer))
+        tokens += 1
+
+    assert tokens == 20000 * 11
+    assert lex.line == 60001
+    assert max_window <= 2048
+
+
+@pytest.mark.parametrize('engine', ['char', 'regex'])
+def test_token_locations_are_offsets(engine):
+    rnd = random.Random(7)
+    pieces = RANDOM_PROGRAM_PIECES[:RANDOM_PROGRAM_PIECES.index('!')]  # No lexical errors
+    for _ in range(200):
+        program = ''.join(rnd.choice(pieces) + rnd.choice(('', ' ', '\n')) for _ in range(rnd.randint(0, 20)))
+        lex = Lexer(io.StringIO(program), engine=engine)
+        tokens = [lex.get_token()]
+        while tokens[-1] != TokenID.EOF:
+            tokens.append(lex.get_token())
+
+        assert lex.line_index._starts is None, "Line index built before needed"
+        for tok in tokens:
+            line = program.count('\n', 0, tok.offset) + 1
+            col = tok.offset - program.rfind('\n', 0, tok.offset)
+            assert (tok.line, tok.col) == (line, col), 'Failed for {} in {}'.format(tok, repr(program))
+
+
+@pytest.mark.parametrize('engine', ['char', 'regex'])
+def test_token_columns_of_punctuation_and_char_literals(engine):
+    # These were one column past the token start (i.e. at the char of a char literal, not at its quote)
+    lex = Lexer(io.StringIO("a = b / 'c';\n(d <= e) != 'f'"), engine=engine)
+    locations = []
+    tok = lex.get_token()
+    while tok != TokenID.EOF:
+        locations.append((tok.value, tok.line, tok.col))
+        tok = lex.get_token()
+
+    assert locations == [
+        ('a', 1, 1), ('=', 1, 3), ('b', 1, 5), ('/', 1, 7), ('c', 1, 9), (';', 1, 12),
+        ('(', 2, 1), ('d', 2, 2), ('<=', 2, 4), ('e', 2, 7), (')', 2, 8), ('!=', 2, 10), ('f', 2, 13),
+    ]
+
+
+def test_line_index_of_a_fragment():
+    source = "ab\ncd\nef"
+    index = LineIndex(source[4:], offset=4, line=2, col=2)
+    assert [index.location(i) for i in range(4, 9)] == [LineIndex(source).location(i) for i in range(4, 9)]
+    assert Token(TokenID.ID, 0, 'a').line == 0
+
+
+@pytest.mark.parametrize('engine', ['char', 'regex'])
+def test_every_operator(engine):
+    operators = [x for x in TOKEN_MAP if not x.isalpha()] + ['/', '/=']
+    tokens = scan_all(' '.join(operators), engine)
+    assert [value for _, _, _, value in tokens[:-1]] == operators
+    assert [id_ for id_, _, _, _ in tokens[:-3]] == [TOKEN_MAP[x] for x in operators[:-2]]
+
+
+@pytest.mark.parametrize('engine', ['char', 'regex'])
+def test_only_ascii_digits_are_numbers(engine):
+    assert scan_all('1²', engine) == [(TokenID.INT_LITERAL, 1, 1, '1'), "Invalid char '²' at line 1, column 2"]
+    assert scan_all('٣', engine) == ["Invalid char '٣' at line 1, column 1"]
+    assert scan_all('ñ²', engine) == [(TokenID.ID, 1, 1, 'ñ²'), (TokenID.EOF, 1, 3, '')]
+
+
+@pytest.mark.parametrize('engine', ['char', 'regex'])
+def test_token_stream_from_source_in_parallel(engine):
+    rnd = random.Random(10)
+    pieces = RANDOM_PROGRAM_PIECES[:RANDOM_PROGRAM_PIECES.index('!')]  # No lexical errors
+    chunks = [rnd.choice(pieces) + rnd.choice(('', ' ', '\n')) for _ in range(3000)]
+    program = ''.join(chunks)
+    stream = TokenStream.from_source(program, engine, workers=3)
+    assert token_stream_columns(stream) == token_stream_columns(TokenStream.from_source(program, engine))
+    assert stream.relexed_tokens == len(stream) + 2  # The EOF tokens of the first two parts
+
+    program = ''.join(chunks[:2000]) + '\n"unclosed\n' + ''.join(chunks[2000:])
+    with pytest.raises(LexException) as ex:
+        TokenStream.from_source(program, engine)
+    with pytest.raises(LexException) as parallel_ex:
+        TokenStream.from_source(program, engine, workers=3)
+    assert parallel_ex.value.args == ex.value.args
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+
+import pytest
+
+import log
+import main
+
+
+@pytest.fixture
+def sources(tmp_path):
+    """ A directory tree of programs, two of them with errors
+    """
+    (tmp_path / 'src' / 'sub').mkdir(parents=True)
+    (tmp_path / 'src' / 'a.ph').write_text('var a: int32;\na = 1;\n')
+    (tmp_path / 'src' / 'b.ph').write_text('var b: int32;\nb = ;\nb = b + ;\n')
+    (tmp_path / 'src' / 'sub' / 'c.ph').write_text('var c: int32;\n')
+    (tmp_path / 'src' / 'sub' / 'd.ph').write_text('var d: int9;\n')
+    (tmp_path / 'src' / 'sub' / 'e.txt').write_text('not a program\n')
+    return tmp_path
+
+
+def test_find_sources(sources):
+    src = str(sources / 'src')
+    assert main.find_sources([src]) == [
+        (os.path.join(src, 'a.ph'), 'a.ph'),
+        (os.path.join(src, 'b.ph'), 'b.ph'),
+        (os.path.join(src, 'sub', 'c.ph'), os.path.join('sub', 'c.ph')),
+        (os.path.join(src, 'sub', 'd.ph'), os.path.join('sub', 'd.ph')),
+    ]
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_compile_batch(mocker, sources, jobs):
+    src = sources / 'src'
+    mocker.patch('log.OUTPUT', io.StringIO())
+    assert main.compile_batch([str(src)], str(sources / 'out'), jobs=jobs, max_errors=0) == 2
+    assert (sources / 'out' / 'a.c').read_text() == '#include <stdlib.h>\n\nint main() {\n  int32_t a;\n  a = 1;\n}\n'
+    assert (sources / 'out' / 'sub' / 'c.c').exists()
+    assert not (sources / 'out' / 'b.c').exists()
+    assert not (sources / 'out' / 'sub' / 'd.c').exists()
+    assert log.OUTPUT.getvalue() == (
+        "{0}: LogLevel.ERROR: 2: syntax error: unexpected token 'Token<SC 2:5 ;>'\n"
+        "{0}: LogLevel.ERROR: 3: syntax error: unexpected token 'Token<SC 3:9 ;>'\n"
+        "{1}: LogLevel.ERROR: 1: unknown type int9\n"
+    ).format(src / 'b.ph', src / 'sub' / 'd.ph')
+    assert log.ERROR_COUNT == 0
+
+
+def test_main_writes_next_to_sources(mocker, sources):
+    src = sources / 'src'
+    mocker.patch('log.OUTPUT', io.StringIO())
+    with pytest.raises(SystemExit):
+        main.main(['main.py', str(src / 'a.ph'), str(src / 'b.ph')])
+    assert (src / 'a.c').exists()
+    assert not (src / 'b.c').exists()
+    assert log.OUTPUT.getvalue().count('\n') == 1, "Should stop at the first error of each file"
+
+
+def test_main_writes_interfaces(mocker, sources):
+    src = sources / 'src'
+    (src / 'f.ph').write_text('fn f(x: int32): int8 {\n    return x;\n}\n')
+    mocker.patch('log.OUTPUT', io.StringIO())
+    assert main.compile_batch([str(src)], str(sources / 'out'), max_errors=0, interface=True) == 2
+    assert (sources / 'out' / 'a.phi').read_text().splitlines()[1:] == []
+    assert (sources / 'out' / 'f.phi').read_text().splitlines()[1:] == ['f int8 x int32']
+    assert not (sources / 'out' / 'a.c').exists()
+    assert not (sources / 'out' / 'b.phi').exists()
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_compile_batch_lexical_errors(mocker, tmp_path, jobs):
+    (tmp_path / 'a.ph').write_text('var a: int32;\n')
+    (tmp_path / 'b.ph').write_text('var b: int32;\nb = 1 @ 2;\n')
+    (tmp_path / 'c.ph').write_bytes(b'var c: int32;\n// \xff\n')
+    (tmp_path / 'd.ph').write_text('var d: int32;\n')
+    mocker.patch('log.OUTPUT', io.StringIO())
+    paths = [str(tmp_path / name) for name in ('a.ph', 'b.ph', 'c.ph', 'd.ph', 'missing.ph')]
+    assert main.compile_batch(paths, str(tmp_path / 'out'), jobs=jobs) == 3
+    assert (tmp_path / 'out' / 'a.c').exists() and (tmp_path / 'out' / 'd.c').exists()
+    assert not (tmp_path / 'out' / 'b.c').exists()
+    diagnostics = log.OUTPUT.getvalue().splitlines()
+    assert len(diagnostics) == 3
+    assert diagnostics[0] == "{}: LogLevel.ERROR: Invalid char '@' at line 2, column 7".format(paths[1])
+    assert diagnostics[1].startswith('{}: LogLevel.ERROR: '.format(paths[2])) and 'decode' in diagnostics[1]
+    assert diagnostics[2].startswith('{}: LogLevel.ERROR: '.format(paths[4]))
+    assert log.ERROR_COUNT == 0
+
+
+@pytest.mark.parametrize('program, max_errors', [
+    ('a = 1 @ 2;\n', 0), ('a = ;\n', 1), ('a = 1;\n', 0)
+], ids=['lexical error', 'too many errors', 'no errors'])
+def test_compile_file_closes_the_source(mocker, tmp_path, program, max_errors):
+    (tmp_path / 'a.ph').write_text('var a: int32;\n' + program + 'a = 2;\n' * 20000)  # Not read to the end on errors
+    opened = []
+
+    def open_(*args, **kwargs):
+        opened.append(open(*args, **kwargs))
+        return opened[-1]
+
+    mocker.patch('main.open', open_, create=True)
+    mocker.patch('log.OUTPUT', io.StringIO())
+    mocker.patch('log.ERROR_COUNT', 0)
+    mocker.patch('log.MAX_ERRORS_ALLOWED', log.MAX_ERRORS_ALLOWED)
+    success, _ = main.compile_file(str(tmp_path / 'a.ph'), str(tmp_path / 'a.c'), max_errors)
+    assert success == (program == 'a = 1;\n')
+    assert opened and all(x.closed for x in opened)
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_compile_batch_internal_errors(mocker, tmp_path, jobs):
+    (tmp_path / 'a.ph').write_text('var a: int32;\nb = ;\n')
+    (tmp_path / 'b.ph').write_text('fn f(x: int32): int32 {\n    return x;\n}\n')  # Not translated to C yet
+    (tmp_path / 'c.ph').write_text('var c: int32;\n')
+    mocker.patch('log.OUTPUT', io.StringIO())
+    paths = [str(tmp_path / name) for name in ('a.ph', 'b.ph', 'c.ph')]
+    assert main.compile_batch(paths, str(tmp_path / 'out'), jobs=jobs) == 2
+    assert (tmp_path / 'out' / 'c.c').exists()
+    assert not (tmp_path / 'out' / 'b.c').exists()
+    diagnostics = log.OUTPUT.getvalue().splitlines()
+    assert diagnostics[0] == "{}: LogLevel.ERROR: 2: syntax error: unexpected token 'Token<SC 2:5 ;>'".format(paths[0])
+    assert diagnostics[1].startswith('{}: LogLevel.ERROR: internal error: AttributeError: '.format(paths[1]))
+    assert len(diagnostics) == 2
+    assert log.ERROR_COUNT == 0
+
+
+@pytest.mark.parametrize('options', [[], ['--pipeline'], ['--max-errors', '0']])
+def test_main_reports_syntax_errors_first(mocker, capsys, tmp_path, options):
+    source = tmp_path / 'a.ph'
+    source.write_text('var a: int8;\na = ;\n')  # int8 is not translated to C yet
+    mocker.patch('log.OUTPUT', io.StringIO())
+    mocker.patch('log.ERROR_COUNT', 0)
+    mocker.patch('log.MAX_ERRORS_ALLOWED', log.MAX_ERRORS_ALLOWED)
+    with pytest.raises(SystemExit):
+        main.main(['main.py', str(source)] + options)
+    assert log.OUTPUT.getvalue() == "LogLevel.ERROR: 2: syntax error: unexpected token 'Token<SC 2:5 ;>'\n"
+
+    source.write_text('var a: int8;\na = 1;\n')
+    log.ERROR_COUNT = 0
+    with pytest.raises(KeyError):
+        main.main(['main.py', str(source)] + options)
+
+
+def test_main_imports_interfaces(mocker, capsys, tmp_path):
+    (tmp_path / 'lib.ph').write_text('fn f(x: int32): int32 {\n    return x;\n}\n')
+    (tmp_path / 'a.ph').write_text('var a: int32;\na = 1;\n')
+    (tmp_path / 'b.ph').write_text('var f: int32;\n')
+    mocker.patch('log.OUTPUT', io.StringIO())
+    mocker.patch('log.ERROR_COUNT', 0)
+    mocker.patch('log.MAX_ERRORS_ALLOWED', log.MAX_ERRORS_ALLOWED)
+    main.main(['main.py', '--interface', str(tmp_path / 'lib.ph')])
+    interface = str(tmp_path / 'lib.phi')
+    capsys.readouterr()
+
+    main.main(['main.py', '--import', interface, str(tmp_path / 'a.ph')])
+    assert capsys.readouterr().out == '#include <stdlib.h>\n\nint main() {\n  int32_t a;\n  a = 1;\n}\n'
+    with pytest.raises(SystemExit):
+        main.main(['main.py', '-i', interface, str(tmp_path / 'b.ph')])
+    assert log.OUTPUT.getvalue() == 'LogLevel.ERROR: 1: duplicated name "f"\n', "Declared in the program scope"
+
+    log.OUTPUT, log.ERROR_COUNT = io.StringIO(), 0
+    interfaces = main.load_interfaces([interface])
+    assert main.compile_batch([str(tmp_path / 'b.ph')], str(tmp_path / 'out'), interfaces=interfaces) == 1
+    with pytest.raises(SystemExit):
+        main.main(['main.py', '-i', str(tmp_path / 'a.ph'), str(tmp_path / 'a.ph')])
+    assert 'cannot load interface' in capsys.readouterr().err
@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 
 import io
+import random
 import parser
 
+import pytest
+
 import ast_
 from lexer import Token, TokenID
 import log
@@ -36,6 +39,22 @@ def test_parser_numeric_literal_float():
     assert ast.type.name == 'float'
 
 
+def test_parser_numeric_literal_types():
+    expected = [(0, 'int8'), (127, 'int8'), (128, 'uint8'), (255, 'uint8'), (256, 'int32'), (2 ** 31 - 1, 'int32'),
+                (2 ** 31, 'uint32'), (2 ** 32 - 1, 'uint32'), (2 ** 32, 'int64'), (2 ** 63 - 1, 'int64'),
+                (2 ** 63, 'uint64'), (2 ** 64 - 1, 'uint64')]
+    parser_ = parser.Parser(io.StringIO(' '.join(str(x) for x, _ in expected)))
+    for value, type_name in expected:
+        ast = parser_.match_number_literal()
+        assert ast.token.num_val == value
+        assert ast.type.name == type_name, "Wrong type for {}".format(value)
+
+    other = parser.Parser(io.StringIO(''))
+    assert other.primitive_types == parser_.primitive_types, "Primitive types should be shared"
+    assert all(x is y for x, y in zip(other.primitive_types, parser_.primitive_types))
+    assert parser_.symbol_table.resolve_symbol('float') is parser.FLOAT_TYPE
+
+
 def test_parser_numeric_error(mocker):
     mocker.patch('log.error')
     parser_ = parser.Parser(io.StringIO('  a '))
@@ -108,7 +127,7 @@ def test_parser_unary(mocker):
     parser_ = parser.Parser(io.StringIO("  + --'a'"))
     ast = parser_.match_unary()
     assert ast is None, "Syntax error expected"
-    log.error.assert_called_once_with("1: syntax error: unexpected token 'Token<CHAR_LITERAL 1:8 a>'")
+    log.error.assert_called_once_with("1: syntax error: unexpected token 'Token<CHAR_LITERAL 1:7 a>'")
 
 
 def test_parse_unary_with_parenthesis():
@@ -143,6 +162,34 @@ def test_parser_binary():
     assert ast.emit() == '((1 + 5) + 4)'
 
 
+def test_parser_binary_precedence_and_associativity():
+    for expression, expected in [
+        ('1 + 2 * 3 ** 4 * 5', '(1 + ((2 * (3 ** 4)) * 5))'),
+        ('a < b + c * d - e', '(a < ((b + (c * d)) - e))'),
+        ('2 ** 3 ** 2', '(2 ** (3 ** 2))'),
+        ('-2 ** -3 ** 2 % 4', '((-2 ** (-3 ** 2)) % 4)'),
+        ('8 / 4 / 2', '((8 / 4) / 2)'),
+    ]:
+        parser_ = parser.Parser(io.StringIO(expression))
+        assert parser_.match_binary_or_unary().emit() == expected
+
+
+@pytest.mark.parametrize('oper, left_associative', [('+', True), ('**', False)])
+def test_parse_long_expression(oper, left_associative):
+    terms = 20000  # Far beyond the recursion limit
+    parser_ = parser.Parser(io.StringIO(' {} '.format(oper).join(['a'] * terms)))
+    ast = parser_.match_binary_or_unary()
+    assert parser_.lookahead == TokenID.EOF
+
+    depth = 0
+    while isinstance(ast, ast_.BinaryExprAST):
+        assert ast.op.value == oper
+        ast = ast.left if left_associative else ast.right
+        depth += 1
+
+    assert depth == terms - 1
+
+
 def test_parser_arglist():
     parser_ = parser.Parser(io.StringIO(" ((5 - 3), 4, 2 + 3 * -4)"))
     ast = parser_.match_arg_list()
@@ -227,6 +274,48 @@ def test_parse_statement(mocker):
     log.error.assert_called_once_with("4: syntax error: unexpected token 'Token<ID 4:9 f>'")
 
 
+def test_parse_statement_dispatch(mocker):
+    dispatch = parser.Parser._statement_dispatch
+    assert dispatch[TokenID.VAR] == parser.Parser.match_var_decl
+    assert dispatch[TokenID.INT_LITERAL] == parser.Parser.match_expression_sentence
+    assert dispatch[TokenID.SC] == parser.Parser.match_unexpected_sentence
+
+    class EmptySentenceParser(parser.Parser):
+        statements = parser.Parser.statements + [parser.Statement('empty', frozenset({TokenID.SC}), 'match_empty')]
+
+        def match_empty(self):
+            return self.match(TokenID.SC) and ast_.BlockAST([])
+
+    parser_ = EmptySentenceParser(io.StringIO('; a = 1;'))
+    assert isinstance(parser_.match_sentence(), ast_.BlockAST)
+    assert isinstance(parser_.match_sentence(), ast_.AssignmentAST)
+
+    mocker.patch('log.error')
+    parser_ = parser.Parser(io.StringIO('; a = 1;'))
+    assert parser_.match_sentence() is None
+    log.error.assert_called_once_with("1: syntax error: unexpected token 'Token<SC 1:1 ;>'")
+
+
+def test_parse_statement_conflicts(mocker):
+    mocker.patch('log.warning')
+
+    class ConflictingParser(parser.Parser):
+        statements = parser.Parser.statements + [
+            parser.Statement('call', frozenset({TokenID.ID}), 'match_expression_sentence'),
+            parser.Statement('swap', frozenset({TokenID.ID}), 'match_var_assignment', frozenset({TokenID.ASSIGN})),
+        ]
+
+    assert log.warning.call_args_list == [
+        mocker.call("FIRST/FIRST conflict between 'expression' and 'call' sentences on ID"),
+        mocker.call("FIRST/FIRST conflict between 'assignment' and 'swap' sentences on ID ASSIGN"),
+    ]
+    # The production declared first is used
+    assert ConflictingParser._statement_dispatch[TokenID.VAR] == parser.Parser.match_var_decl
+    parser_ = ConflictingParser(io.StringIO('a = 1; f(a);'))
+    assert isinstance(parser_.match_sentence(), ast_.AssignmentAST)
+    assert isinstance(parser_.match_sentence(), ast_.FunctionCallAST)
+
+
 def test_parse_block():
     parser_ = parser.Parser(io.StringIO("""
         {
@@ -384,3 +473,408 @@ def test_parse_program():
     assert ast.emit() == '{\nint32 f(int32 a) {\nreturn (a + 1);;\n};' \
                          '\nwhile ((a < 10)) {\n{\nif ((a < 5)) {\na = (a + 1)\n} else ' \
                          '{\na = (a + 2)\n};\n}\n};\n}'
+
+
+def test_parse_program_scans_once():
+    program = """
+    var a: int32;
+    a = 1;
+    a = a + 1;
+    f(a);
+    """
+    parser_ = parser.Parser(io.StringIO(program))
+    ast = parser_.parse_program()
+    assert ast is not None, "Should parse a program"
+    assert parser_.lex.scanned_tokens == 21
+    assert parser_.lex.scanned_chars == len(program)
+
+
+def test_parse_program_error_recovery(mocker):
+    mocker.patch('log.error')
+    parser_ = parser.Parser(io.StringIO("""
+    var a: int32;
+    a = ;
+    fn f(b int32): int32 {
+        var c: int32;
+        return c;
+    }
+    fn g(b: int32): int32 {
+        b = b + ;
+        return b;
+    }
+    if a + { a = 1; } else a = 2;
+    a = a + 1;
+    """), recover=True)
+    ast = parser_.parse_program()
+    assert ast is not None, "Should parse a program with errors"
+    assert [type(x) for x in ast.sentences] == [
+        ast_.VarDeclAST, ast_.ErrorAST, ast_.ErrorAST, ast_.FunctionDeclAST, ast_.ErrorAST, ast_.AssignmentAST
+    ]
+    assert isinstance(ast.sentences[3].body.sentences[0], ast_.ErrorAST)
+    assert [x[0][0] for x in log.error.call_args_list] == [
+        "3: syntax error: unexpected token 'Token<SC 3:9 ;>'",
+        "4: syntax error: unexpected token 'Token<ID 4:12 int32>'",
+        "9: syntax error: unexpected token 'Token<SC 9:17 ;>'",
+        "12: syntax error: unexpected token 'Token<LBR 12:12 {>'",
+    ]
+    assert parser_.current_scope == '.', "Scopes should be closed"
+
+
+@pytest.mark.parametrize('program', ['}', ')', '} } a = 1;', 'fn f(): int32 {', 'if a { a = 1; ', 'var var var'])
+def test_parse_program_error_recovery_makes_progress(mocker, program):
+    mocker.patch('log.error')
+    parser_ = parser.Parser(io.StringIO(program), recover=True)
+    ast = parser_.parse_program()
+    assert ast is not None
+    assert log.error.called
+    assert parser_.lookahead == TokenID.EOF
+
+
+def test_parse_program_error_recovery_reports_stray_braces(mocker):
+    program = '}}}\nvar a: int32;\n}\nvar b: int32;\n'
+    mocker.patch('log.error')
+    parser_ = parser.Parser(io.StringIO(program), recover=True)
+    ast = parser_.parse_program()
+    assert [type(x) for x in ast.sentences] == [ast_.ErrorAST] * 3 + [ast_.VarDeclAST, ast_.ErrorAST, ast_.VarDeclAST]
+    assert [x[0][0] for x in log.error.call_args_list] == [
+        "1: syntax error: unexpected token 'Token<RBR 1:1 }>'",
+        "1: syntax error: unexpected token 'Token<RBR 1:2 }>'",
+        "1: syntax error: unexpected token 'Token<RBR 1:3 }>'",
+        "3: syntax error: unexpected token 'Token<RBR 3:1 }>'",
+    ]
+
+    mocker.resetall()
+    parser_ = parser.Parser(io.StringIO(program), recover=True)
+    assert len(list(parser_.iter_program())) == 6
+    assert log.error.call_count == 4
+
+
+REPARSE_PROGRAM = """var a: int32;
+fn f(x: int32): int32 {
+    var y: int32;
+    y = x * 2;
+    return y;
+}
+// A comment
+fn g(x: int32): int32 {
+    if x > 0 {
+        var z: int32;
+        z = x;
+    }
+    return x;
+}
+a = f(1) + g(2);
+"""
+
+
+def test_reparse_keeps_untouched_sentences():
+    parser_ = parser.Parser(io.StringIO(REPARSE_PROGRAM))
+    old = parser_.parse_program()
+    text = REPARSE_PROGRAM.replace('fn f(x: int32): int32 {\n', 'fn f(x: int32): int32 {\n    var w: int32;\n\n')
+    text = text.replace('y = x * 2;', 'y = x * 3;')
+    new = parser_.reparse(old, REPARSE_PROGRAM, text)
+    assert new.emit() == parser.Parser(io.StringIO(text)).parse_program().emit()
+    assert new.sentences[0] is old.sentences[0], "Sentences before the edit should be kept"
+    assert new.sentences[2:] == old.sentences[2:], "Sentences after the edit should be kept"
+    assert new.sentences[1] is not old.sentences[1]
+    assert new.sentences[2].func.token.line == 10, "Kept tokens should be located in the new text"
+    assert new.sentences[3].lvalue.token.line == 17
+
+    parser_.start_scope('S0')
+    parser_.start_scope('f')
+    assert parser_.symbol_table.resolve_symbol('w') is not None
+    assert parser_.symbol_table.resolve_symbol('y') is not None
+
+
+def test_reparse_until_back_in_sync():
+    parser_ = parser.Parser(io.StringIO(REPARSE_PROGRAM))
+    old = parser_.parse_program()
+    text = REPARSE_PROGRAM.replace('// A comment', '/* A comment').replace('a = f(1)', '*/ a = f(1)')
+    new = parser_.reparse(old, REPARSE_PROGRAM, text)
+    assert [type(x) for x in new.sentences] == [ast_.VarDeclAST, ast_.FunctionDeclAST, ast_.AssignmentAST]
+    assert new.sentences[0] is old.sentences[0]
+    assert new.emit() == parser.Parser(io.StringIO(text)).parse_program().emit()
+
+    new = parser_.reparse(new, text, REPARSE_PROGRAM)
+    assert new.emit() == old.emit()
+    expected = parser.Parser(io.StringIO(REPARSE_PROGRAM))
+    assert parser_.symbol_table.symbol_count == expected.symbol_table.symbol_count + 5
+
+
+def test_reparse_random_edits():
+    rnd = random.Random(0)
+    lines = REPARSE_PROGRAM.splitlines(keepends=True)
+    pieces = ['a = a + 1;\n', 'var b{}: int32;\n', 'fn h{}(x: int8): int8 {{ return x; }}\n', '\n', '// c\n']
+    parser_ = parser.Parser(io.StringIO(REPARSE_PROGRAM))
+    program = parser_.parse_program()
+    text = REPARSE_PROGRAM
+
+    for i in range(100):
+        top_level = [k for k in range(len(lines) + 1) if k == len(lines) or not lines[k].startswith((' ', '}'))]
+        k = rnd.choice(top_level)
+        if rnd.random() < 0.3 and k < len(lines) and lines[k].startswith(('a =', '\n', '// c', 'var b', 'fn h')):
+            del lines[k]
+        else:
+            lines.insert(k, rnd.choice(pieces).format(i))
+
+        new_text = ''.join(lines)
+        program = parser_.reparse(program, text, new_text)
+        text = new_text
+        expected = parser.Parser(io.StringIO(text))
+        assert program.emit() == expected.parse_program().emit()
+        assert parser_.symbol_table.symbol_count == expected.symbol_table.symbol_count
+        assert [x.var.token.line for x in program.sentences if isinstance(x, ast_.VarDeclAST)] == \
+               [x + 1 for x, line in enumerate(lines) if line.startswith('var')]
+
+
+def test_reparse_removes_only_the_symbols_parsed_again(mocker):
+    text = ''.join('var v{}: int32;\n'.format(i) for i in range(1000))
+    parser_ = parser.Parser(io.StringIO(text))
+    program = parser_.parse_program()
+    remove_symbols = mocker.spy(parser_.symbol_table, 'remove_symbols')
+    new_text = text.replace('var v1:', 'var w1:')
+    program = parser_.reparse(program, text, new_text)
+    assert sum(len(call[0][0]) for call in remove_symbols.call_args_list) == 1
+    assert parser_.symbol_table.symbol_count == parser.Parser(io.StringIO(new_text)).symbol_table.symbol_count + 1000
+
+    mocker.patch('log.error')
+    new_text, text = new_text.replace('var w1:', 'var v999:'), new_text
+    assert parser_.reparse(program, text, new_text) is None
+    log.error.assert_called_once_with('1000: duplicated name "v999"'), "Reported like a fresh parse does"
+    assert parser_.program is program, "The last program parsed should be kept on errors"
+
+
+def test_reparse_after_a_failed_one(mocker):
+    mocker.patch('log.error')
+    text = 'var a: int32;\nfn f(x: int32): int32 {\n  return x;\n}\na = f(1);\nvar b: int32;\n'
+    parser_ = parser.Parser(io.StringIO(text))
+    program = parser_.parse_program()
+    assert parser_.reparse(program, text, text.replace('a = f(1);', 'a = f(1')) is None
+    assert parser_.reparse(program, text, text.replace('fn f(x', 'fn f(var c: int32; x')) is None
+
+    new_text = text.replace('a = f(1);', 'a = f(2);')
+    program = parser_.reparse(program, text, new_text)
+    expected = parser.Parser(io.StringIO(new_text))
+    assert program.emit() == expected.parse_program().emit()
+    assert parser_.symbol_table.symbol_count == expected.symbol_table.symbol_count
+    assert scope_names(parser_.symbol_table) == scope_names(expected.symbol_table)
+
+
+@pytest.mark.parametrize('text, new_text, errors', [
+    ('var a: int32;\nvar b: int32;\nvar a: int32;\n', 'var c: int32;\nvar b: int32;\nvar a: int32;\n', []),
+    ('var c: int8;\nvar b: int32;\nvar a: int32;\n', 'var a: int8;\nvar b: int32;\nvar a: int32;\n',
+     ['3: duplicated name "a"']),
+    ('var c: int8;\nvar b: int32;\nvar a: int8;\n', 'var int8: int32;\nvar b: int32;\nvar a: int8;\n', []),
+], ids=['duplicate removed', 'duplicate added', 'type shadowed'])
+def test_reparse_kept_sentences_depending_on_the_names_changed(mocker, text, new_text, errors):
+    mocker.patch('log.error')
+    parser_ = parser.Parser(io.StringIO(text), recover=True)
+    old = parser_.parse_program()
+    log.error.reset_mock()
+    new = parser_.reparse(old, text, new_text)
+    assert [x[0][0] for x in log.error.call_args_list] == errors
+    assert new.sentences[-2] is old.sentences[-2], "Not depending on the names changed"
+
+    expected = parser.Parser(io.StringIO(new_text), recover=True)
+    assert new.emit() == expected.parse_program().emit()
+    assert [type(x) for x in new.sentences] == [type(x) for x in expected.program.sentences]
+    assert parser_.symbol_table.symbol_count == expected.symbol_table.symbol_count
+
+    assert parser_.reparse(new, new_text, text).emit() == old.emit()
+    expected = parser.Parser(io.StringIO(text), recover=True)
+    expected.parse_program()
+    assert parser_.symbol_table.symbol_count == expected.symbol_table.symbol_count
+
+
+def test_reparse_many_edits():
+    """ Locations of tokens kept from the first parse are found through every edit since
+    """
+    rnd = random.Random(0)
+    text = REPARSE_PROGRAM.replace('a = f(1)', '// The end\na = f(1)')
+    lines = text.splitlines(keepends=True)
+    parser_ = parser.Parser(io.StringIO(text))
+    program = parser_.parse_program()
+    first, last = program.sentences[0].var.token, program.sentences[-1].lvalue.token
+
+    for i in range(3000):  # Not editing the first and the last two lines
+        top_level = [k for k in range(1, len(lines) - 2) if not lines[k].startswith((' ', '}'))]
+        k = rnd.choice(top_level)
+        if lines[k].startswith('//') and rnd.random() < 0.4:
+            del lines[k]
+        else:
+            lines.insert(k, '//' + ' ' * rnd.randrange(4) + 'c{}\n'.format(i))
+        new_text = ''.join(lines)
+        program = parser_.reparse(program, text, new_text)
+        text = new_text
+
+    assert program.sentences[-1].lvalue.token is last, "Never edited"
+    assert (first.line, first.col) == (1, 5)
+    assert (last.line, last.col) == (len(lines), 1)
+    assert last.line_index.current_offset(last.offset) == text.rindex('a = f(1)')
+
+
+def test_reparse_sentence_before_the_edit():
+    text = 'var a: int32;\nif a > 0\n    a = 1;\nelsa = 2;\n'
+    parser_ = parser.Parser(io.StringIO(text))
+    old = parser_.parse_program()
+    new_text = text.replace('elsa', 'else a')
+    new = parser_.reparse(old, text, new_text)
+    assert len(new.sentences) == 2
+    assert new.sentences[0] is old.sentences[0]
+    assert new.emit() == parser.Parser(io.StringIO(new_text)).parse_program().emit()
+
+
+def test_reparse_new_sentence_taking_over_the_next_one(mocker):
+    mocker.patch('log.error')
+    parser_ = parser.Parser(io.StringIO(REPARSE_PROGRAM))
+    old = parser_.parse_program()
+    text = REPARSE_PROGRAM.replace('var a: int32;\n', 'var a: int32; if a > 0\n')
+    new = parser_.reparse(old, REPARSE_PROGRAM, text)
+    log.error.assert_not_called()
+    assert [type(x) for x in new.sentences] == [
+        ast_.VarDeclAST, ast_.IfSentenceAST, ast_.FunctionDeclAST, ast_.AssignmentAST
+    ]
+    assert new.sentences[2:] == old.sentences[2:], "Sentences after the one taken over should be kept"
+    assert new.emit() == parser.Parser(io.StringIO(text)).parse_program().emit()
+
+    new = parser_.reparse(new, text, REPARSE_PROGRAM)
+    log.error.assert_not_called()
+    assert new.emit() == old.emit()
+
+
+def symbol_names(symbol_table):
+    return {symbol_table.string_table[x] for scope in symbol_table.scopes() for x in scope.names()}
+
+
+def scope_names(symbol_table):
+    return sorted(scope.mangled_name() for scope in symbol_table.scopes())
+
+
+def test_parse_lazy_function_bodies():
+    parser_ = parser.Parser(io.StringIO(REPARSE_PROGRAM), lazy_bodies=True)
+    ast = parser_.parse_program()
+    assert ast is not None
+    functions = [x for x in ast.sentences if isinstance(x, ast_.FunctionDeclAST)]
+    assert [(x.name, x.parameters.emit(), x.type_.name) for x in functions] == [
+        ('f', '(int32 x)', 'int32'), ('g', '(int32 x)', 'int32')
+    ]
+    assert not any(x.body_parsed for x in functions), "Function bodies should not be parsed yet"
+    assert parser_.lex.scanned_chars == len(REPARSE_PROGRAM), "Bodies should be skipped in one pass"
+
+    parser_.start_scope('S0')
+    assert parser_.symbol_table.resolve_symbol('a') is not None
+    assert isinstance(functions[1].body, ast_.BlockAST)
+    assert functions[1].body_parsed and not functions[0].body_parsed
+    assert parser_.current_scope == '.S0.', "Scopes should be restored after parsing a body"
+
+    eager = parser.Parser(io.StringIO(REPARSE_PROGRAM))
+    assert ast.emit() == eager.parse_program().emit()
+    assert symbol_names(parser_.symbol_table) == symbol_names(eager.symbol_table)
+    assert scope_names(parser_.symbol_table) == scope_names(eager.symbol_table)
+
+
+def test_parse_lazy_function_bodies_errors(mocker):
+    mocker.patch('log.error')
+    parser_ = parser.Parser(io.StringIO('fn f(): int32 { if a { return 1; }'), lazy_bodies=True)
+    assert parser_.parse_program() is None
+    log.error.assert_called_once_with("1: syntax error: unexpected token 'Token<EOF 1:35 >'")
+
+    log.error.reset_mock()
+    parser_ = parser.Parser(io.StringIO('fn f(): int32 {\n  var a: int32;\n  var a: int32;\n}'), lazy_bodies=True)
+    ast = parser_.parse_program()
+    assert ast is not None and not log.error.called
+    assert ast.sentences[0].body is None
+    log.error.assert_called_once_with('3: duplicated name "a"')
+
+
+def test_reparse_lazy_function_bodies():
+    parser_ = parser.Parser(io.StringIO(REPARSE_PROGRAM), lazy_bodies=True)
+    old = parser_.parse_program()
+    assert old.sentences[1].body is not None
+    text = REPARSE_PROGRAM.replace('y = x * 2;', 'y = x * 3;')
+    new = parser_.reparse(old, REPARSE_PROGRAM, text)
+    assert new.sentences[1].body_parsed, "Parsed again eagerly, so it cannot see the symbols kept after it"
+    assert new.sentences[2] is old.sentences[2] and not new.sentences[2].body_parsed
+    assert new.emit() == parser.Parser(io.StringIO(text)).parse_program().emit()
+
+
+def test_iter_program():
+    parser_ = parser.Parser(io.StringIO(REPARSE_PROGRAM))
+    expected = parser.Parser(io.StringIO(REPARSE_PROGRAM)).parse_program()
+    sentences = []
+    for sentence in parser_.iter_program():
+        sentences.append(sentence.emit())
+        assert scope_names(parser_.symbol_table) == ['.', '.S0.'], "Closed scopes should be released"
+
+    assert sentences == [x.emit() for x in expected.sentences]
+    assert parser_.current_scope == '.'
+    assert parser_.symbol_table.symbol_count == parser.Parser(io.StringIO('')).symbol_table.symbol_count + 1
+
+
+@pytest.mark.parametrize('queue_size', [1, 64])
+def test_iter_program_threaded(queue_size):
+    program = ''.join(REPARSE_PROGRAM.replace('fn f(', 'fn f{}('.format(i)).replace('fn g(', 'fn g{}('.format(i))
+                      .replace('var a:', 'var a{}:'.format(i)) for i in range(5))
+    parser_ = parser.Parser(io.StringIO(program))
+    sentences = [x.emit() for x in parser_.iter_program_threaded(queue_size)]
+    assert sentences == [x.emit() for x in parser.Parser(io.StringIO(program)).parse_program().sentences]
+
+    parser_ = parser.Parser(io.StringIO(program))
+    sentences = parser_.iter_program_threaded(queue_size)
+    assert isinstance(next(sentences), ast_.VarDeclAST)
+    sentences.close()  # Stops the parsing thread
+
+
+def test_iter_program_threaded_errors(mocker):
+    mocker.patch('log.OUTPUT', io.StringIO())
+    mocker.patch('log.ERROR_COUNT', 0)
+    parser_ = parser.Parser(io.StringIO('var a: int32;\na = 1;\na = ;\na = 2;\n'))
+    sentences = parser_.iter_program_threaded()
+    assert isinstance(next(sentences), ast_.VarDeclAST)
+    assert isinstance(next(sentences), ast_.AssignmentAST)
+    with pytest.raises(SystemExit):
+        next(sentences)
+    assert log.OUTPUT.getvalue() == "LogLevel.ERROR: 3: syntax error: unexpected token 'Token<SC 3:5 ;>'\n"
+
+
+def nesting_depth(ast) -> int:
+    """ Depth of the nested if, while and block sentences (computed without recursion)
+    """
+    depth = 0
+    while True:
+        if isinstance(ast, ast_.IfSentenceAST):
+            ast = ast.else_ if ast.else_ is not None else ast.then
+        elif isinstance(ast, ast_.WhileSentenceAST):
+            ast = ast.block
+        elif isinstance(ast, ast_.BlockAST) and ast.sentences:
+            ast = ast.sentences[-1]
+        else:
+            return depth
+        depth += 1
+
+
+@pytest.mark.parametrize('prefix', ['if a < 1 ', 'while a > 0 ', 'if a a = 1; else '])
+def test_parse_deep_nesting(prefix):
+    depth = 100000
+    parser_ = parser.Parser(io.StringIO('var a: int32;\n' + prefix * depth + 'a = a + 1;\n'))
+    ast = parser_.parse_program()
+    assert ast is not None
+    assert nesting_depth(ast.sentences[1]) == depth
+
+
+def test_parse_deep_blocks(mocker):
+    depth = 100000
+    program = 'fn f(a: int32): int32 {\n' + 'while a > 0 { var b: int32;\n' * depth + 'a = a - 1;' + '}' * depth + '}\n'
+    parser_ = parser.Parser(io.StringIO(program))
+    ast = parser_.parse_program()
+    assert ast is not None
+    assert nesting_depth(ast.sentences[0].body) == 2 * depth + 1
+    assert parser_.current_scope == '.'
+    assert len(list(parser_.symbol_table.scopes())) == depth + 3
+
+    mocker.patch('log.error')
+    parser_ = parser.Parser(io.StringIO(program.replace('a = a - 1;', 'a = a - ;')), recover=True)
+    ast = parser_.parse_program()
+    assert ast is not None
+    log.error.assert_called_once()
+    assert parser_.current_scope == '.', "Scopes should be closed"
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import io
+
+import pytest
+
+from string_table import StringTable
+from lexer import Lexer, TokenID
+import parser
+
+
+@pytest.fixture()
+def string_table() -> StringTable:
+    return StringTable()
+
+
+def test_intern(string_table: StringTable):
+    assert string_table.intern('a') == 0
+    assert string_table.intern('b') == 1
+    assert string_table.intern('a') == 0
+    assert string_table[1] == 'b'
+    assert len(string_table) == 2
+    assert (string_table.lookups, string_table.hits) == (3, 1)
+    assert string_table.stats() == 'string table: 2 strings (2 chars), 3 lookups, 1 hits (33.3%)'
+
+
+def test_find_does_not_intern(string_table: StringTable):
+    assert string_table.find('a') is None
+    assert len(string_table) == 0
+    string_table.intern('a')
+    assert string_table.find('a') == 0
+
+
+@pytest.mark.parametrize('engine', ['char', 'regex'])
+def test_lexer_interns_identifiers(string_table: StringTable, engine):
+    lex = Lexer(io.StringIO('var abc = abc + b var'), engine=engine, string_table=string_table)
+    tokens = [lex.get_token() for _ in range(8)]
+    assert tokens[-1] == TokenID.EOF
+    assert [tok.name_id for tok in tokens] == [0, 1, None, 1, None, 2, 0, None]
+    assert tokens[1].value is tokens[3].value
+    assert string_table.strings == ['var', 'abc', 'b']
+
+
+def test_parser_shares_the_string_table():
+    parser_ = parser.Parser(io.StringIO('var a: int32; var b: int8;'))
+    ast = parser_.parse_program()
+    names = [sentence.var for sentence in ast.sentences]
+    assert [parser_.string_table[name.name_id] for name in names] == ['a', 'b']
+    main_scope = parser_.symbol_table.root.children['S0']
+    assert main_scope.symbols[names[0].name_id] is parser_.symbol_table.resolve_symbol('int32')
@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 
+import random
+
 import pytest
 
 from symbol_table import SymbolTable
-from lexer import Token, TokenID
+from lexer import Token, TokenID, LineIndex
 import ast_
 import log
 
@@ -38,7 +40,7 @@ def test_pop_scope(symbol_table: SymbolTable):
 
 def test_duplicated_name(symbol_table: SymbolTable, mocker):
     mocker.patch('log.error')
-    token = Token(TokenID.ID, 1, 1, 'int8')
+    token = Token(TokenID.ID, 0, 'int8', LineIndex('int8'))
     symbol_table.declare_symbol(token, ast_.SignedIntType(token))
     log.error.assert_not_called()
     symbol_table.declare_symbol(token, ast_.SignedIntType(token))
@@ -46,15 +48,249 @@ def test_duplicated_name(symbol_table: SymbolTable, mocker):
 
 
 def test_resolve_symbol(symbol_table: SymbolTable):
-    token = Token(TokenID.ID, 0, 0, 'char')
+    token = Token(TokenID.ID, 0, 'char')
     char_type = ast_.PrimitiveScalarTypeAST(token, 'char')
     symbol_table.declare_symbol(token, char_type)
     assert symbol_table.resolve_symbol('char') == char_type
 
     symbol_table.push_scope('local')
-    token = Token(TokenID.ID, 0, 0, 'str')
+    token = Token(TokenID.ID, 0, 'str')
     str_type = ast_.PrimitiveScalarTypeAST(token, 'str')
     symbol_table.declare_symbol(token, str_type)
     assert symbol_table.resolve_symbol('str') == str_type
     assert symbol_table.resolve_symbol('char') == char_type
     assert not symbol_table.resolve_symbol('unknown')
+
+
+def test_scope_tree(symbol_table: SymbolTable):
+    symbol_table.push_scope('scope1')
+    scope1 = symbol_table.scope
+    symbol_table.push_scope('scope2')
+    assert symbol_table.scope.parent is scope1
+    assert symbol_table.scope.depth == symbol_table.scope_depth == 2
+    assert symbol_table.scope.mangled_name('$') == '$scope1$scope2$'
+    symbol_table.pop_scope()
+    symbol_table.pop_scope()
+    symbol_table.push_scope('scope1')
+    assert symbol_table.scope is scope1, "Scopes are entered again by name"
+    assert [x.mangled_name() for x in symbol_table.scopes()] == ['.', '.scope1.', '.scope1.scope2.']
+
+
+def test_release(symbol_table: SymbolTable):
+    symbol_table.push_scope('main')
+    mark = symbol_table.mark()
+    token = Token(TokenID.ID, 0, 'a')
+    symbol_table.declare_symbol(token, ast_.SignedIntType(Token(TokenID.ID, 0, 'int8')))
+    symbol_table.push_scope('local')
+    symbol_table.declare_symbol(token, ast_.SignedIntType(Token(TokenID.ID, 0, 'int32')))
+    assert symbol_table.resolve_symbol('a').name == 'int32'
+    symbol_table.pop_scope()
+    assert symbol_table.resolve_symbol('a').name == 'int8'
+
+    symbol_table.release(mark)
+    assert symbol_table.symbol_count == 1
+    assert [x.mangled_name() for x in symbol_table.scopes()] == ['.', '.main.']
+    assert symbol_table.declared == [(symbol_table.scope, symbol_table.string_table.find('a'))]
+
+
+def test_resolution_cache(symbol_table: SymbolTable):
+    token = Token(TokenID.ID, 0, 'a')
+    outer_type = ast_.SignedIntType(Token(TokenID.ID, 0, 'int8'))
+    symbol_table.declare_symbol(token, outer_type)
+    symbol_table.push_scope('scope1')
+    scope1 = symbol_table.scope
+    symbol_table.push_scope('scope2')
+    assert symbol_table.resolve_symbol('a') is outer_type
+    assert (symbol_table.hits, symbol_table.misses) == (0, 1)
+    assert symbol_table.resolve_symbol('a') is outer_type
+    assert (symbol_table.hits, symbol_table.misses) == (1, 1)
+    symbol_table.pop_scope()
+    assert symbol_table.resolve_symbol('a') is outer_type, "Cached by the scopes walked through"
+    assert (symbol_table.hits, symbol_table.misses) == (2, 1)
+
+    # A declaration shadowing the cached symbol is seen from the scope and the nested ones entered again
+    symbol_table.push_scope('sibling')
+    assert symbol_table.resolve_symbol('a') is outer_type
+    symbol_table.pop_scope()
+    inner_type = ast_.SignedIntType(Token(TokenID.ID, 0, 'int32'))
+    symbol_table.declare_symbol(token, inner_type)
+    assert symbol_table.resolve_symbol('a') is inner_type
+    symbol_table.push_scope('scope2')
+    assert symbol_table.resolve_symbol('a') is inner_type
+    symbol_table.pop_scope()
+    assert symbol_table.stats() == \
+        'symbol table: 4 scopes, 2 symbols, 3 cached resolutions, 2 hits, 3 misses (40.0% hits)'
+
+    symbol_table.remove_symbols([(scope1, symbol_table.string_table.find('a'))])
+    symbol_table.push_scope('scope2')
+    assert symbol_table.resolve_symbol('a') is outer_type
+
+
+def test_remove_symbols_of_outer_scopes(symbol_table: SymbolTable):
+    int8 = ast_.SignedIntType(Token(TokenID.ID, 0, 'int8'))
+    symbol_table.push_scope('scope1')
+    symbol_table.declare_symbol(Token(TokenID.ID, 0, 'a'), int8)
+    scope1 = symbol_table.scope
+    symbol_table.push_scope('scope2')
+    assert symbol_table.resolve_symbol('a') is int8
+    removed = symbol_table.remove_symbols([(scope1, symbol_table.string_table.find('a'))])
+    assert symbol_table.resolve_symbol('a') is None, "The current scope should see the removal"
+
+    symbol_table.pop_scope()
+    symbol_table.declare_symbol(Token(TokenID.ID, 0, 'b'), int8)
+    assert symbol_table.resolve_symbol('a') is None, "Not lost by declaring afterwards"
+    symbol_table.push_scope('scope2')
+    symbol_table.add_symbols(removed)
+    assert symbol_table.resolve_symbol('a') is int8
+    symbol_table.pop_scope()
+    assert symbol_table.symbol_count == 2
+
+
+def test_snapshots(symbol_table: SymbolTable):
+    int8 = ast_.SignedIntType(Token(TokenID.ID, 0, 'int8'))
+    int32 = ast_.SignedIntType(Token(TokenID.ID, 0, 'int32'))
+    symbol_table.push_scope('main')
+    symbol_table.declare_symbol(Token(TokenID.ID, 0, 'a'), int8)
+    snapshot = symbol_table.snapshot()
+
+    symbol_table.declare_symbol(Token(TokenID.ID, 0, 'b'), int8)
+    symbol_table.push_scope('local')
+    symbol_table.declare_symbol(Token(TokenID.ID, 0, 'a'), int32)
+    later = symbol_table.snapshot()
+    assert symbol_table.resolve_symbol('a') is int32 and symbol_table.resolve_symbol('b') is int8
+
+    symbol_table.restore(snapshot)
+    assert symbol_table.current_scope == '.main.'
+    assert symbol_table.resolve_symbol('a') is int8
+    assert symbol_table.resolve_symbol('b') is None, "Declared after the snapshot"
+    symbol_table.declare_symbol(Token(TokenID.ID, 0, 'c'), int32)  # Into the snapshot
+
+    symbol_table.restore(later)
+    assert symbol_table.current_scope == '.main.local.'
+    assert symbol_table.resolve_symbol('a') is int32 and symbol_table.resolve_symbol('b') is int8
+    assert symbol_table.resolve_symbol('c') is None, "Versions should be kept intact"
+    symbol_table.restore(snapshot)
+    assert symbol_table.resolve_symbol('c') is None
+
+
+def test_snapshots_of_nested_scopes(symbol_table: SymbolTable):
+    int8 = ast_.SignedIntType(Token(TokenID.ID, 0, 'int8'))
+    symbol_table.push_scope('main')
+    symbol_table.push_scope('old')
+    symbol_table.declare_symbol(Token(TokenID.ID, 0, 'a'), int8)
+    symbol_table.pop_scope()
+    snapshot = symbol_table.snapshot()
+
+    for name in ('old', 'new'):
+        symbol_table.push_scope(name)
+        symbol_table.declare_symbol(Token(TokenID.ID, 0, 'b'), int8)
+        symbol_table.pop_scope()
+
+    symbol_table.restore(snapshot)
+    symbol_table.push_scope('old')
+    assert symbol_table.resolve_symbol('a') is int8
+    assert symbol_table.resolve_symbol('b') is None, "Declared after the snapshot"
+    symbol_table.pop_scope()
+    symbol_table.push_scope('new')
+    assert symbol_table.resolve_symbol('b') is None, "Entered after the snapshot"
+    symbol_table.pop_scope()
+
+    assert sorted(x.mangled_name() for x in symbol_table.scopes()) == ['.', '.main.', '.main.new.', '.main.old.']
+    assert symbol_table.symbol_count == 2, "Entering 'new' from the snapshot made a new latest version of it"
+
+
+def test_scopes_entered_again_after_restore(symbol_table: SymbolTable):
+    int8 = ast_.SignedIntType(Token(TokenID.ID, 0, 'int8'))
+    symbol_table.push_scope('f')
+    snapshot = symbol_table.snapshot()
+    symbol_table.restore(snapshot)
+    symbol_table.declare_symbol(Token(TokenID.ID, 0, 'x'), int8)
+    symbol_table.pop_scope()
+    symbol_table.push_scope('f')
+    assert symbol_table.resolve_symbol('x') is int8, "Declared since the snapshot was restored"
+
+    symbol_table.pop_scope()
+    symbol_table.push_scope('g')
+    symbol_table.declare_symbol(Token(TokenID.ID, 0, 'y'), int8)
+    symbol_table.pop_scope()
+    later = symbol_table.snapshot()
+    symbol_table.restore(later)
+    symbol_table.push_scope('g')
+    assert symbol_table.resolve_symbol('y') is int8, "Seen by a snapshot taken after the restore"
+
+    symbol_table.restore(snapshot)
+    symbol_table.pop_scope()
+    symbol_table.push_scope('f')
+    assert symbol_table.resolve_symbol('x') is None, "Declared after restoring the snapshot the last time"
+    symbol_table.pop_scope()
+    symbol_table.push_scope('g')
+    assert symbol_table.resolve_symbol('y') is None
+
+
+def test_snapshots_random_operations(symbol_table: SymbolTable):
+    """ Compares the symbol table with a model of it: a dict of the symbols of every scope, by its path
+    """
+    rnd = random.Random(0)
+    model = {(): {}}
+    path = ()
+    snapshots = []
+    for i in range(5000):
+        operation = rnd.choice(['push', 'push', 'pop', 'declare', 'declare', 'snapshot', 'restore', 'resolve'])
+        if operation == 'push':
+            path += (rnd.choice('fgh'),)
+            symbol_table.push_scope(path[-1])
+            model.setdefault(path, {})
+        elif operation == 'pop' and path:
+            symbol_table.pop_scope()
+            path = path[:-1]
+        elif operation == 'declare':
+            name = rnd.choice('xyz')
+            if name not in model[path]:
+                model[path][name] = ast_.SignedIntType(Token(TokenID.ID, 0, 'int8'))
+                assert symbol_table.declare_symbol(Token(TokenID.ID, 0, name), model[path][name])
+        elif operation == 'snapshot':
+            snapshots.append((symbol_table.snapshot(), {k: dict(v) for k, v in model.items()}, path))
+        elif operation == 'restore' and snapshots:
+            snapshot, model, path = rnd.choice(snapshots)
+            model = {k: dict(v) for k, v in model.items()}
+            symbol_table.restore(snapshot)
+        elif operation == 'resolve':
+            for name in 'xyz':
+                scopes = (model.get(path[:k], {}) for k in range(len(path), -1, -1))
+                expected = next((x[name] for x in scopes if name in x), None)
+                assert symbol_table.resolve_symbol(name) is expected, "Operation {}".format(i)
+
+
+def test_snapshots_share_symbols(symbol_table: SymbolTable):
+    symbol_table.push_scope('main')
+    int8 = ast_.SignedIntType(Token(TokenID.ID, 0, 'int8'))
+    snapshots = []
+    for i in range(1000):
+        symbol_table.declare_symbol(Token(TokenID.ID, 0, 'v{}'.format(i)), int8)
+        snapshots.append(symbol_table.snapshot())
+
+    assert len({id(x.symbols) for x in snapshots}) < 100
+    assert max(len(x.recent) for x in snapshots) <= 32
+    for i in (0, 500, 999):
+        symbol_table.restore(snapshots[i])
+        assert symbol_table.resolve_symbol('v{}'.format(i)) is int8
+        assert symbol_table.resolve_symbol('v{}'.format(i + 1)) is None
+
+
+def test_snapshots_of_snapshots_restored(symbol_table: SymbolTable):
+    int8 = ast_.SignedIntType(Token(TokenID.ID, 0, 'int8'))
+    symbol_table.push_scope('main')
+    first = snapshot = symbol_table.snapshot()
+    for i in range(5000):
+        symbol_table.restore(snapshot)
+        symbol_table.push_scope('f')
+        symbol_table.declare_symbol(Token(TokenID.ID, 0, 'v{}'.format(i)), int8)
+        symbol_table.pop_scope()
+        snapshot = symbol_table.snapshot()
+
+    assert len(snapshot.nested) + len(snapshot.recent_nested) == 1, "Only the versions entered from it"
+    symbol_table.push_scope('f')
+    assert symbol_table.resolve_symbol('v4999') is int8 and symbol_table.resolve_symbol('v0') is int8
+    symbol_table.restore(first)
+    symbol_table.push_scope('f')
+    assert symbol_table.resolve_symbol('v0') is None
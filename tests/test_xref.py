@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import io
+
+import pytest
+
+import parser
+import xref
+from xref import SymbolKind
+
+
+def index_of(text: str, **kwargs) -> xref.XrefIndex:
+    parser_ = parser.Parser(io.StringIO(text), **kwargs)
+    program = parser_.parse_program()
+    assert program is not None
+    return xref.build_index(program, parser_.string_table)
+
+
+def symbol(index: xref.XrefIndex, text: str, needle: str) -> int:
+    """ The symbol used or defined by the first token of needle in text
+    """
+    result = index.symbol_at(text.index(needle))
+    assert result is not None
+    return result
+
+
+def lines(text: str, offsets) -> list:
+    return [text.count('\n', 0, offset) + 1 for offset in offsets]
+
+
+@pytest.fixture
+def index(program_text, lazy_bodies) -> xref.XrefIndex:
+    return index_of(program_text, lazy_bodies=lazy_bodies)
+
+
+def test_xref_definitions(index: xref.XrefIndex, program_text):
+    assert [(index.name(i), index.kind(i)) for i in range(len(index))] == [
+        ('f', SymbolKind.FUNCTION), ('g', SymbolKind.FUNCTION), ('a', SymbolKind.VARIABLE),
+        ('x', SymbolKind.PARAMETER), ('y', SymbolKind.VARIABLE),
+        ('x', SymbolKind.PARAMETER), ('a', SymbolKind.VARIABLE),
+    ]
+    assert lines(program_text, index.definitions) == [2, 7, 1, 2, 3, 7, 9]
+
+
+def test_xref_references(index: xref.XrefIndex, program_text):
+    global_a = symbol(index, program_text, 'a: int32;\nfn')
+    local_a = symbol(index, program_text, 'a: int32;\n        a')
+    assert lines(program_text, index.references(global_a)) == [4, 12, 14]
+    assert lines(program_text, index.references(local_a)) == [10]
+    g = symbol(index, program_text, 'g(x')
+    assert lines(program_text, index.references(g)) == [4, 14], "Functions can be called before their definition"
+    assert index.reference_count(g) == 2
+    assert lines(program_text, index.occurrences(g)) == [4, 7, 14]
+    assert symbol(index, program_text, 'g(b)') == g
+    assert index.symbol_at(program_text.index('b)')) is None, "Unresolved"
+
+    assert index.symbol_at(program_text.index('int32')) is None
+    assert index.symbol_at(program_text.index(': int32')) is None, "Past the end of 'a'"
+    assert index.symbol_at(0) is None and index.symbol_at(4) == global_a
+
+
+def test_xref_unresolved():
+    text = 'var a: int32;\na = b + h(a);\n'
+    index = index_of(text)
+    assert len(index) == 1
+    assert index.references(0).tolist() == [text.index('a ='), text.index('a);')]
+
+
+def test_xref_serialization(index: xref.XrefIndex):
+    loaded = xref.XrefIndex.loads(index.dumps())
+    for name in ('strings', 'names', 'kinds', 'definitions', 'use_starts', 'uses', 'positions', 'position_symbols'):
+        assert getattr(loaded, name) == getattr(index, name)
+
+    empty = xref.XrefIndex.loads(xref.XrefIndex().dumps())
+    assert len(empty) == 0 and empty.symbol_at(0) is None
+    with pytest.raises(ValueError):
+        xref.XrefIndex.loads(b'XREF' + bytes(16))
+
+
+def test_xref_after_reparse(program_text):
+    parser_ = parser.Parser(io.StringIO(program_text))
+    program = parser_.parse_program()
+    text = '// An extra line\n' + program_text
+    program = parser_.reparse(program, program_text, text)
+    index = xref.build_index(program, parser_.string_table)
+    assert index.positions == index_of(text).positions, "Offsets should be the ones in the edited text"
+
+
+def test_xref_deep_nesting():
+    depth = 10000
+    text = 'var a: int32;\n' + 'if a > 0 {\n' * depth + 'a = a + 1;\n' + '}' * depth + '\n'
+    index = index_of(text)
+    assert index.reference_count(0) == depth + 2
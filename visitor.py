@@ -1,12 +1,12 @@
 # -*- coding: utf-8 -*-
 
-from typing import TextIO, Optional
+from typing import Iterable, TextIO, Optional
 
 import ast_
 
 
 class Visitor:
-    def __init__(self, output_buffer: TextIO, root: ast_.AST):
+    def __init__(self, output_buffer: TextIO, root: Optional[ast_.AST] = None):
         self.root = root
         self.outbuffer = output_buffer
         self.outbuffer.write('#include <stdlib.h>\n\nint main() ')
@@ -19,9 +19,14 @@ class Visitor:
         getattr(self, 'visit_{}'.format(root.__class__.__name__))(root)
 
     def visit_BlockAST(self, ast: ast_.BlockAST):
+        self.visit_sentences(ast.sentences)
+
+    def visit_sentences(self, sentences: Iterable[ast_.AST]):
+        """ Emits a block with the given sentences, as they come (i.e. from Parser.iter_program())
+        """
         self._output('{\n')
         self.indent_level += 1
-        for sentence in ast.sentences:
+        for sentence in sentences:
             self._indent()
             self.visit(sentence)
             self._output_line('')
@@ -46,6 +51,9 @@ class Visitor:
         }
         self._output('{} {};'.format(types[ast.type_.name], ast.var.var_name))
 
+    def visit_ErrorAST(self, ast: ast_.ErrorAST):
+        self._output(ast.emit())  # The output is incomplete anyway
+
     def visit_NumericLiteralAST(self, ast: ast_.NumericLiteralAST):
         self._output('{}'.format(ast.value))
 
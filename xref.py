@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+import struct
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Dict, List, Optional
+
+import ast_
+import binder
+from binder import SymbolKind
+from lexer import Token
+from string_table import StringTable
+
+
+class XrefIndex:
+    """ Cross reference index of a source: the definition and all the uses of every symbol declared in it
+    (variables, parameters and functions), stored as a struct of arrays. Symbols are numbered in declaration
+    order (functions first in their blocks), and their uses are kept sorted and grouped by symbol, so the uses
+    of symbol i are uses[use_starts[i]:use_starts[i + 1]]. Locations are source offsets.
+    """
+    MAGIC = b'XREF'
+    VERSION = 1
+    _HEADER = struct.Struct('<4sIIII')  # Magic, version, number of symbols, of uses, and size of the names
+
+    def __init__(self):
+        self.strings: List[str] = []  # Distinct names of the symbols
+        self.names = array('i')  # Index in strings of the name of every symbol
+        self.kinds = array('b')  # SymbolKind of every symbol
+        self.definitions = array('i')  # Offset of the defining token of every symbol
+        self.use_starts = array('i', [0])  # Start of the uses of every symbol in uses (and the end of the last)
+        self.uses = array('i')  # Offsets of the uses of the symbols
+        self.positions = array('i')  # Offsets of every definition and use, sorted
+        self.position_symbols = array('i')  # Symbol defined or used at each position
+
+    def __len__(self) -> int:
+        """ Number of symbols
+        """
+        return len(self.names)
+
+    def name(self, symbol: int) -> str:
+        return self.strings[self.names[symbol]]
+
+    def kind(self, symbol: int) -> SymbolKind:
+        return SymbolKind(self.kinds[symbol])
+
+    def definition(self, symbol: int) -> int:
+        """ Offset of the defining token of the symbol
+        """
+        return self.definitions[symbol]
+
+    def reference_count(self, symbol: int) -> int:
+        return self.use_starts[symbol + 1] - self.use_starts[symbol]
+
+    def references(self, symbol: int) -> array:
+        """ Offsets of the uses of the symbol, sorted
+        """
+        return self.uses[self.use_starts[symbol]:self.use_starts[symbol + 1]]
+
+    def occurrences(self, symbol: int) -> List[int]:
+        """ Offsets of the definition and the uses of the symbol, sorted (i.e. the tokens to change
+        when renaming it)
+        """
+        result = self.references(symbol).tolist()
+        result.insert(bisect_right(result, self.definitions[symbol]), self.definitions[symbol])
+        return result
+
+    def symbol_at(self, offset: int) -> Optional[int]:
+        """ Returns the symbol defined or used by the token at the given offset, if any
+        """
+        i = bisect_right(self.positions, offset) - 1
+        if i < 0:
+            return None
+
+        symbol = self.position_symbols[i]
+        return symbol if offset < self.positions[i] + len(self.name(symbol)) else None
+
+    def dumps(self) -> bytes:
+        """ Serializes the index (see loads())
+        """
+        names = '\n'.join(self.strings).encode('utf-8')
+        return b''.join([
+            self._HEADER.pack(self.MAGIC, self.VERSION, len(self.names), len(self.uses), len(names)), names,
+            self.names.tobytes(), self.kinds.tobytes(), self.definitions.tobytes(), self.use_starts.tobytes(),
+            self.uses.tobytes(), self.positions.tobytes(), self.position_symbols.tobytes()
+        ])
+
+    @classmethod
+    def loads(cls, data: bytes) -> 'XrefIndex':
+        """ Returns the index serialized in data by dumps() (on a machine with the same byte order)
+        """
+        magic, version, symbols, uses, names_size = cls._HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError('Not a cross reference index (version {})'.format(cls.VERSION))
+
+        result = cls()
+        offset = cls._HEADER.size
+        result.strings = data[offset:offset + names_size].decode('utf-8').split('\n') if names_size else []
+        offset += names_size
+        result.use_starts = array('i')
+        for values, count in ((result.names, symbols), (result.kinds, symbols), (result.definitions, symbols),
+                              (result.use_starts, symbols + 1), (result.uses, uses),
+                              (result.positions, symbols + uses), (result.position_symbols, symbols + uses)):
+            size = count * values.itemsize
+            values.frombytes(data[offset:offset + size])
+            offset += size
+
+        return result
+
+
+def _offset(token: Token) -> int:
+    """ Offset of the token in the current source (tokens kept by a reparse still have their old one)
+    """
+    return token.line_index.current_offset(token.offset) if token.line_index is not None else token.offset
+
+
+def build_index(program: ast_.BlockAST, string_table: StringTable) -> XrefIndex:
+    """ Returns the cross reference index of the program parsed (the string table is the one
+    of the parser), binding it first (see binder.bind()). Function bodies parsed lazily are parsed now.
+    """
+    bindings = binder.bind(program, string_table)
+    index = XrefIndex()
+    string_ids: Dict[str, int] = {}  # Name -> index in index.strings
+    symbols: Dict[ast_.IdAST, int] = {}  # Declaration -> symbol id
+    for id_, kind in zip(bindings.declarations, bindings.kinds):
+        name = id_.token.value
+        string_id = string_ids.get(name)
+        if string_id is None:
+            string_id = string_ids[name] = len(index.strings)
+            index.strings.append(name)
+
+        symbols[id_] = len(symbols)
+        index.names.append(string_id)
+        index.kinds.append(kind)
+        index.definitions.append(_offset(id_.token))
+
+    # Uses come in source order, so they are grouped by symbol keeping it (a counting sort)
+    use_symbols = [symbols[id_.decl] for id_ in bindings.uses]
+    use_offsets = [_offset(id_.token) for id_ in bindings.uses]
+    counts = [0] * len(symbols)
+    for symbol in use_symbols:
+        counts[symbol] += 1
+    index.use_starts.extend(accumulate(counts))
+    uses = [0] * len(use_symbols)
+    next_use = index.use_starts.tolist()
+    for offset, symbol in zip(use_offsets, use_symbols):
+        uses[next_use[symbol]] = offset
+        next_use[symbol] += 1
+    index.uses.extend(uses)
+
+    # Sorted by index, not as (offset, symbol) pairs, which is much cheaper for the garbage collector
+    positions = index.definitions.tolist() + use_offsets
+    position_symbols = list(range(len(symbols))) + use_symbols
+    order = sorted(range(len(positions)), key=positions.__getitem__)
+    index.positions.extend(positions[i] for i in order)
+    index.position_symbols.extend(position_symbols[i] for i in order)
+    return index